@@ -1,3 +1,4 @@
+import os
 import sys
 import time
 
@@ -55,6 +56,10 @@ MODEL_LISTS = [
     'lw_human_pose'
 ]
 
+# the person dimension is zero padded to these sizes, then to multiples of
+# the largest one
+PERSON_BUCKETS = (1, 2, 4, 8)
+
 # ======================
 # Arguemnt Parser Config
 # ======================
@@ -72,6 +77,17 @@ parser.add_argument(
     '--img-save', action='store_true',
     help='Instead of show video, save image file.'
 )
+parser.add_argument(
+    '--stride', default=4, type=int,
+    help='Real-time mode: run the action recognition every STRIDE frames, '
+         'and reuse the latest result in between. The result is always '
+         'updated when a tracked person appears or disappears.'
+)
+parser.add_argument(
+    '--batch_size', default=4, type=int,
+    help='Offline mode: maximum number of video files recognized at once. '
+         'Only the skeleton sequences of the same length are batched.'
+)
 args = update_parser(parser)
 
 if args.arch == "pyopenpose":
@@ -138,10 +154,78 @@ def postprocess(output, feature, num_person):
     return voting_label_name, video_label_name, output, intensity
 
 
+def person_bucket(num_person):
+    for bucket in PERSON_BUCKETS:
+        if num_person <= bucket:
+            return bucket
+    return -(-num_person // PERSON_BUCKETS[-1]) * PERSON_BUCKETS[-1]
+
+
+class ActionRecognizer:
+    """
+    ST-GCN inference on skeleton sequences.
+
+    Sequences are zero padded to PERSON_BUCKETS persons and gathered in a
+    reused input array, so the input shape is only set when the bucket
+    changes. The outputs are cropped back to the actual persons.
+    In real-time mode (`update`), the network is only run every `stride`
+    frames, or when the traces of the tracker change.
+    """
+
+    def __init__(self, net, stride=1):
+        self.net = net
+        self.stride = max(stride, 1)
+        self.input_data = None
+        self.num_frame = 0
+        self.generation = None
+        self.result = None
+
+    def predict(self, data_list):
+        """
+        data_list: list of (3, T, V, M) skeleton sequences of the same
+        length T, M may differ. Returns the (output, feature) of each
+        sequence.
+        """
+        num_person = person_bucket(max(data.shape[3] for data in data_list))
+        _, num_frame, num_joint, _ = data_list[0].shape
+        shape = (len(data_list), 3, num_frame, num_joint, num_person)
+        if self.input_data is None or self.input_data.shape != shape:
+            self.input_data = np.zeros(shape, dtype=np.float32)
+            self.net.set_input_shape(shape)
+        else:
+            self.input_data[:] = 0
+        for i, data in enumerate(data_list):
+            self.input_data[i, :, :, :, :data.shape[3]] = data
+
+        output, feature = self.net.predict({
+            'data': self.input_data
+        })
+
+        results = []
+        for i, data in enumerate(data_list):
+            m = data.shape[3]
+            results.append((output[i, ..., :m], feature[i, ..., :m]))
+        return results
+
+    def update(self, data, generation):
+        """
+        Real-time inference on the latest window, returns the postprocess
+        result, which may be the one of a previous frame as long as the
+        tracker `generation` (its trace slots) is the same.
+        """
+        if self.result is None or generation != self.generation or \
+                self.num_frame % self.stride == 0:
+            output, feature = self.predict([data])[0]
+            self.result = postprocess(output, feature, data.shape[3])
+            self.generation = generation
+        self.num_frame += 1
+        return self.result
+
+
 # ======================
 # Main functions
 # ======================
-def recognize_offline(input, pose, net):
+def estimate_poses(input, pose):
     capture = cv2.VideoCapture(input)
     video_length = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
     pose_tracker = naive_pose_tracker(data_frame=video_length)
@@ -192,60 +276,91 @@ def recognize_offline(input, pose, net):
         frame_index += 1
         print('Pose estimation ({}/{}).'.format(frame_index, video_length))
 
-    # action recognition
     data = pose_tracker.get_skeleton_sequence()
-    input_data = np.expand_dims(data, 0)
-    net.set_input_shape(input_data.shape)
-    outputs = net.predict({
-        'data': input_data
-    })
-    output, feature = outputs
-    output = output[0]
-    feature = feature[0]
-
-    # classification result for each person of the latest frame
-    _, _, _, num_person = data.shape
-    out = postprocess(output, feature, num_person)
-    voting_label_name, video_label_name, output, intensity = out
-    return data, voting_label_name, video_label_name, output, intensity, frames
+    if data is not None:
+        data = data.copy()
+    return data, frames
+
+
+def recognize_offline(inputs, pose, recognizer):
+    sequences = []
+    for input in inputs:
+        data, frames = estimate_poses(input, pose)
+        if data is None:
+            print('No person found in {}.'.format(input))
+            continue
+        sequences.append((input, data, frames))
+
+    # action recognition, by batches of files of the same length
+    lengths = sorted(set(data.shape[1] for _, data, _ in sequences))
+    batches = []
+    for length in lengths:
+        index = [
+            i for i, (_, data, _) in enumerate(sequences)
+            if data.shape[1] == length
+        ]
+        for i in range(0, len(index), max(args.batch_size, 1)):
+            batches.append(index[i:i + max(args.batch_size, 1)])
+
+    results = [None] * len(sequences)
+    for batch in batches:
+        outputs = recognizer.predict([sequences[i][1] for i in batch])
+        for i, (output, feature) in zip(batch, outputs):
+            input, data, frames = sequences[i]
+            # classification result for each person of the latest frame
+            _, _, _, num_person = data.shape
+            out = postprocess(output, feature, num_person)
+            voting_label_name, video_label_name, output, intensity = out
+            results[i] = (
+                input, data, voting_label_name, video_label_name, output,
+                intensity, frames
+            )
+    return results
+
+
+def recognize_from_file(inputs, pose, net):
+    recognizer = ActionRecognizer(net)
 
-
-def recognize_from_file(input, pose, net):
     # inference
     print('Start inference...')
     if args.benchmark:
         print('BENCHMARK mode')
         for i in range(5):
             start = int(round(time.time() * 1000))
-            result = recognize_offline(input, pose, net)
+            results = recognize_offline(inputs, pose, recognizer)
             end = int(round(time.time() * 1000))
             print(f'\tailia processing time {end - start} ms')
     else:
-        result = recognize_offline(input, pose, net)
+        results = recognize_offline(inputs, pose, recognizer)
 
     print('Script finished successfully.')
 
-    # render the video
-    data, voting_label_name, video_label_name, output, intensity, frames = result
-    images = render_video(
-        data, voting_label_name,
-        video_label_name, intensity, frames)
+    for result in results:
+        # render the video
+        input, data, voting_label_name, video_label_name, output, intensity, frames = result
+        print('{}: {}'.format(input, voting_label_name))
+        images = render_video(
+            data, voting_label_name,
+            video_label_name, intensity, frames)
 
-    # visualize
-    for i, image in enumerate(images):
-        image = image.astype(np.uint8)
-        if args.img_save:
-            cv2.imwrite("output/ST-GCN-%08d.png" % i, image)
-        else:
-            cv2.imshow("ST-GCN", image)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+        # visualize
+        prefix = 'ST-GCN' if len(results) == 1 else \
+            os.path.splitext(os.path.basename(input))[0]
+        for i, image in enumerate(images):
+            image = image.astype(np.uint8)
+            if args.img_save:
+                cv2.imwrite("output/%s-%08d.png" % (prefix, i), image)
+            else:
+                cv2.imshow("ST-GCN", image)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
 
 
 def recognize_realtime(video, pose, net):
     capture = get_capture(args.video)
 
     pose_tracker = naive_pose_tracker()
+    recognizer = ActionRecognizer(net, stride=args.stride)
 
     # start recognition
     start_time = time.time()
@@ -299,18 +414,7 @@ def recognize_realtime(video, pose, net):
 
         # action recognition
         data = pose_tracker.get_skeleton_sequence()
-        input_data = np.expand_dims(data, 0)
-        net.set_input_shape(input_data.shape)
-        outputs = net.predict({
-            'data': input_data
-        })
-        output, feature = outputs
-        output = output[0]
-        feature = feature[0]
-
-        # classification result for each person of the latest frame
-        _, _, _, num_person = data.shape
-        out = postprocess(output, feature, num_person)
+        out = recognizer.update(data, pose_tracker.generation)
         voting_label_name, video_label_name, output, intensity = out
 
         # visualization
@@ -12,6 +12,12 @@ class naive_pose_tracker():
     """ A simple tracker for recording person poses and generating skeleton sequences.
     For actual occasion, I recommend you to implement a robuster tracker.
     Pull-requests are welcomed.
+
+    Traces are kept in a ring buffer of the latest `data_frame` frames, so
+    the cost of an update does not grow with the session length. Each frame
+    is written twice, at t and t + data_frame, so that the latest window is
+    always a contiguous slice of the buffer. `generation` changes whenever
+    traces are added or removed, i.e. when the trace slots change meaning.
     """
 
     def __init__(self, data_frame=128, num_joint=18, max_frame_dis=np.inf):
@@ -19,7 +25,13 @@ class naive_pose_tracker():
         self.num_joint = num_joint
         self.max_frame_dis = max_frame_dis
         self.latest_frame = 0
-        self.trace_info = list()
+
+        # (channel, 2 * frame, joint, trace slot)
+        self.buffer = np.zeros((3, 2 * data_frame, num_joint, 0))
+        self.num_trace = 0
+        self.last_pose = np.zeros((0, num_joint, 3))
+        self.trace_latest_frame = np.zeros(0, dtype=np.int64)
+        self.generation = 0
 
     def update(self, multi_pose, current_frame):
         # multi_pose.shape: (num_person, num_joint, 3)
@@ -30,89 +42,104 @@ class naive_pose_tracker():
         if len(multi_pose.shape) != 3:
             return
 
-        score_order = (-multi_pose[:, :, 2].sum(axis=1)).argsort(axis=0)
-        for p in multi_pose[score_order]:
-
-            # match existing traces
-            matching_trace = None
-            matching_dis = None
-            for trace_index, (trace, latest_frame) in enumerate(self.trace_info):
-                # trace.shape: (num_frame, num_joint, 3)
-                if current_frame <= latest_frame:
-                    continue
-                mean_dis, is_close = self.get_dis(trace, p)
-                if is_close:
-                    if matching_trace is None:
-                        matching_trace = trace_index
-                        matching_dis = mean_dis
-                    elif matching_dis > mean_dis:
-                        matching_trace = trace_index
-                        matching_dis = mean_dis
-
-            # update trace information
-            if matching_trace is not None:
-                trace, latest_frame = self.trace_info[matching_trace]
-
-                # padding zero if the trace is fractured
-                pad_mode = 'interp' if latest_frame == self.latest_frame else 'zero'
-                pad = current_frame - latest_frame - 1
-                new_trace = self.cat_pose(trace, p, pad, pad_mode)
-                self.trace_info[matching_trace] = (new_trace, current_frame)
+        self._clear_frames(self.latest_frame + 1, current_frame + 1)
 
-            else:
-                new_trace = np.array([p])
-                self.trace_info.append((new_trace, current_frame))
+        score_order = (-multi_pose[:, :, 2].sum(axis=1)).argsort(axis=0)
+        multi_pose = multi_pose[score_order]
+        mean_dis, is_close = self.get_dis(multi_pose)
+
+        # match existing traces, most confident poses first
+        available = self.trace_latest_frame[:self.num_trace] < current_frame
+        for p, pose in enumerate(multi_pose):
+            candidates = np.nonzero(available & is_close[p])[0]
+            if len(candidates) == 0:
+                self._add_trace(pose, current_frame)
+                continue
+            trace_index = candidates[np.argmin(mean_dis[p, candidates])]
+            available[trace_index] = False
+
+            # padding zero if the trace is fractured
+            latest_frame = self.trace_latest_frame[trace_index]
+            pad = current_frame - latest_frame - 1
+            if pad > 0 and latest_frame == self.latest_frame:
+                # only the frames still in the buffer are interpolated
+                last_pose = self.last_pose[trace_index].copy()
+                for k in range(max(pad - self.data_frame, 0), pad):
+                    c = (k + 1) / (pad + 1)
+                    self._write(trace_index, latest_frame + 1 + k, (1 - c) * last_pose + c * pose)
+            self._write(trace_index, current_frame, pose)
 
         self.latest_frame = current_frame
 
     def get_skeleton_sequence(self):
+        """
+        Skeleton sequence of the latest `data_frame` frames, as a
+        (3, data_frame, num_joint, num_trace) view of the ring buffer.
+        The view is only valid until the next update.
+        """
 
         # remove old traces
-        valid_trace_index = []
-        for trace_index, (trace, latest_frame) in enumerate(self.trace_info):
-            if self.latest_frame - latest_frame < self.data_frame:
-                valid_trace_index.append(trace_index)
-        self.trace_info = [self.trace_info[v] for v in valid_trace_index]
-
-        num_trace = len(self.trace_info)
-        if num_trace == 0:
+        valid = self.latest_frame - self.trace_latest_frame[:self.num_trace] < self.data_frame
+        if not valid.all():
+            keep = np.nonzero(valid)[0]
+            n = len(keep)
+            self.buffer[..., :n] = self.buffer[..., keep]
+            self.last_pose[:n] = self.last_pose[keep]
+            self.trace_latest_frame[:n] = self.trace_latest_frame[keep]
+            self.num_trace = n
+            self.generation += 1
+
+        if self.num_trace == 0:
             return None
 
-        data = np.zeros((3, self.data_frame, self.num_joint, num_trace))
-        for trace_index, (trace, latest_frame) in enumerate(self.trace_info):
-            end = self.data_frame - (self.latest_frame - latest_frame)
-            d = trace[-end:]
-            beg = end - len(d)
-            data[:, beg:end, :, trace_index] = d.transpose((2, 0, 1))
-
-        return data
-
-    # concatenate pose to a trace
-    def cat_pose(self, trace, pose, pad, pad_mode):
-        # trace.shape: (num_frame, num_joint, 3)
-        num_joint = pose.shape[0]
-        num_channel = pose.shape[1]
-        if pad != 0:
-            if pad_mode == 'zero':
-                trace = np.concatenate(
-                    (trace, np.zeros((pad, num_joint, 3))), 0)
-            elif pad_mode == 'interp':
-                last_pose = trace[-1]
-                coeff = [(p + 1) / (pad + 1) for p in range(pad)]
-                interp_pose = [(1 - c) * last_pose + c * pose for c in coeff]
-                trace = np.concatenate((trace, interp_pose), 0)
-        new_trace = np.concatenate((trace, [pose]), 0)
-        return new_trace
-
-    # calculate the distance between a existing trace and the input pose
-
-    def get_dis(self, trace, pose):
-        last_pose_xy = trace[-1, :, 0:2]
-        curr_pose_xy = pose[:, 0:2]
-
-        mean_dis = ((((last_pose_xy - curr_pose_xy) ** 2).sum(1)) ** 0.5).mean()
-        wh = last_pose_xy.max(0) - last_pose_xy.min(0)
-        scale = (wh[0] * wh[1]) ** 0.5 + 0.0001
+        start = (self.latest_frame + 1) % self.data_frame
+        return self.buffer[:, start:start + self.data_frame, :, :self.num_trace]
+
+    def _write(self, trace_index, frame, pose):
+        t = frame % self.data_frame
+        self.buffer[:, t, :, trace_index] = pose.T
+        self.buffer[:, t + self.data_frame, :, trace_index] = pose.T
+        self.last_pose[trace_index] = pose
+        self.trace_latest_frame[trace_index] = frame
+
+    def _clear_frames(self, begin, end):
+        # zero the frames [begin, end) of all traces, before they are written
+        if end - begin >= self.data_frame:
+            self.buffer[:] = 0
+            return
+        t = np.arange(begin, end) % self.data_frame
+        self.buffer[:, t] = 0
+        self.buffer[:, t + self.data_frame] = 0
+
+    def _add_trace(self, pose, current_frame):
+        capacity = self.buffer.shape[3]
+        if self.num_trace == capacity:
+            # grow the trace slots, amortized
+            capacity = max(2 * capacity, 4)
+            buffer = np.zeros(self.buffer.shape[:3] + (capacity,))
+            buffer[..., :self.num_trace] = self.buffer[..., :self.num_trace]
+            self.buffer = buffer
+            self.last_pose = np.concatenate(
+                (self.last_pose, np.zeros((capacity - len(self.last_pose), self.num_joint, 3))), 0)
+            self.trace_latest_frame = np.concatenate(
+                (self.trace_latest_frame, np.zeros(capacity - len(self.trace_latest_frame), dtype=np.int64)))
+
+        trace_index = self.num_trace
+        self.buffer[..., trace_index] = 0
+        self.num_trace += 1
+        self.generation += 1
+        self._write(trace_index, current_frame, pose)
+
+    # calculate the distance between the existing traces and the input poses
+
+    def get_dis(self, multi_pose):
+        # mean_dis, is_close: (num_person, num_trace)
+        last_pose_xy = self.last_pose[:self.num_trace, :, 0:2]
+        curr_pose_xy = multi_pose[:, :, 0:2]
+
+        mean_dis = ((((last_pose_xy[None] - curr_pose_xy[:, None]) ** 2).sum(3)) ** 0.5).mean(2)
+        wh = last_pose_xy.max(1) - last_pose_xy.min(1)
+        scale = (wh[:, 0] * wh[:, 1]) ** 0.5 + 0.0001
         is_close = mean_dis < scale * self.max_frame_dis
         return mean_dis, is_close
 
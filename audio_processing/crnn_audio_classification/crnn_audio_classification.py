@@ -10,7 +10,8 @@ import ailia
 sys.path.append('../../util')
 from utils import get_base_parser, update_parser  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
-from crnn_audio_classification_util import MelspectrogramStretch  # noqa: E402
+from crnn_audio_classification_util import MelspectrogramStretch, StreamingMelspectrogram, num_frames  # noqa: E402
+from crnn_audio_classification_util import SAMPLE_RATE, HOP_LENGTH  # noqa: E402
 
 
 # logger
@@ -18,9 +19,6 @@ from logging import getLogger   # noqa: E402
 logger = getLogger(__name__)
 
 
-# TODO: FIXME: crnn_audio_classification_util uses torchaudio & torch...
-
-
 # ======================
 # PARAMETERS
 # ======================
@@ -33,27 +31,68 @@ WEIGHT_PATH = "crnn_audio_classification.onnx"
 MODEL_PATH = "crnn_audio_classification.onnx.prototxt"
 REMOTE_PATH = "https://storage.googleapis.com/ailia-models/crnn_audio_classification/"
 
+# spectrogram lengths of a batch are padded to a multiple of this
+BUCKET_FRAMES = 32
+
+# streaming mode
+STREAM_WINDOW_SEC = 4.0
+STREAM_HOP_SEC = 1.0
+SMOOTHING = 0.5
+EVENT_THRESHOLD = 0.5
+READ_BLOCK = 4096
+
 
 # ======================
 # Arguemnt Parser Config
 # ======================
 parser = get_base_parser(
     'CRNN Audio Classification.', WAVE_PATH, None, input_ftype='audio')
+parser.add_argument(
+    '--batch_size', type=int, default=16,
+    help=('Number of files classified by one predict. Files of similar '
+          'length are grouped together.')
+)
+parser.add_argument(
+    '--stream', action='store_true',
+    help=('Classify overlapping windows of a long recording continuously, '
+          'and log the sound events found.')
+)
+parser.add_argument(
+    '-V', action='store_true',
+    help='Classify the microphone input continuously (requires pyaudio).'
+)
+parser.add_argument(
+    '--window_sec', type=float, default=STREAM_WINDOW_SEC,
+    help='Length of the classified window in streaming mode.'
+)
+parser.add_argument(
+    '--hop_sec', type=float, default=STREAM_HOP_SEC,
+    help='Interval between two classifications in streaming mode.'
+)
 args = update_parser(parser)
 
 
 # ======================
 # Postprocess
 # ======================
+CLASSES = [
+    'air_conditioner', 'car_horn', 'children_playing', 'dog_bark',
+    'drilling', 'engine_idling', 'gun_shot', 'jackhammer', 'siren',
+    'street_music'
+]
+
+
 def postprocess(x):
-    classes = [
-        'air_conditioner', 'car_horn', 'children_playing', 'dog_bark',
-        'drilling', 'engine_idling', 'gun_shot', 'jackhammer', 'siren',
-        'street_music'
-    ]
     out = np.exp(x)
     max_ind = out.argmax().item()
-    return classes[max_ind], out[:, max_ind].item()
+    return CLASSES[max_ind], out[:, max_ind].item()
+
+
+def postprocess_batch(x):
+    out = np.exp(x)
+    max_inds = out.argmax(axis=1)
+    confs = out[np.arange(len(out)), max_inds]
+    return [(CLASSES[i], c.item()) for i, c in zip(max_inds, confs)]
 
 
 # ======================
@@ -74,30 +113,228 @@ def crnn(data, session):
     return label, conf
 
 
+def crnn_batch(datas, session, max_length=None):
+    spec = MelspectrogramStretch()
+    xt, lengths = spec.forward_batch(datas, max_length)
+
+    # inference
+    session.set_input_blob_shape(xt.shape, session.find_blob_index_by_name('data'))
+    session.set_input_blob_shape(lengths.shape, session.find_blob_index_by_name('lengths'))
+    results = session.predict({"data": xt, "lengths": lengths.astype(np.float64)})
+
+    return postprocess_batch(results[0])
+
+
+def make_buckets(paths, batch_size):
+    """
+    Group file paths of similar spectrogram length, padded length per group.
+    A file alone in its group is not padded.
+    """
+    n_frames = np.array([num_frames(sf.info(p).frames) for p in paths])
+    order = np.argsort(n_frames, kind='stable')
+    buckets = []
+    for i in range(0, len(order), batch_size):
+        idx = order[i:i + batch_size]
+        max_length = n_frames[idx].max()
+        if len(idx) > 1:
+            max_length = -(-max_length // BUCKET_FRAMES) * BUCKET_FRAMES
+        buckets.append((idx, max_length))
+    return buckets
+
+
+def classify_batch(session):
+    paths = args.input
+    results = [None] * len(paths)
+
+    start = int(round(time.time() * 1000))
+    for idx, max_length in make_buckets(paths, args.batch_size):
+        datas = [sf.read(paths[i]) for i in idx]
+        for i, res in zip(idx, crnn_batch(datas, session, max_length)):
+            results[i] = res
+    end = int(round(time.time() * 1000))
+    logger.info("\tailia processing time {} ms".format(end-start))
+
+    for path, (label, conf) in zip(paths, results):
+        logger.info('=' * 80)
+        logger.info(f'input: {path}')
+        logger.info(label)
+        logger.info(conf)
+
+
+class StreamingClassifier(object):
+    """
+    Sliding window classification of a sample stream.
+
+    Every `hop_sec` of new samples, the latest `window_sec` of mel frames
+    are classified, once per feed even if the new samples span several
+    hops. Class probabilities are smoothed over time with an
+    exponential moving average, and an event is reported when the smoothed
+    top class changes.
+    """
+
+    def __init__(self, session, window_sec=STREAM_WINDOW_SEC,
+                 hop_sec=STREAM_HOP_SEC, smoothing=SMOOTHING,
+                 threshold=EVENT_THRESHOLD):
+        self.session = session
+        window_frames = max(int(window_sec * SAMPLE_RATE / HOP_LENGTH), 2)
+        self.hop_frames = max(int(hop_sec * SAMPLE_RATE / HOP_LENGTH), 1)
+        self.spec = StreamingMelspectrogram(window_frames)
+        self.smoothing = smoothing
+        self.threshold = threshold
+
+        self.input_shape = None
+        self.frames = 0
+        self.pending = 0
+        self.probs = None
+        self.event = None
+
+    def feed(self, sig):
+        """
+        Consume new samples, returns the list of finished events
+        as (start_sec, end_sec, label, mean_conf).
+        """
+        n = self.spec.feed(sig)
+        self.frames += n
+        self.pending += n
+
+        # the window is classified once, however many hops it moved by
+        events = []
+        if self.pending >= self.hop_frames and self.spec.count > 1:
+            self.pending %= self.hop_frames
+            events.extend(self.classify())
+        return events
+
+    def flush(self):
+        """Finish the event in progress at the end of the stream"""
+        events = []
+        if self.event is not None:
+            label, start, confs = self.event
+            events.append((start, self.time(), label, float(np.mean(confs))))
+            self.event = None
+        return events
+
+    def time(self):
+        return self.frames * HOP_LENGTH / SAMPLE_RATE
+
+    def classify(self):
+        xt = self.spec.window()
+        if xt.shape != self.input_shape:
+            self.input_shape = xt.shape
+            self.session.set_input_blob_shape(
+                xt.shape, self.session.find_blob_index_by_name('data'))
+        lengths_np = np.array([xt.shape[3]], np.float64)
+        results = self.session.predict({"data": xt, "lengths": lengths_np})
+
+        probs = np.exp(results[0][0])
+        if self.probs is None:
+            self.probs = probs
+        else:
+            self.probs = self.smoothing * self.probs + \
+                (1 - self.smoothing) * probs
+        # postprocess expects log probabilities
+        label, conf = postprocess(np.log(self.probs[np.newaxis]))
+        if conf < self.threshold:
+            label = None
+
+        events = []
+        if self.event is not None and self.event[0] != label:
+            events.extend(self.flush())
+        if label is not None:
+            if self.event is None:
+                self.event = (label, self.time(), [])
+            self.event[2].append(conf)
+        return events
+
+
+def log_event(event):
+    start, end, label, conf = event
+    logger.info(f'[{start:8.2f} - {end:8.2f}] {label} ({conf:.4f})')
+
+
+def classify_stream(session):
+    for input_data_path in args.input:
+        logger.info('=' * 80)
+        logger.info(f'input: {input_data_path}')
+        classifier = StreamingClassifier(
+            session, window_sec=args.window_sec, hop_sec=args.hop_sec)
+
+        start = int(round(time.time() * 1000))
+        for block in sf.blocks(input_data_path, blocksize=READ_BLOCK,
+                               dtype='float32', always_2d=True):
+            for event in classifier.feed(block.mean(axis=1)):
+                log_event(event)
+        for event in classifier.flush():
+            log_event(event)
+        end = int(round(time.time() * 1000))
+        logger.info("\tailia processing time {} ms".format(end-start))
+
+
+def classify_microphone(session):
+    import pyaudio
+
+    classifier = StreamingClassifier(
+        session, window_sec=args.window_sec, hop_sec=args.hop_sec)
+    p = pyaudio.PyAudio()
+    stream = p.open(
+        format=pyaudio.paFloat32,
+        channels=1,
+        rate=SAMPLE_RATE,
+        input=True,
+        frames_per_buffer=READ_BLOCK,
+    )
+    logger.info('Listening... (Ctrl+C to stop)')
+    try:
+        while True:
+            data = np.frombuffer(stream.read(READ_BLOCK), dtype=np.float32)
+            for event in classifier.feed(data):
+                log_event(event)
+    except KeyboardInterrupt:
+        for event in classifier.flush():
+            log_event(event)
+    finally:
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+
+
 def main():
     # model files check and download
     check_and_download_models(WEIGHT_PATH, MODEL_PATH, REMOTE_PATH)
 
+    # create instance
+    session = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
+
+    if args.V:
+        classify_microphone(session)
+        logger.info('Script finished successfully.')
+        return
+
+    if args.stream:
+        logger.info('Start inference...')
+        classify_stream(session)
+        logger.info('Script finished successfully.')
+        return
+
+    if not args.benchmark:
+        logger.info('Start inference...')
+        classify_batch(session)
+        logger.info('Script finished successfully.')
+        return
+
     # load audio
     for input_data_path in args.input:
         logger.info('=' * 80)
         logger.info(f'input: {input_data_path}')
         data = sf.read(input_data_path)
 
-        # create instance
-        session = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
-
         # inference
         logger.info('Start inference...')
-        if args.benchmark:
-            logger.info('BENCHMARK mode')
-            for c in range(5):
-                start = int(round(time.time() * 1000))
-                label, conf = crnn(data, session)
-                end = int(round(time.time() * 1000))
-                logger.info("\tailia processing time {} ms".format(end-start))
-        else:
+        logger.info('BENCHMARK mode')
+        for c in range(5):
+            start = int(round(time.time() * 1000))
             label, conf = crnn(data, session)
+            end = int(round(time.time() * 1000))
+            logger.info("\tailia processing time {} ms".format(end-start))
 
         logger.info(label)
         logger.info(conf)
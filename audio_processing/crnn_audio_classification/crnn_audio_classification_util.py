@@ -1,68 +1,170 @@
-import torch
-from torchaudio.transforms import Spectrogram, MelSpectrogram, ComplexNorm
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+SAMPLE_RATE = 44100
+NUM_MELS = 128
+FFT_LENGTH = 2048
+HOP_LENGTH = FFT_LENGTH // 2
+
+
+@lru_cache(maxsize=None)
+def mel_filterbank(n_freqs, f_min, f_max, n_mels, sample_rate):
+    """
+    Triangular HTK mel filterbank, same as torchaudio create_fb_matrix.
+    Returns (n_freqs, n_mels) float32 matrix, cached by its parameters.
+    """
+    all_freqs = np.linspace(0, sample_rate // 2, n_freqs)
+    m_min = 2595.0 * np.log10(1.0 + (f_min / 700.0))
+    m_max = 2595.0 * np.log10(1.0 + (f_max / 700.0))
+    m_pts = np.linspace(m_min, m_max, n_mels + 2)
+    f_pts = 700.0 * (10 ** (m_pts / 2595.0) - 1.0)
+
+    f_diff = f_pts[1:] - f_pts[:-1]
+    slopes = f_pts[np.newaxis, :] - all_freqs[:, np.newaxis]
+    down_slopes = (-1.0 * slopes[:, :-2]) / f_diff[:-1]
+    up_slopes = slopes[:, 2:] / f_diff[1:]
+    fb = np.maximum(0.0, np.minimum(down_slopes, up_slopes))
+    return fb.astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def hann_window(n):
+    # periodic hann, same as torch.hann_window
+    return (0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n) / n)).astype(np.float32)
+
+
+def num_frames(n_samples, hop_length=HOP_LENGTH):
+    """Number of STFT frames of a centered STFT"""
+    return n_samples // hop_length + 1
+
+
+def power_spectrogram(sig, n_fft=FFT_LENGTH, hop_length=HOP_LENGTH):
+    """
+    Centered (reflect padded) STFT power of a 1-D signal.
+    Returns (n_fft//2+1, frames) float32.
+    """
+    sig = np.pad(sig.astype(np.float32), n_fft // 2, mode='reflect')
+    n = num_frames(len(sig) - 2 * (n_fft // 2), hop_length)
+    frames = as_strided(
+        sig, shape=(n, n_fft),
+        strides=(sig.strides[0] * hop_length, sig.strides[0]),
+        writeable=False,
+    )
+    spec = np.fft.rfft(frames * hann_window(n_fft), axis=1)
+    return (spec.real ** 2 + spec.imag ** 2).astype(np.float32).T
 
 
 class MelspectrogramStretch(object):
 
     def __init__(self):
-        sample_rate = 44100
-        num_mels = 128
-        fft_length = 2048
-        hop_length = fft_length//2
-
-        self.stft = Spectrogram(
-            n_fft=fft_length,
-            win_length=fft_length,
-            hop_length=None,
-            pad=0,
-            power=None,
-            normalized=False
+        self.sample_rate = SAMPLE_RATE
+        self.num_mels = NUM_MELS
+        self.fft_length = FFT_LENGTH
+        self.hop_length = HOP_LENGTH
+
+        self.fb = mel_filterbank(
+            self.fft_length // 2 + 1, 0.0, float(self.sample_rate // 2),
+            self.num_mels, self.sample_rate,
         )
 
-        self.mst = MelSpectrogram(
-            sample_rate=sample_rate,
-            n_fft=fft_length,
-            hop_length=hop_length,
-            n_mels=num_mels
-        )
+    def melspectrogram(self, sig):
+        """Normalized mel spectrogram (n_mels, frames) of a 1-D signal"""
+        x = self.fb.T @ power_spectrogram(sig, self.fft_length, self.hop_length)
 
-        # Normalization (pot spec processing)
-        self.complex_norm = ComplexNorm(power=2.)
+        # Normalize melspectrogram
+        # Independent mean, std per batch
+        mean = x.mean()
+        std = x.std(ddof=1)
+        return (x - mean) / std
 
     def forward(self, data):
         tsf = AudioTransforms()
-        sig_t, sr, _ = tsf.apply(data, None)
-
-        length = torch.tensor(sig_t.size(0))
-        sr = torch.tensor(sr)
-        data = [d.unsqueeze(0).to("cpu") for d in [sig_t, length, sr]]
-
-        # x-> (batch, time, channel)
-        x, lengths, _ = data  # unpacking seqs, lengths and srs
-        # x-> (batch, channel, time)
-        xt = x.float().transpose(1, 2)
-        # xt -> (batch, channel, freq, time)
-        x = self.stft(xt)
-        # x -> (fft_length//2+1,bins,channel)
-
-        # print(x.shape)  #torch.Size([1, 1, 1025, 173, 2])
-        x = self.complex_norm(x)
-        # print(x.shape)  #torch.Size([1, 1, 1025, 173])
-        x = self.mst.mel_scale(x)
-        # print(x.shape)  #torch.Size([1, 1, 128, 173])
-
-        # Normalize melspectrogram
-        # Independent mean, std per batch
-        non_batch_inds = [1, 2, 3]
-        mean = x.mean(non_batch_inds, keepdim=True)
-        std = x.std(non_batch_inds, keepdim=True)
-        x = (x - mean)/std
+        sig, sr, _ = tsf.apply(data, None)
 
-        x = x.to('cpu').detach().numpy().copy()
+        # x -> (batch, channel, freq, time)
+        x = self.melspectrogram(sig)[np.newaxis, np.newaxis]
 
         lengths = [x.shape[3]]
         return x, lengths
 
+    def forward_batch(self, datas, max_length=None):
+        """
+        Mel spectrograms of several signals, zero padded to a common length.
+
+        Returns (batch, 1, n_mels, max_length) float32 and the number of
+        valid frames of each signal.
+        """
+        specs = []
+        for data in datas:
+            sig, _, _ = AudioTransforms().apply(data, None)
+            specs.append(self.melspectrogram(sig))
+
+        lengths = np.array([s.shape[1] for s in specs])
+        if max_length is None:
+            max_length = lengths.max()
+        x = np.zeros((len(specs), 1, self.num_mels, max_length), np.float32)
+        for i, s in enumerate(specs):
+            x[i, 0, :, :s.shape[1]] = s
+        return x, lengths
+
+
+class StreamingMelspectrogram(object):
+    """
+    Incremental mel spectrogram of a sample stream.
+
+    Samples which do not complete a frame yet are carried over, and only
+    the STFT frames completed by new samples are computed. The latest
+    `window_frames` mel frames are kept in a ring buffer.
+    """
+
+    def __init__(self, window_frames):
+        self.spec = MelspectrogramStretch()
+        self.window_frames = window_frames
+        self.mel = np.zeros((self.spec.num_mels, window_frames), np.float32)
+        self.pos = 0
+        self.count = 0
+        self.carry = np.zeros(0, np.float32)
+
+    def feed(self, sig):
+        """Append samples, returns the number of new mel frames"""
+        n_fft, hop = self.spec.fft_length, self.spec.hop_length
+        sig = np.concatenate([self.carry, sig.astype(np.float32)])
+        n = (len(sig) - n_fft) // hop + 1 if len(sig) >= n_fft else 0
+        if n == 0:
+            self.carry = sig
+            return 0
+        self.carry = sig[n * hop:]
+
+        frames = as_strided(
+            sig, shape=(n, n_fft),
+            strides=(sig.strides[0] * hop, sig.strides[0]),
+            writeable=False,
+        )
+        spec = np.fft.rfft(frames * hann_window(n_fft), axis=1)
+        power = (spec.real ** 2 + spec.imag ** 2).astype(np.float32)
+        mel = (power @ self.spec.fb).T
+
+        # keep only the frames which fit in the ring buffer
+        mel = mel[:, -self.window_frames:]
+        idx = (self.pos + np.arange(mel.shape[1])) % self.window_frames
+        self.mel[:, idx] = mel
+        self.pos = (self.pos + mel.shape[1]) % self.window_frames
+        self.count = min(self.count + n, self.window_frames)
+        return n
+
+    def window(self):
+        """Normalized (1, 1, n_mels, frames) spectrogram of the latest frames"""
+        if self.count < self.window_frames:
+            x = self.mel[:, :self.count]
+        else:
+            x = np.concatenate(
+                [self.mel[:, self.pos:], self.mel[:, :self.pos]], axis=1)
+        x = (x - x.mean()) / x.std(ddof=1)
+        return x[np.newaxis, np.newaxis]
+
 
 class AudioTransforms(object):
 
@@ -72,7 +174,5 @@ class AudioTransforms(object):
 
         # avg
         new_audio = audio.mean(axis=1) if audio.ndim > 1 else audio
-        new_audio = new_audio[:, None]
-        new_audio = torch.from_numpy(new_audio)
 
         return new_audio, sr, target
@@ -1,16 +1,19 @@
 import sys
 import time
+from math import gcd
 
 import librosa
 import pyaudio
 import numpy as np
-import torch
+import soundfile as sf
+from scipy import signal
 
 import ailia
 # import original moduls
 sys.path.append('../../util')
 from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
+from ctc_utils import greedy_decode, prefix_beam_search, NgramLanguageModel  # noqa: E402
 
 # logger
 from logging import getLogger   # noqa: E402
@@ -47,7 +50,6 @@ ALPHA = 1.97
 BETA = 4.36
 CUTOFF_TOP_N = 40
 CUTOFF_PROB = 1.0
-NUM_PROCESS = 1
 BEAM_WIDTH = 128
 
 # pyaudio
@@ -57,6 +59,12 @@ CHANNELS = 1
 RECODING_SAMPING_RATE = 48000
 THRESHOLD = 0.02
 
+# streaming mode
+STREAM_WINDOW_SEC = 8.0
+STREAM_OVERLAP_SEC = 2.0
+VAD_SILENCE_SEC = 0.5
+READ_BLOCK_SEC = 1.0
+
 # ======================
 # Arguemnt Parser Config
 # ======================
@@ -84,6 +92,13 @@ parser.add_argument(
     default=DEFAULT_MODEL, choices=MODEL_LISTS,
     help='model lists: ' + ' | '.join(MODEL_LISTS)
 )
+parser.add_argument(
+    '--stream',
+    action='store_true',
+    help=('streaming mode: the audio is segmented by a VAD and recognized '
+          'in overlapping windows with greedy decoding, memory use does not '
+          'depend on the input length'),
+)
 args = update_parser(parser)
 
 
@@ -151,44 +166,222 @@ def record_microphone_input():
     p.terminate()
 
     wav = np.array(frames)
-    return librosa.resample(wav, RECODING_SAMPING_RATE, SAMPLING_RATE)
+    return resample(wav, RECODING_SAMPING_RATE)
+
+
+def resample(wav, sr):
+    if sr == SAMPLING_RATE:
+        return wav
+    g = gcd(sr, SAMPLING_RATE)
+    return signal.resample_poly(wav, SAMPLING_RATE // g, sr // g)
+
+
+class StreamResampler:
+    """
+    Block by block resampling to SAMPLING_RATE, with the same output as
+    `resample` of the whole signal, so the block boundaries add no filter
+    transients. The input samples still in the filter support of the next
+    outputs are kept, and an output is only emitted once all its input
+    samples are known.
+    """
+
+    def __init__(self, sr):
+        g = gcd(sr, SAMPLING_RATE)
+        self.up, self.down = SAMPLING_RATE // g, sr // g
+        # half length of the resample_poly filter, in input samples
+        self.margin = 10 * max(self.up, self.down) // self.up + 2
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.start = 0  # input index of buffer[0], a multiple of down
+        self.count = 0  # number of output samples emitted
+        self.total = 0  # number of input samples fed
+
+    def _emit(self, last):
+        offset = self.start * self.up // self.down
+        y = signal.resample_poly(self.buffer, self.up, self.down)
+        y = y[self.count - offset:last - offset]
+        self.count = last
+
+        # drop the input samples out of the support of the next outputs
+        need = self.count * self.down // self.up - self.margin
+        drop = max(need - self.start, 0) // self.down * self.down
+        self.buffer = self.buffer[drop:]
+        self.start += drop
+        return y.astype(np.float32)
+
+    def feed(self, wav):
+        if self.up == self.down:
+            return wav.astype(np.float32)
+        self.buffer = np.concatenate([self.buffer, wav.astype(np.float32)])
+        self.total += len(wav)
+        last = (self.total - 1 - self.margin) * self.up // self.down + 1
+        if last <= self.count:
+            return np.zeros(0, dtype=np.float32)
+        return self._emit(last)
+
+    def flush(self):
+        last = -(-self.total * self.up // self.down)
+        if self.up == self.down or last <= self.count:
+            return np.zeros(0, dtype=np.float32)
+        return self._emit(last)
+
+
+def read_wav_blocks(path, block_sec=READ_BLOCK_SEC):
+    """Yield the mono 16kHz signal of a wav file block by block"""
+    sr = sf.info(path).samplerate
+    resampler = StreamResampler(sr)
+    blocksize = int(sr * block_sec)
+    for block in sf.blocks(path, blocksize=blocksize, dtype='float32',
+                           always_2d=True):
+        yield resampler.feed(block.mean(axis=1))
+    yield resampler.flush()
 
 
 def decode(sequence, size=None):
-    sequence = np.argmax(sequence, -1)
-
-    text = ''
-    size = int(size[0]) if size is not None else len(sequence)
-    for i in range(size):
-        char = int_to_char[sequence[i]]
-        if char != int_to_char[BRANK_LABEL_INDEX]:
-            if i != 0 and char == int_to_char[sequence[i - 1]]:
-                pass
-            else:
-                text += char
-    return text.lower()
+    return greedy_decode(sequence, LABELS, lengths=size)[0].lower()
+
+
+def create_beam_decoder():
+    lm = NgramLanguageModel(LM_PATH)
+
+    def decoder(sequence, size=None):
+        return prefix_beam_search(
+            sequence, LABELS, lengths=size, beam_width=BEAM_WIDTH,
+            blank=BRANK_LABEL_INDEX, lm=lm, alpha=ALPHA, beta=BETA,
+            cutoff_top_n=CUTOFF_TOP_N, cutoff_prob=CUTOFF_PROB,
+        )[0]
+    return decoder
 
 
 def beam_ctc_decode(sequence, size=None, decoder=None):
     """
     Decode using language model
     """
-    out, scores, offsets, seq_len = decoder.decode(sequence, size)
-
-    # results = []
-    for b, batch in enumerate(out):
-        utterances = []
-        for p, utt in enumerate(batch):
-            size = seq_len[0][p]
-            if size > 0:
-                transcript = ''.join(
-                    map(lambda x: int_to_char[x.item()], utt[0:size])
-                )
-            else:
-                transcript = ''
-        utterances.append(transcript)
+    return decoder(sequence, size)[0].lower()
 
-    return utterances[0].lower()
+
+class StreamingRecognizer:
+    """
+    Greedy CTC recognition of an unbounded 16kHz sample stream.
+
+    Samples are split into utterances by an energy VAD on 10ms frames.
+    Each utterance is recognized in windows of `window` seconds overlapping
+    by `overlap` seconds, using one network session. Only the labels of the
+    window center are committed, the overlap halves are decoded by the
+    neighbouring windows, and the CTC collapse state is carried over, so
+    the committed text is a stable prefix of the utterance.
+    """
+
+    def __init__(self, net, window=STREAM_WINDOW_SEC,
+                 overlap=STREAM_OVERLAP_SEC, silence=VAD_SILENCE_SEC,
+                 threshold=THRESHOLD):
+        self.net = net
+        self.window = int(window * SAMPLING_RATE) // HOP_LENGTH * HOP_LENGTH
+        self.keep = int(overlap * SAMPLING_RATE) // HOP_LENGTH * HOP_LENGTH
+        self.margin = self.keep // 2
+        self.max_silence = int(silence * SAMPLING_RATE) // HOP_LENGTH
+        self.threshold = threshold
+
+        self.buf = np.zeros(self.window, np.float32)
+        self.pending = np.zeros(0, np.float32)
+        self.input_shape = None
+        self.pos = 0
+        self.reset()
+
+    def reset(self):
+        self.buf_len = 0
+        self.first = True
+        self.in_speech = False
+        self.silence = 0
+        self.seg_start = 0
+        self.prev = BRANK_LABEL_INDEX
+        self.labels = []
+
+    @property
+    def partial(self):
+        """Stable text of the current utterance"""
+        return ''.join(int_to_char[c] for c in self.labels).lower()
+
+    def feed(self, wav):
+        """
+        Consume new samples, returns the list of finished utterances
+        as (start_sec, end_sec, text).
+        """
+        wav = np.concatenate([self.pending, wav.astype(np.float32)])
+        n = len(wav) // HOP_LENGTH * HOP_LENGTH
+        self.pending = wav[n:]
+        frames = wav[:n].reshape(-1, HOP_LENGTH)
+        loud = np.abs(frames).max(axis=1) > self.threshold
+
+        results = []
+        for frame, is_loud in zip(frames, loud):
+            if is_loud:
+                if not self.in_speech:
+                    self.in_speech = True
+                    self.seg_start = self.pos
+                self.silence = 0
+            elif self.in_speech:
+                self.silence += 1
+
+            if self.in_speech:
+                self.push(frame)
+            self.pos += HOP_LENGTH
+
+            if self.in_speech and self.silence > self.max_silence:
+                results.extend(self.finish())
+        return results
+
+    def flush(self):
+        """Finish the utterance in progress at the end of the stream"""
+        self.pending = np.zeros(0, np.float32)
+        return self.finish()
+
+    def push(self, frame):
+        self.buf[self.buf_len:self.buf_len + HOP_LENGTH] = frame
+        self.buf_len += HOP_LENGTH
+        if self.buf_len == self.window:
+            self.recognize_window(final=False)
+            self.buf[:self.keep] = self.buf[self.window - self.keep:]
+            self.buf_len = self.keep
+            self.first = False
+
+    def finish(self):
+        if self.buf_len > WIN_LENGTH:
+            self.recognize_window(final=True)
+        text = self.partial.strip()
+        start, end = self.seg_start, self.pos
+        self.reset()
+        if not text:
+            return []
+        return [(start / SAMPLING_RATE, end / SAMPLING_RATE, text)]
+
+    def recognize_window(self, final):
+        spectrogram = create_spectrogram(self.buf[:self.buf_len])
+        if spectrogram[0].shape != self.input_shape:
+            self.input_shape = spectrogram[0].shape
+            self.net.set_input_shape(self.input_shape)
+        preds_ailia, output_length = self.net.predict(spectrogram)
+
+        labels = np.argmax(preds_ailia[0, :int(output_length[0])], axis=-1)
+        scale = len(labels) / self.buf_len
+        start = 0 if self.first else int(round(self.margin * scale))
+        end = len(labels) if final else \
+            int(round((self.buf_len - self.margin) * scale))
+        labels = labels[start:end]
+        if len(labels) == 0:
+            return
+
+        # greedy CTC collapse, continued from the previous window
+        prev = np.concatenate([[self.prev], labels[:-1]])
+        keep = (labels != prev) & (labels != BRANK_LABEL_INDEX)
+        self.labels.extend(labels[keep].tolist())
+        self.prev = labels[-1]
+
+
+def write_segment(f, segment):
+    start, end, text = segment
+    logger.info(f'[{start:.2f} - {end:.2f}] {text}')
+    f.write(f'{start:.2f}\t{end:.2f}\t{text}\n')
+    f.flush()
 
 
 # ======================
@@ -196,22 +389,7 @@ def beam_ctc_decode(sequence, size=None, decoder=None):
 # ======================
 def wavfile_input_recognition():
     if args.beamdecode:
-        try:
-            from ctcdecode import CTCBeamDecoder
-        except ImportError:
-            raise ImportError("BeamCTCDecoder requires paddledecoder package.")
-
-        decoder = CTCBeamDecoder(
-            LABELS,
-            LM_PATH,
-            ALPHA,
-            BETA,
-            CUTOFF_TOP_N,
-            CUTOFF_PROB,
-            BEAM_WIDTH,
-            NUM_PROCESS,
-            BRANK_LABEL_INDEX,
-        )
+        decoder = create_beam_decoder()
 
     # net initialize
     net = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
@@ -236,11 +414,7 @@ def wavfile_input_recognition():
             preds_ailia, output_length = net.predict(spectrogram)
 
         if args.beamdecode:
-            text = beam_ctc_decode(
-                torch.from_numpy(preds_ailia),
-                torch.from_numpy(output_length),
-                decoder,
-            )
+            text = beam_ctc_decode(preds_ailia, output_length, decoder)
         else:
             text = decode(preds_ailia[0], output_length)
 
@@ -252,34 +426,73 @@ def wavfile_input_recognition():
     logger.info('Script finished successfully.')
 
 
+def stream_wavfile_recognition():
+    # net initialize
+    net = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
+
+    for soundf_path in args.input:
+        logger.info(soundf_path)
+        recognizer = StreamingRecognizer(net)
+
+        savepath = get_savepath(args.savepath, soundf_path, ext='.txt')
+        logger.info('Start inference...')
+        start = int(round(time.time() * 1000))
+        with open(savepath, 'w', encoding='utf-8') as f:
+            for block in read_wav_blocks(soundf_path):
+                for segment in recognizer.feed(block):
+                    write_segment(f, segment)
+            for segment in recognizer.flush():
+                write_segment(f, segment)
+        end = int(round(time.time() * 1000))
+        logger.info("\tailia processing time {} ms".format(end-start))
+        logger.info(f'Results saved at : {savepath}')
+    logger.info('Script finished successfully.')
+
+
 # ======================
 # microphone input mode
 # ======================
+def microphone_stream_recognition():
+    net = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
+    recognizer = StreamingRecognizer(net)
+
+    p = pyaudio.PyAudio()
+    stream = p.open(
+        format=FORMAT,
+        channels=CHANNELS,
+        rate=RECODING_SAMPING_RATE,
+        input=True,
+        frames_per_buffer=CHUNK,
+    )
+    logger.info("Please speak something")
+
+    resampler = StreamResampler(RECODING_SAMPING_RATE)
+    partial = ''
+    try:
+        while True:
+            data = np.frombuffer(stream.read(CHUNK), dtype=np.int16) / 32768.0
+            for _, _, text in recognizer.feed(resampler.feed(data)):
+                logger.info(f'predict sentence:\n{text}\n')
+            if recognizer.partial != partial:
+                partial = recognizer.partial
+                if partial:
+                    logger.info(f'... {partial}')
+    finally:
+        stream.stop_stream()
+        stream.close()
+        p.terminate()
+
+
 def microphone_input_recognition():
     if args.beamdecode:
-        try:
-            from ctcdecode import CTCBeamDecoder
-        except ImportError:
-            raise ImportError("BeamCTCDecoder requires paddledecoder package.")
-
-        decoder = CTCBeamDecoder(
-            LABELS,
-            LM_PATH,
-            ALPHA,
-            BETA,
-            CUTOFF_TOP_N,
-            CUTOFF_PROB,
-            BEAM_WIDTH,
-            NUM_PROCESS,
-            BRANK_LABEL_INDEX,
-        )
+        decoder = create_beam_decoder()
+
+    # net initialize
+    net = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
 
     while True:
         wav = record_microphone_input()
         spectrogram = create_spectrogram(wav)
-
-        # net initialize
-        net = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
         net.set_input_shape(spectrogram[0].shape)
 
         # inference
@@ -288,11 +501,7 @@ def microphone_input_recognition():
         preds_ailia, output_length = net.predict(spectrogram)
 
         if args.beamdecode:
-            text = beam_ctc_decode(
-                torch.from_numpy(preds_ailia),
-                torch.from_numpy(output_length),
-                decoder,
-            )
+            text = beam_ctc_decode(preds_ailia, output_length, decoder)
         else:
             text = decode(preds_ailia[0], output_length)
 
@@ -302,6 +511,10 @@ def microphone_input_recognition():
 
 def main():
     global WEIGHT_PATH, MODEL_PATH
+    if args.stream and args.beamdecode:
+        parser.error('--stream only supports greedy decoding, '
+                     'it can not be used with -d/--beamdecode')
+
     if args.arch != WEIGHT_PATH:
         WEIGHT_PATH = args.arch + '.onnx'
         MODEL_PATH = WEIGHT_PATH + '.prototxt'
@@ -312,11 +525,16 @@ def main():
     # microphone input mode
     if args.V:
         try:
-            microphone_input_recognition()
+            if args.stream:
+                microphone_stream_recognition()
+            else:
+                microphone_input_recognition()
         except KeyboardInterrupt:
             logger.info('script finished successfully.')
 
     # sound file input mode
+    elif args.stream:
+        stream_wavfile_recognition()
     else:
         wavfile_input_recognition()
 
@@ -1,11 +1,12 @@
 import time
 import sys
+import os
 import argparse
 
 import numpy as np
 
 import ailia  # noqa: E402
-from pytorch_dc_tts_utils import get_test_data, save_to_wav
+from pytorch_dc_tts_utils import get_test_data, text_normalize, save_to_wav, save_to_wav_batch
 
 # import original modules
 sys.path.append('../../util')
@@ -32,6 +33,11 @@ MODEL_PATH_SSRM = 'ssrn.onnx.prototxt'
 REMOTE_PATH_SSRM = 'https://storage.googleapis.com/ailia-models/pytorch-dc-tts/'
 
 MAX_T = 210
+BUCKET_N = 16
+SSRN_UPSAMPLE = 4
+
+VOCAB = "PE abcdefghijklmnopqrstuvwxyz'.?"  # P: Padding, E: EOS.
+EOS_ID = VOCAB.index('E')
 
 # ======================
 # Arguemnt Parser Config
@@ -44,6 +50,27 @@ parser.add_argument(
     '--input', '-i', metavar='TEXT', default=SENTENCE,
     help='input text'
 )
+parser.add_argument(
+    '--chunk', type=int, default=0,
+    help=('Text2Mel decodes into a preallocated mel buffer which grows by '
+          'this number of frames, so the input shape is only updated once '
+          'per chunk. Every step still runs the whole buffer, and the zero '
+          'frames of the chunk are extra work. 0 (default) reshapes the '
+          'input at every step (legacy mode).')
+)
+parser.add_argument(
+    '--input_list', metavar='TEXT_FILE', default=None,
+    help=('Batch mode. Text file with one sentence per line, the wav files '
+          'are saved in the --savepath directory.')
+)
+parser.add_argument(
+    '--batch_size', type=int, default=8,
+    help='Number of sentences decoded together in batch mode.'
+)
+parser.add_argument(
+    '--workers', type=int, default=os.cpu_count(),
+    help='Number of processes used for Griffin-Lim vocoding in batch mode.'
+)
 args = update_parser(parser, check_input_type=False)
 
 # ======================
@@ -64,24 +91,92 @@ def inference(net_t2m, net_ssrm, L, Y, zeros, A):
 
 
 def inference_by_text2mel(net_t2m, L, Y, zeros, A):
+    if args.chunk <= 0:
+        return inference_by_text2mel_legacy(net_t2m, L, Y, zeros, A)
+    Y, _ = inference_by_text2mel_chunked(net_t2m, L, args.chunk)
+    return Y
+
+
+def inference_by_text2mel_legacy(net_t2m, L, Y, zeros, A):
     for t in (range(MAX_T)):
         net_t2m.set_input_blob_shape(Y.shape, net_t2m.find_blob_index_by_name('input.2'))
         _, Y_t, A = net_t2m.predict({'input.1':L, 'input.2':Y})
 
         Y = np.concatenate([zeros, Y_t], 2)
         attention = np.argmax(A[0, :, -1], 0)
-        vocab = "PE abcdefghijklmnopqrstuvwxyz'.?"  # P: Padding, E: EOS.
-        if L[0, attention] == vocab.index('E'):  # EOS
+        if L[0, attention] == EOS_ID:  # EOS
             break
 
     return Y
 
 
+def inference_by_text2mel_chunked(net_t2m, L, chunk):
+    """Autoregressive Text2Mel decoding on a preallocated mel buffer.
+
+    AudioEnc / AudioDec only use causal convolutions and the attention is
+    computed independently for each mel frame, so zero frames appended after
+    the current position do not change the outputs up to that position.
+    The buffer is therefore fed at a capacity rounded up to `chunk` frames,
+    and the network input is reshaped once per chunk instead of per step.
+    Each step still runs the network on the whole buffer, so the decoding
+    cost is the same O(T^2) as the legacy loop.
+
+    L may hold a batch of sentences, decoding stops when all of them reached
+    EOS. Returns the mel buffer and the number of valid frames per sentence.
+    """
+    batch = L.shape[0]
+    net_t2m.set_input_blob_shape(L.shape, net_t2m.find_blob_index_by_name('input.1'))
+    blob_idx = net_t2m.find_blob_index_by_name('input.2')
+
+    # frame 0 is the all-zero <GO> frame, frame t + 1 is predicted at step t
+    Y = np.zeros((batch, 80, MAX_T + 1), np.float32)
+    lengths = np.full(batch, MAX_T + 1)
+    done = np.zeros(batch, bool)
+    cap = 0
+    for t in range(MAX_T):
+        if cap < t + 1:
+            cap = min(cap + chunk, MAX_T)
+            net_t2m.set_input_blob_shape((batch, 80, cap), blob_idx)
+        _, Y_t, A = net_t2m.predict(
+            {'input.1': L, 'input.2': np.ascontiguousarray(Y[:, :, :cap])}
+        )
+
+        Y[:, :, t + 1] = Y_t[:, :, t]
+        attention = np.argmax(A[:, :, t], axis=1)
+        eos = (L[np.arange(batch), attention] == EOS_ID) & ~done  # EOS
+        lengths[eos] = t + 2
+        done |= eos
+        if done.all():
+            break
+
+    return Y[:, :, :lengths.max()], lengths
+
+
 def inference_by_ssr(net_ssrm, Y):
+    net_ssrm.set_input_blob_shape(Y.shape, net_ssrm.find_blob_index_by_name('input.1'))
     _, Z = net_ssrm.predict({'input.1':Y})
     return Z
 
 
+def make_buckets(sentences, batch_size):
+    """Group sentence indices by normalized length, padded length per group."""
+    n_chars = [len(text_normalize(s).strip()) + 1 for s in sentences]
+    order = np.argsort(n_chars, kind='stable')
+    buckets = []
+    for i in range(0, len(order), batch_size):
+        idx = order[i:i + batch_size]
+        max_n = int(np.ceil(max(n_chars[j] for j in idx) / BUCKET_N)) * BUCKET_N
+        buckets.append((idx, max_n))
+    return buckets
+
+
+def inference_batch(net_t2m, net_ssrm, sentences, max_n):
+    L = get_test_data(sentences, max_n)
+    Y, lengths = inference_by_text2mel_chunked(net_t2m, L, max(args.chunk, 1))
+    Z = inference_by_ssr(net_ssrm, Y)
+    return [Z[b, :, :lengths[b] * SSRN_UPSAMPLE].T for b in range(len(sentences))]
+
+
 def generate_sentence(sentence):
     # prepare data
     L, Y, zeros, A = preprocess(sentence)
@@ -109,12 +204,51 @@ def generate_sentence(sentence):
     logger.info('Script finished successfully.')
 
 
+def generate_sentences(list_path):
+    with open(list_path, encoding='utf-8') as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    logger.info(f'{len(sentences)} sentences found')
+
+    savedir = args.savepath
+    if savedir == SAVE_WAV_PATH:
+        savedir = os.path.splitext(list_path)[0] + '_results'
+    os.makedirs(savedir, exist_ok=True)
+
+    # model initialize
+    net_t2m = ailia.Net(MODEL_PATH_T2M, WEIGHT_PATH_T2M, env_id=args.env_id)
+    net_ssrm = ailia.Net(MODEL_PATH_SSRM, WEIGHT_PATH_SSRM, env_id=args.env_id)
+
+    # inference
+    logger.info('Start inference...')
+    start = int(round(time.time() * 1000))
+    mags = [None] * len(sentences)
+    for idx, max_n in make_buckets(sentences, args.batch_size):
+        outs = inference_batch(
+            net_t2m, net_ssrm, [sentences[i] for i in idx], max_n
+        )
+        for i, out in zip(idx, outs):
+            mags[i] = out
+    end = int(round(time.time() * 1000))
+    logger.info("\tailia processing time {} ms".format(end-start))
+
+    savepaths = [
+        os.path.join(savedir, f'{i:05d}.wav') for i in range(len(sentences))
+    ]
+    save_to_wav_batch(mags, savepaths, workers=args.workers)
+    logger.info(f'saved at : {savedir}')
+
+    logger.info('Script finished successfully.')
+
+
 def main():
     # model files check and download
     check_and_download_models(WEIGHT_PATH_T2M, MODEL_PATH_T2M, REMOTE_PATH_T2M)
     check_and_download_models(WEIGHT_PATH_SSRM, MODEL_PATH_SSRM, REMOTE_PATH_SSRM)
 
-    generate_sentence(args.input)
+    if args.input_list is not None:
+        generate_sentences(args.input_list)
+    else:
+        generate_sentence(args.input)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import os
 import re
 import copy
+from concurrent.futures import ProcessPoolExecutor
 import librosa
 from scipy import signal
 import scipy.io.wavfile
@@ -23,6 +24,16 @@ class HParams:
 hp = HParams()
 
 
+def _stft_window():
+    # same as librosa: periodic hann of win_length, zero padded to n_fft
+    window = np.zeros(hp.n_fft, np.float64)
+    offset = (hp.n_fft - hp.win_length) // 2
+    window[offset:offset + hp.win_length] = signal.get_window('hann', hp.win_length)
+    return window
+STFT_WINDOW = _stft_window()
+STFT_SCALE = STFT_WINDOW.sum()
+
+
 """Save to wav"""
 def save_to_wav(mag, filename):
     """Generate and save an audio file from the given linear spectrogram using Griffin-Lim."""
@@ -30,6 +41,18 @@ def save_to_wav(mag, filename):
     scipy.io.wavfile.write(filename, hp.sr, wav)
 
 
+def save_to_wav_batch(mags, filenames, workers=1):
+    """Vocode a list of linear spectrograms, Griffin-Lim runs on a process pool."""
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            wavs = executor.map(spectrogram2wav, mags)
+            for wav, filename in zip(wavs, filenames):
+                scipy.io.wavfile.write(filename, hp.sr, wav)
+    else:
+        for mag, filename in zip(mags, filenames):
+            save_to_wav(mag, filename)
+
+
 def spectrogram2wav(mag):
     '''# Generate wave file from linear magnitude spectrogram
     Args:
@@ -63,7 +86,7 @@ def griffin_lim(spectrogram):
     X_best = copy.deepcopy(spectrogram)
     for i in range(hp.n_iter):
         X_t = invert_spectrogram(X_best)
-        est = librosa.stft(X_t, hp.n_fft, hp.hop_length, win_length=hp.win_length)
+        est = stft(X_t)[:, :spectrogram.shape[1]]
         phase = est / np.maximum(1e-8, np.abs(est))
         X_best = spectrogram * phase
     X_t = invert_spectrogram(X_best)
@@ -72,12 +95,26 @@ def griffin_lim(spectrogram):
     return y
 
 
+def stft(y):
+    '''Centered STFT with the same layout and scale as librosa.stft.
+    Returns:
+      spectrogram: [1+n_fft//2, t]
+    '''
+    _, _, Zxx = signal.stft(
+        y, window=STFT_WINDOW, nperseg=hp.n_fft,
+        noverlap=hp.n_fft - hp.hop_length, boundary='even', padded=False)
+    return Zxx * STFT_SCALE
+
+
 def invert_spectrogram(spectrogram):
     '''Applies inverse fft.
     Args:
       spectrogram: [1+n_fft//2, t]
     '''
-    return librosa.istft(spectrogram, hp.hop_length, win_length=hp.win_length, window="hann")
+    _, y = signal.istft(
+        spectrogram / STFT_SCALE, window=STFT_WINDOW, nperseg=hp.n_fft,
+        noverlap=hp.n_fft - hp.hop_length)
+    return y
 
 
 
@@ -1,6 +1,7 @@
 import time
 import sys
 import argparse
+from math import gcd
 
 import numpy as np
 
@@ -48,6 +49,21 @@ parser.add_argument(
     default='base', choices=MODEL_LISTS,
     help='model lists: ' + ' | '.join(MODEL_LISTS)
 )
+parser.add_argument(
+    '--stream',
+    action='store_true',
+    help=('Process the input in fixed-length chunks blended by overlap-add '
+          'crossfades and write the output incrementally, so the memory use '
+          'does not depend on the input length.')
+)
+parser.add_argument(
+    '--chunk_sec', type=float, default=10.0,
+    help='Chunk length in seconds for --stream.'
+)
+parser.add_argument(
+    '--overlap_sec', type=float, default=1.0,
+    help='Overlap between consecutive chunks in seconds for --stream.'
+)
 args = update_parser(parser)
 
 
@@ -100,7 +116,26 @@ def src_sep(data, session) :
     return sep
 
 
-def recognize_one_audio(input_path):
+def create_session():
+    if not args.onnx :
+        logger.info('Use ailia')
+        logger.info(f'env_id: {args.env_id}')
+        session = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
+    else :
+        logger.info('Use onnxruntime')
+        import onnxruntime
+        session = onnxruntime.InferenceSession(WEIGHT_PATH)
+    return session
+
+
+def postprocess(sep):
+    if LPF_CUTOFF > 0 :
+        sep = lowpass(sep, LPF_CUTOFF, DESIRED_SR)
+
+    return inv_preemphasis(sep).clip(-1.,1.)
+
+
+def recognize_one_audio(input_path, session):
     # load audio
     logger.info('Loading wavfile...')
     wav, sr = sf.read(input_path)
@@ -126,17 +161,6 @@ def recognize_one_audio(input_path):
 
     input_feature = tfconvert(wav, WINDOW_LEN, HOP_LEN, MULT)
 
-    # create instance
-    if not args.onnx :
-        logger.info('Use ailia')
-        env_id = ailia.get_gpu_environment_id()
-        logger.info(f'env_id: {env_id}')
-        session = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=env_id)
-    else :
-        logger.info('Use onnxruntime')
-        import onnxruntime
-        session = onnxruntime.InferenceSession(WEIGHT_PATH)
-
     # inference
     logger.info('Start inference...')
     if args.benchmark:
@@ -151,10 +175,7 @@ def recognize_one_audio(input_path):
 
     # postprocessing
     logger.info('Start postprocessing...')
-    if LPF_CUTOFF > 0 :
-        sep = lowpass(sep, LPF_CUTOFF, DESIRED_SR)
-
-    out_wav = inv_preemphasis(sep).clip(-1.,1.)
+    out_wav = postprocess(sep)
     out_wav = out_wav.swapaxes(0,1)
     
     # save sapareted signal
@@ -167,12 +188,73 @@ def recognize_one_audio(input_path):
     logger.info('Script finished successfully.')
 
 
+def separate_chunk(wav, sr, session):
+    """Separate one chunk, returns DESIRED_SR samples of the same duration"""
+    wav = wav[np.newaxis, :]
+    if not sr == DESIRED_SR :
+        wav = signal.resample_poly(wav, DESIRED_SR, sr, axis=1)
+    n = wav.shape[1]
+
+    input_feature = tfconvert(preemphasis(wav), WINDOW_LEN, HOP_LEN, MULT)
+    sep = src_sep(input_feature, session)
+    return postprocess(sep)[0, :n]
+
+
+def recognize_one_audio_stream(input_path, session):
+    info = sf.info(input_path)
+    sr = info.samplerate
+    calc_time(info.frames, sr)
+
+    # chunk and overlap lengths are multiples of the resampling period,
+    # so that they map to an exact number of output samples
+    g = gcd(sr, DESIRED_SR)
+    period_in, period_out = sr // g, DESIRED_SR // g
+    n_periods = max(int(args.chunk_sec * sr) // period_in, 2)
+    n_overlap = min(max(int(args.overlap_sec * sr) // period_in, 1), n_periods - 1)
+    chunk_in, overlap_in = n_periods * period_in, n_overlap * period_in
+    overlap_out = n_overlap * period_out
+
+    # raised cosine crossfade, fade_in + fade_out == 1
+    fade_in = np.sin(0.5 * np.pi * (np.arange(overlap_out) + 0.5) / overlap_out) ** 2
+    fade_out = 1.0 - fade_in
+
+    savepath = get_savepath(args.savepath, input_path)
+    logger.info('Start inference...')
+    start = int(round(time.time() * 1000))
+    tail = None
+    with sf.SoundFile(savepath, 'w', samplerate=DESIRED_SR, channels=1) as f:
+        for block in sf.blocks(input_path, blocksize=chunk_in,
+                               overlap=overlap_in, dtype='float32',
+                               always_2d=True):
+            out = separate_chunk(block[:, 0], sr, session)
+
+            if tail is not None:
+                n = min(len(tail), len(out))
+                out[:n] = tail[:n] * fade_out[:n] + out[:n] * fade_in[:n]
+            if len(out) > overlap_out:
+                f.write(out[:-overlap_out])
+                tail = out[-overlap_out:]
+            else:
+                tail = out
+        if tail is not None:
+            f.write(tail)
+    end = int(round(time.time() * 1000))
+    logger.info("\tprocessing time {} ms".format(end-start))
+
+    logger.info(f'saved at : {savepath}')
+    logger.info('Script finished successfully.')
+
+
 def main():
     # model files check and download
     check_and_download_models(WEIGHT_PATH, MODEL_PATH, REMOTE_PATH)
 
+    session = create_session()
     for input_file in args.input:
-        recognize_one_audio(input_file)
+        if args.stream:
+            recognize_one_audio_stream(input_file, session)
+        else:
+            recognize_one_audio(input_file, session)
 
 if __name__ == "__main__":
      main()
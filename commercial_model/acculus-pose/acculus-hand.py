@@ -11,6 +11,7 @@ from utils import get_base_parser, update_parser  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
 from webcamera_utils import get_capture, get_writer, \
     calc_adjust_fsize  # noqa: E402
+from top_down_utils import crop_boxes  # noqa: E402
 
 # logger
 from logging import getLogger   # noqa: E402
@@ -37,6 +38,9 @@ HAND_CATEGORY = ['hand']
 THRESHOLD = 0.2
 IOU = 0.45
 
+# all the hand crops of a frame are resized to this size
+HAND_CROP_SIZE = 256
+
 
 # ======================
 # Arguemnt Parser Config
@@ -147,33 +151,31 @@ def recognize_from_video():
 
         h, w = img.shape[0], img.shape[1]
         count = detector.get_object_count()
+        boxes = []
         for idx in range(count):
-            # get detected hand
+            # get detected hand, as a square box
             obj = detector.get_object(idx)
             margin = 1.0
             cx = (obj.x + obj.w/2) * w
             cy = (obj.y + obj.h/2) * h
             cw = max(obj.w * w, obj.h * h) * margin
-            fx = max(cx - cw/2, 0)
-            fy = max(cy - cw/2, 0)
-            fw = min(cw, w-fx)
-            fh = min(cw, h-fy)
-            top_left = (int(fx), int(fy))
-            bottom_right = (int(fx+fw), int(fy+fh))
+            if cw < 1:
+                continue
+            boxes.append((cx - cw/2, cy - cw/2, cx + cw/2, cy + cw/2))
+
+        # get all the detected hands in one pass, zero padded outside
+        # the frame so that they stay square
+        crops, _ = crop_boxes(img, boxes, HAND_CROP_SIZE)
+        for crop_img, box in zip(crops, boxes):
+            top_left = (int(box[0]), int(box[1]))
+            bottom_right = (int(box[2]), int(box[3]))
 
             # display detected hand
             color = hsv_to_rgb(0, 255, 255)
             cv2.rectangle(frame, top_left, bottom_right, color, 4)
 
-            # get detected face
-            crop_img = img[
-                top_left[1]:bottom_right[1], top_left[0]:bottom_right[0], 0:4
-            ]
-            if crop_img.shape[0] <= 0 or crop_img.shape[1] <= 0:
-                continue
-
             # inference
-            _ = hand.compute(crop_img.astype(np.uint8, order='C'))
+            _ = hand.compute(crop_img)
 
             # postprocessing
             display_result(frame, hand, top_left, bottom_right)
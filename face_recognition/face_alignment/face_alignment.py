@@ -3,6 +3,7 @@ import sys
 import time
 import math
 import collections
+from functools import lru_cache
 
 from mpl_toolkits.axes_grid1 import ImageGrid
 import cv2
@@ -16,6 +17,7 @@ from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
 from image_utils import load_image  # noqa: E402
 import webcamera_utils  # noqa: E402
+from plot3d_utils import SkeletonRenderer3d  # noqa: E402
 
 sys.path.append('../../face_detection/blazeface')
 from blazeface_utils import compute_blazeface, crop_blazeface  # noqa: E402
@@ -73,6 +75,11 @@ PRED_TYPES = {
     'lips': PRED_TYPE(slice(48, 60), (0.596, 0.875, 0.541, 0.3)),
     'teeth': PRED_TYPE(slice(60, 68), (0.596, 0.875, 0.541, 0.4))
 }
+LANDMARK_EDGES = np.array([
+    (i, i + 1)
+    for pred_type in PRED_TYPES.values()
+    for i in range(pred_type.slice.start, pred_type.slice.stop - 1)
+])
 
 
 # ======================
@@ -168,28 +175,40 @@ def visualize_results(axs, image, pts_img, active_3d=False):
     return axs
 
 
-def transform(point, center, scale, resolution, invert=False):
-    """Generate and affine transformation matrix.
+def create_renderer():
+    # same view as the 3D axes of visualize_results
+    return SkeletonRenderer3d((IMAGE_HEIGHT, IMAGE_WIDTH), elev=90, azim=90)
 
-    Given a set of points, a center, a scale and a targer resolution, the
-    function generates and affine transformation matrix. If invert is ``True``
-    it will produce the inverse transformation.
 
-    Arguments:
-        point {torch.tensor} -- the input 2D point
-        center {torch.tensor or numpy.array} -- the center around which to
-            perform the transformations
-        scale {float} -- the scale of the face/object
-        resolution {float} -- the output resolution
+def draw_results(renderer, image, pts_img, active_3d=False):
+    """OpenCV version of visualize_results for video, image is BGR"""
+    img = image.copy()
+    for pred_type in PRED_TYPES.values():
+        color = tuple(c * 255 for c in pred_type.color[2::-1])
+        pts = np.round(pts_img[pred_type.slice, :2]).astype(np.int32)
+        cv2.polylines(img, [pts], False, color, 2, cv2.LINE_AA)
+        for p in pts.tolist():
+            cv2.circle(img, tuple(p), 2, color, -1, cv2.LINE_AA)
+    if not active_3d:
+        return img
 
-    Keyword Arguments:
-        invert {bool} -- define wherever the function should produce the direct
-            or the inverse transformation matrix (default: {False})
-    """
-    _pt = np.ones(3)
-    _pt[0] = point[0]
-    _pt[1] = point[1]
+    # the x axis is reversed in visualize_results
+    points = pts_img * np.array([-1, 1, 1])
+    renderer.fit(points)
+    canvas = renderer.render(
+        points, LANDMARK_EDGES, (255, 0, 0),
+        thickness=1, radius=3, point_colors=(255, 255, 0),
+    )
+    return np.concatenate([img, canvas], axis=1)
 
+
+def transform_matrix(center, scale, resolution, invert=False):
+    """Generate an affine transformation matrix.
+
+    Given a center, a scale and a target resolution, the function generates
+    the 3x3 affine transformation matrix of the crop. If invert is ``True``
+    it will produce the inverse transformation.
+    """
     h = scale  # NOTE: originally, scale * 200
     t = np.eye(3)
     t[0, 0] = resolution / h
@@ -199,8 +218,7 @@ def transform(point, center, scale, resolution, invert=False):
 
     if invert:
         t = np.linalg.inv(t)
-    new_point = (np.dot(t, _pt))[0:2]
-    return new_point.astype(np.int)
+    return t
 
 
 def get_preds_from_hm(hm):
@@ -208,52 +226,51 @@ def get_preds_from_hm(hm):
     Obtain (x,y) coordinates given a set of N heatmaps.
     ref: 1adrianb/face-alignment/blob/master/face_alignment/utils.py
 
-    TODO: docstring
+    All faces and landmarks are decoded at once: the peak of each heatmap
+    is moved by a quarter pixel towards its higher neighbours, then mapped
+    back to the input image by a single matrix product.
 
     Parameters
     ----------
     hm : np.array
+        (B, N, H, W) heatmaps
 
     Returns
     -------
-    preds:
-    preds_orig:
-
+    preds: np.array
+        (B, N, 2) coordinates in the heatmap
+    preds_orig: np.array
+        (B, N, 2) coordinates in the input image
     """
-    idx = np.argmax(
-        hm.reshape(hm.shape[0], hm.shape[1], hm.shape[2] * hm.shape[3]), axis=2
+    b, n, height, width = hm.shape
+    hm_flat = hm.reshape(b, n, height * width)
+    idx = np.argmax(hm_flat, axis=2)
+    pX, pY = idx % width, idx // width
+    preds = np.stack([pX, pY], axis=2).astype(float) + 1
+
+    # quarter pixel refinement, only for peaks inside the border
+    inside = (pX > 0) & (pX < width - 1) & (pY > 0) & (pY < height - 1)
+    neighbours = np.clip(
+        idx[..., np.newaxis] + np.array([1, -1, width, -width]),
+        0, height * width - 1,
     )
-    idx += 1
-    preds = idx.reshape(idx.shape[0], idx.shape[1], 1)
-    preds = np.tile(preds, (1, 1, 2)).astype(np.float)
-    preds[..., 0] = (preds[..., 0] - 1) % hm.shape[3] + 1
-    preds[..., 1] = np.floor((preds[..., 1] - 1) / (hm.shape[2])) + 1
-
-    for i in range(preds.shape[0]):
-        for j in range(preds.shape[1]):
-            hm_ = hm[i, j, :]
-            pX, pY = int(preds[i, j, 0]) - 1, int(preds[i, j, 1]) - 1
-            if pX > 0 and pX < 63 and pY > 0 and pY < 63:
-                diff = np.array(
-                    [hm_[pY, pX + 1] - hm_[pY, pX - 1],
-                     hm_[pY + 1, pX] - hm_[pY - 1, pX]]).astype(np.float)
-                preds[i, j] = preds[i, j] + (np.sign(diff) * 0.25)
+    v = np.take_along_axis(hm_flat, neighbours, axis=2).astype(float)
+    diff = np.stack([v[..., 0] - v[..., 1], v[..., 2] - v[..., 3]], axis=2)
+    preds += np.where(inside[..., np.newaxis], np.sign(diff) * 0.25, 0)
 
     preds += -0.5
-    preds_orig = np.zeros_like(preds)
-
-    for i in range(hm.shape[0]):
-        for j in range(hm.shape[1]):
-            preds_orig[i, j] = transform(
-                preds[i, j],  # point
-                np.array([IMAGE_HEIGHT // 2, IMAGE_WIDTH // 2]),  # center
-                (IMAGE_HEIGHT + IMAGE_WIDTH) // 2,  # FIXME not sure... # scale
-                hm.shape[2],  # resolution
-                True,
-            )
+
+    t = transform_matrix(
+        np.array([IMAGE_HEIGHT // 2, IMAGE_WIDTH // 2]),  # center
+        (IMAGE_HEIGHT + IMAGE_WIDTH) // 2,  # FIXME not sure... # scale
+        height,  # resolution
+        True,
+    )
+    preds_orig = np.trunc(preds @ t[:2, :2].T + t[:2, 2])
     return preds, preds_orig
 
 
+@lru_cache(maxsize=None)
 def _gaussian(
         size=3,
         sigma=0.25,
@@ -266,6 +283,7 @@ def _gaussian(
         mean_horz=0.5,
         mean_vert=0.5
 ):
+    # kernels are cached by their parameters, they must not be modified
     # handle some defaults
     if width is None:
         width = size
@@ -277,17 +295,14 @@ def _gaussian(
         sigma_vert = sigma
     center_x = mean_horz * width + 0.5
     center_y = mean_vert * height + 0.5
-    gauss = np.empty((height, width), dtype=np.float32)
     # generate kernel
-    for i in range(height):
-        for j in range(width):
-            gauss[i][j] = amplitude * math.exp(-(math.pow(
-                (j + 1 - center_x) / (sigma_horz * width), 2
-            ) / 2.0 + math.pow(
-                (i + 1 - center_y) / (sigma_vert * height), 2
-            ) / 2.0))
+    x = ((np.arange(width) + 1 - center_x) / (sigma_horz * width)) ** 2 / 2.0
+    y = ((np.arange(height) + 1 - center_y) / (sigma_vert * height)) ** 2 / 2.0
+    gauss = (amplitude * np.exp(-(y[:, np.newaxis] + x[np.newaxis, :]))).astype(
+        np.float32)
     if normalize:
         gauss = gauss / np.sum(gauss)
+    gauss.flags.writeable = False
     return gauss
 
 
@@ -410,16 +425,14 @@ def recognize_from_video():
 
     # create video writer if savepath is specified as video format
     if args.savepath != SAVE_IMAGE_PATH:
-        logger.warning('[WARNING] currently video results output feature '
-                       'is not supported in this model!')
-        # TODO: shape should be debugged!
-        f_h = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        f_w = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        f_h = IMAGE_HEIGHT
+        f_w = IMAGE_WIDTH * 2 if args.active_3d else IMAGE_WIDTH
         writer = webcamera_utils.get_writer(args.savepath, f_h, f_w)
     else:
         writer = None
 
-    fig, axs = create_figure(active_3d=args.active_3d)
+    # results are drawn with OpenCV, matplotlib is too slow for video
+    renderer = create_renderer()
 
     while(True):
         ret, frame = capture.read()
@@ -469,28 +482,17 @@ def recognize_from_video():
             depth_pred = depth_pred.reshape(68, 1)
             pts_img = np.concatenate((pts_img, depth_pred * 2), 1)
 
-        resized_img = cv2.resize(
-            cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB),
-            (IMAGE_WIDTH, IMAGE_HEIGHT)
-        )
+        resized_img = cv2.resize(input_image, (IMAGE_WIDTH, IMAGE_HEIGHT))
 
-        # visualize results (clear axs at first)
-        axs = visualize_results(
-            axs, resized_img, pts_img, active_3d=args.active_3d
+        # visualize results
+        res_img = draw_results(
+            renderer, resized_img, pts_img, active_3d=args.active_3d
         )
-        plt.pause(0.01)
-        if not plt.get_fignums():
-            break
+        cv2.imshow('frame', res_img)
 
         # save results
-        # FIXME: How to save plt --> cv2.VideoWriter()
-        # if writer is not None:
-        #     # put pixel buffer in numpy array
-        #     canvas = FigureCanvas(fig)
-        #     canvas.draw()
-        #     mat = np.array(canvas.renderer._renderer)
-        #     res_img = cv2.cvtColor(mat, cv2.COLOR_RGB2BGR)
-        #     writer.write(res_img)
+        if writer is not None:
+            writer.write(res_img)
 
     capture.release()
     cv2.destroyAllWindows()
@@ -23,7 +23,7 @@ from prnet_utils.rotate_vertices import frontalize  # noqa: E402
 from prnet_utils.render_app import get_visibility, get_uv_mask, get_depth_image  # noqa: E402
 from prnet_utils.write import write_obj_with_colors, write_obj_with_texture  # noqa: E402
 from prnet_utils.cv_plot import plot_kpt, plot_vertices, plot_pose_box  # noqa: E402
-from prnet_utils.render import render_texture  # noqa: E402
+from prnet_utils.render import render_texture, get_triangle_buffer  # noqa: E402
 
 # logger
 from logging import getLogger   # noqa: E402
@@ -366,15 +366,14 @@ def texture_editing_from_images():
             exit()
 
         # 3. remap to input image (render).
-        vis_colors = np.ones((vertices.shape[0], 1))
-        face_mask = render_texture(
-            vertices.T, vis_colors.T, TRIANGLES.T, h, w, c=1
-        )
-        face_mask = np.squeeze(face_mask > 0).astype(np.float32)
+        # the mesh is rasterized once, for the face mask and the new image
+        triangle_buffer = get_triangle_buffer(vertices.T, TRIANGLES.T, h, w)
+        face_mask = (triangle_buffer >= 0).astype(np.float32)
 
         new_colors = get_colors_from_texture(new_texture, IMAGE_SIZE)
         new_image = render_texture(
-            vertices.T, new_colors.T, TRIANGLES.T, h, w, c=3
+            vertices.T, new_colors.T, TRIANGLES.T, h, w, c=3,
+            triangle_buffer=triangle_buffer,
         )
         new_image = image * (1 - face_mask[:, :, np.newaxis]) + \
             new_image * face_mask[:, :, np.newaxis]
@@ -4,85 +4,109 @@ Mail: fengyao@sjtu.edu.cn
 '''
 import numpy as np
 
-def isPointInTri(point, tri_points):
-    ''' Judge whether the point is in the triangle
-    Method:
-        http://blackpawn.com/texts/pointinpoly/
+def barycentric(px, py, tri_points):
+    ''' Barycentric weights of many points in many triangles
     Args:
-        point: [u, v] or [x, y] 
-        tri_points: three vertices(2d points) of a triangle. 2 coords x 3 vertices
+        px, py: x and y of the points, broadcastable with the triangles
+        tri_points: 2 coords x 3 vertices x ... of the triangles
     Returns:
-        bool: true for in triangle
+        u, v: weights of vertex 2 and vertex 1 (w0 = 1 - u - v)
     '''
     tp = tri_points
-
     # vectors
-    v0 = tp[:,2] - tp[:,0]
-    v1 = tp[:,1] - tp[:,0]
-    v2 = point - tp[:,0]
+    v0x, v0y = tp[0, 2] - tp[0, 0], tp[1, 2] - tp[1, 0]
+    v1x, v1y = tp[0, 1] - tp[0, 0], tp[1, 1] - tp[1, 0]
+    v2x, v2y = px - tp[0, 0], py - tp[1, 0]
 
     # dot products
-    dot00 = np.dot(v0.T, v0)
-    dot01 = np.dot(v0.T, v1)
-    dot02 = np.dot(v0.T, v2)
-    dot11 = np.dot(v1.T, v1)
-    dot12 = np.dot(v1.T, v2)
-
-    # barycentric coordinates
-    if dot00*dot11 - dot01*dot01 == 0:
-        inverDeno = 0
-    else:
-        inverDeno = 1/(dot00*dot11 - dot01*dot01)
+    dot00 = v0x*v0x + v0y*v0y
+    dot01 = v0x*v1x + v0y*v1y
+    dot02 = v0x*v2x + v0y*v2y
+    dot11 = v1x*v1x + v1y*v1y
+    dot12 = v1x*v2x + v1y*v2y
+
+    # barycentric coordinates, 0 for degenerated triangles as above
+    deno = dot00*dot11 - dot01*dot01
+    inverDeno = np.divide(1, deno, out=np.zeros_like(deno, dtype=float), where=deno != 0)
 
     u = (dot11*dot02 - dot01*dot12)*inverDeno
     v = (dot00*dot12 - dot01*dot02)*inverDeno
+    return u, v
 
-    # check if point in triangle
-    return (u >= 0) & (v >= 0) & (u + v < 1)
 
-def get_point_weight(point, tri_points):
-    ''' Get the weights of the position
-    Methods: https://gamedev.stackexchange.com/questions/23743/whats-the-most-efficient-way-to-find-barycentric-coordinates
-     -m1.compute the area of the triangles formed by embedding the point P inside the triangle
-     -m2.Christer Ericson's book "Real-Time Collision Detection". faster, so I used this.
+def rasterize_triangles(vertices, triangles, h, w, inside_test = True, max_pixels = 1 << 22):
+    ''' z buffer of all triangles at once
+    Triangles are grouped by the size of their bounding box (rounded up to
+    a power of 2), and the pixels of each group are tested on one stacked
+    grid. Each pixel keeps the triangle with the biggest depth, the first
+    one in case of a tie, as the per triangle loop did.
     Args:
-        point: [u, v] or [x, y] 
-        tri_points: three vertices(2d points) of a triangle. 2 coords x 3 vertices
+        vertices: 3 x nver
+        triangles: 3 x ntri
+        h: height
+        w: width
+        inside_test: if False, the whole bounding box of each triangle is drawn
+        max_pixels: number of candidate pixels tested at once
     Returns:
-        w0: weight of v0
-        w1: weight of v1
-        w2: weight of v3
-     '''
-    tp = tri_points
-    # vectors
-    v0 = tp[:,2] - tp[:,0]
-    v1 = tp[:,1] - tp[:,0]
-    v2 = point - tp[:,0]
-
-    # dot products
-    dot00 = np.dot(v0.T, v0)
-    dot01 = np.dot(v0.T, v1)
-    dot02 = np.dot(v0.T, v2)
-    dot11 = np.dot(v1.T, v1)
-    dot12 = np.dot(v1.T, v2)
-
-    # barycentric coordinates
-    if dot00*dot11 - dot01*dot01 == 0:
-        inverDeno = 0
-    else:
-        inverDeno = 1/(dot00*dot11 - dot01*dot01)
-
-    u = (dot11*dot02 - dot01*dot12)*inverDeno
-    v = (dot00*dot12 - dot01*dot02)*inverDeno
-
-    w0 = 1 - u - v
-    w1 = v
-    w2 = u
-
-    return w0, w1, w2
-
+        depth_buffer: height x width
+        triangle_buffer: height x width. -1 for no triangle
+    '''
+    depth_buffer = np.zeros([h, w]) - 999999.
+    triangle_buffer = np.zeros([h, w], dtype = np.int32) - 1
+    depth_flat = depth_buffer.reshape(-1)
+    triangle_flat = triangle_buffer.reshape(-1)
 
-def render_texture(vertices, colors, triangles, h, w, c = 3):
+    # triangle depth: average z of the vertices
+    tri_depth = (vertices[2, triangles[0,:]] + vertices[2,triangles[1,:]] + vertices[2, triangles[2,:]])/3.
+    tri_points = vertices[:2, triangles]  # 2 x 3 x ntri
+
+    # the inner bounding box
+    umin = np.maximum(np.ceil(tri_points[0].min(axis=0)), 0).astype(np.int64)
+    umax = np.minimum(np.floor(tri_points[0].max(axis=0)), w-1).astype(np.int64)
+    vmin = np.maximum(np.ceil(tri_points[1].min(axis=0)), 0).astype(np.int64)
+    vmax = np.minimum(np.floor(tri_points[1].max(axis=0)), h-1).astype(np.int64)
+
+    ind = np.nonzero((umax >= umin) & (vmax >= vmin) & (tri_depth > -999999.))[0]
+    if len(ind) == 0:
+        return depth_buffer, triangle_buffer
+
+    # group by bounding box size
+    bw = 1 << np.ceil(np.log2(umax[ind] - umin[ind] + 1)).astype(np.int64)
+    bh = 1 << np.ceil(np.log2(vmax[ind] - vmin[ind] + 1)).astype(np.int64)
+    for gw, gh in set(zip(bw.tolist(), bh.tolist())):
+        group = ind[(bw == gw) & (bh == gh)]
+        step = max(max_pixels // (gw * gh), 1)
+        for k in range(0, len(group), step):
+            t = group[k:k + step]
+            U = umin[t, None, None] + np.arange(gw)[None, None, :]
+            V = vmin[t, None, None] + np.arange(gh)[None, :, None]
+            mask = (U <= umax[t, None, None]) & (V <= vmax[t, None, None])
+            if inside_test:
+                u, v = barycentric(U, V, tri_points[:, :, t, None, None])
+                mask &= (u >= 0) & (v >= 0) & (u + v < 1)
+
+            tri = np.broadcast_to(t[:, None, None], mask.shape)[mask]
+            pix = (V * w + U)[mask]
+            depth = tri_depth[tri]
+
+            # nearest triangle of each pixel in this batch
+            order = np.lexsort((tri, -depth, pix))
+            pix, depth, tri = pix[order], depth[order], tri[order]
+            first = np.ones(len(pix), dtype = bool)
+            first[1:] = pix[1:] != pix[:-1]
+            pix, depth, tri = pix[first], depth[first], tri[first]
+
+            # merge into the buffers
+            cur_depth = depth_flat[pix]
+            cur_tri = triangle_flat[pix]
+            better = (depth > cur_depth) | ((depth == cur_depth) & (cur_tri > tri))
+            depth_flat[pix[better]] = depth[better]
+            triangle_flat[pix[better]] = tri[better]
+
+    return depth_buffer, triangle_buffer
+
+
+def render_texture(vertices, colors, triangles, h, w, c = 3, triangle_buffer = None):
     ''' render mesh by z buffer
     Args:
         vertices: 3 x nver
@@ -90,33 +114,19 @@ def render_texture(vertices, colors, triangles, h, w, c = 3):
         triangles: 3 x ntri
         h: height
         w: width    
+        triangle_buffer: height x width, from get_triangle_buffer if given
     '''
     # initial 
     image = np.zeros((h, w, c))
 
-    depth_buffer = np.zeros([h, w]) - 999999.
-    # triangle depth: approximate the depth to the average value of z in each vertex(v0, v1, v2), since the vertices are closed to each other
-    tri_depth = (vertices[2, triangles[0,:]] + vertices[2,triangles[1,:]] + vertices[2, triangles[2,:]])/3. 
-    tri_tex = (colors[:, triangles[0,:]] + colors[:,triangles[1,:]] + colors[:, triangles[2,:]])/3.
-
-    for i in range(triangles.shape[1]):
-        tri = triangles[:, i] # 3 vertex indices
-
-        # the inner bounding box
-        umin = max(int(np.ceil(np.min(vertices[0,tri]))), 0)
-        umax = min(int(np.floor(np.max(vertices[0,tri]))), w-1)
+    if triangle_buffer is None:
+        triangle_buffer = get_triangle_buffer(vertices, triangles, h, w)
 
-        vmin = max(int(np.ceil(np.min(vertices[1,tri]))), 0)
-        vmax = min(int(np.floor(np.max(vertices[1,tri]))), h-1)
-
-        if umax<umin or vmax<vmin:
-            continue
+    # triangle color: the average color of its vertices
+    tri_tex = (colors[:, triangles[0,:]] + colors[:,triangles[1,:]] + colors[:, triangles[2,:]])/3.
 
-        for u in range(umin, umax+1):
-            for v in range(vmin, vmax+1):
-                if tri_depth[i] > depth_buffer[v, u] and isPointInTri([u,v], vertices[:2, tri]): 
-                    depth_buffer[v, u] = tri_depth[i]
-                    image[v, u, :] = tri_tex[:, i]
+    mask = triangle_buffer >= 0
+    image[mask] = tri_tex[:, triangle_buffer[mask]].T
     return image
 
 
@@ -139,50 +149,36 @@ def map_texture(src_image, src_vertices, dst_vertices, dst_triangle_buffer, tria
     '''
     [sh, sw, sc] = src_image.shape
     dst_image = np.zeros((h, w, c))
-    for y in range(h):
-        for x in range(w):
-            tri_ind = dst_triangle_buffer[y,x]
-            if tri_ind < 0: # no tri in dst image
-                continue 
-            #if src_triangles_vis[tri_ind]: # the corresponding triangle in src image is invisible
-            #   continue
-            
-            # then. For this triangle index, map corresponding pixels(in triangles) in src image to dst image
-            # Two Methods:
-            # M1. Calculate the corresponding affine matrix from src triangle to dst triangle. Then find the corresponding src position of this dst pixel.
-            # -- ToDo
-            # M2. Calculate the relative position of three vertices in dst triangle, then find the corresponding src position relative to three src vertices.
-            tri = triangles[:, tri_ind]
-            # dst weight, here directly use the center to approximate because the tri is small
-            # if tri_ind < 366:
-                # print tri_ind
-            w0, w1, w2 = get_point_weight([x, y], dst_vertices[:2, tri])
-            # else:
-            #     w0 = w1 = w2 = 1./3
-            # src
-            src_texel = w0*src_vertices[:2, tri[0]] + w1*src_vertices[:2, tri[1]] + w2*src_vertices[:2, tri[2]] #
-# 
-            if src_texel[0] < 0 or src_texel[0]> sw-1 or src_texel[1]<0 or src_texel[1] > sh-1:
-                dst_image[y, x, :] = 0
-                continue
-            # As the coordinates of the transformed pixel in the image will most likely not lie on a texel, we have to choose how to
-            # calculate the pixel colors depending on the next texels
-            # there are three different texture interpolation methods: area, bilinear and nearest neighbour
-            # print y, x, src_texel
-            # nearest neighbour 
-            if mapping_type == 'nearest':
-                dst_image[y, x, :] = src_image[int(round(src_texel[1])), int(round(src_texel[0])), :]
-            # bilinear
-            elif mapping_type == 'bilinear':
-                # next 4 pixels
-                ul = src_image[int(np.floor(src_texel[1])), int(np.floor(src_texel[0])), :]
-                ur = src_image[int(np.floor(src_texel[1])), int(np.ceil(src_texel[0])), :]
-                dl = src_image[int(np.ceil(src_texel[1])), int(np.floor(src_texel[0])), :]
-                dr = src_image[int(np.ceil(src_texel[1])), int(np.ceil(src_texel[0])), :]
-
-                yd = src_texel[1] - np.floor(src_texel[1])
-                xd = src_texel[0] - np.floor(src_texel[0])
-                dst_image[y, x, :] = ul*(1-xd)*(1-yd) + ur*xd*(1-yd) + dl*(1-xd)*yd + dr*xd*yd
+
+    # all pixels with a triangle in dst image
+    y, x = np.nonzero(dst_triangle_buffer[:h, :w] >= 0)
+    tri = triangles[:, dst_triangle_buffer[y, x]]
+
+    # relative position of the pixel to the three vertices of dst triangle,
+    # applied to the src triangle
+    u, v = barycentric(x, y, dst_vertices[:2, tri])
+    w0, w1, w2 = 1 - u - v, v, u
+    src_texel = w0*src_vertices[:2, tri[0]] + w1*src_vertices[:2, tri[1]] + w2*src_vertices[:2, tri[2]]
+
+    inside = (src_texel[0] >= 0) & (src_texel[0] <= sw-1) & (src_texel[1] >= 0) & (src_texel[1] <= sh-1)
+    y, x, src_texel = y[inside], x[inside], src_texel[:, inside]
+
+    # nearest neighbour 
+    if mapping_type == 'nearest':
+        dst_image[y, x, :] = src_image[np.round(src_texel[1]).astype(int), np.round(src_texel[0]).astype(int), :]
+    # bilinear
+    elif mapping_type == 'bilinear':
+        # next 4 pixels
+        x0, x1 = np.floor(src_texel[0]).astype(int), np.ceil(src_texel[0]).astype(int)
+        y0, y1 = np.floor(src_texel[1]).astype(int), np.ceil(src_texel[1]).astype(int)
+        ul = src_image[y0, x0, :]
+        ur = src_image[y0, x1, :]
+        dl = src_image[y1, x0, :]
+        dr = src_image[y1, x1, :]
+
+        yd = (src_texel[1] - np.floor(src_texel[1]))[:, np.newaxis]
+        xd = (src_texel[0] - np.floor(src_texel[0]))[:, np.newaxis]
+        dst_image[y, x, :] = ul*(1-xd)*(1-yd) + ur*xd*(1-yd) + dl*(1-xd)*yd + dr*xd*yd
                 
     return dst_image
 
@@ -201,38 +197,9 @@ def get_depth_buffer(vertices, triangles, h, w):
         m3. like somewhere is wrong
     # Each triangle has 3 vertices & Each vertex has 3 coordinates x, y, z.
     # Here, the bigger the z, the fronter the point.
+    # The whole bounding box of each triangle is drawn (no inside test).
     '''
-    # initial 
-    depth_buffer = np.zeros([h, w]) - 999999. #+ np.min(vertices[2,:]) - 999999. # set the initial z to the farest position
-
-    ## calculate the depth(z) of each triangle
-    #-m1. z = the center of shpere(through 3 vertices)
-    #center3d = (vertices[:, triangles[0,:]] + vertices[:,triangles[1,:]] + vertices[:, triangles[2,:]])/3.
-    #tri_depth = np.sum(center3d**2, axis = 0)
-    #-m2. z = the center of z(v0, v1, v2)
-    tri_depth = (vertices[2, triangles[0,:]] + vertices[2,triangles[1,:]] + vertices[2, triangles[2,:]])/3.
-    
-    for i in range(triangles.shape[1]):
-        tri = triangles[:, i] # 3 vertex indices
-
-        # the inner bounding box
-        umin = max(int(np.ceil(np.min(vertices[0,tri]))), 0)
-        umax = min(int(np.floor(np.max(vertices[0,tri]))), w-1)
-
-        vmin = max(int(np.ceil(np.min(vertices[1,tri]))), 0)
-        vmax = min(int(np.floor(np.max(vertices[1,tri]))), h-1)
-
-        if umax<umin or vmax<vmin:
-            continue
-
-        for u in range(umin, umax+1):
-            for v in range(vmin, vmax+1):
-                #-m3. calculate the accurate depth(z) of each pixel by barycentric weights
-                #w0, w1, w2 = weightsOfpoint([u,v], vertices[:2, tri])
-                #tri_depth = w0*vertices[2,tri[0]] + w1*vertices[2,tri[1]] + w2*vertices[2,tri[2]]
-                if tri_depth[i] > depth_buffer[v, u]: # and is_pointIntri([u,v], vertices[:2, tri]): 
-                    depth_buffer[v, u] = tri_depth[i]
-
+    depth_buffer, _ = rasterize_triangles(vertices, triangles, h, w, inside_test = False)
     return depth_buffer
 
 
@@ -244,46 +211,11 @@ def get_triangle_buffer(vertices, triangles, h, w):
         h: height
         w: width
     Returns:
-        depth_buffer: height x width
-    ToDo:
-        whether to add x, y by 0.5? the center of the pixel?
-        m3. like somewhere is wrong
+        triangle_buffer: height x width. -1 if the pixel has no triangle correspondance
     # Each triangle has 3 vertices & Each vertex has 3 coordinates x, y, z.
     # Here, the bigger the z, the fronter the point.
     '''
-    # initial 
-    depth_buffer = np.zeros([h, w]) - 999999. #+ np.min(vertices[2,:]) - 999999. # set the initial z to the farest position
-    triangle_buffer = np.zeros_like(depth_buffer, dtype = np.int32) - 1 # if -1, the pixel has no triangle correspondance
-
-    ## calculate the depth(z) of each triangle
-    #-m1. z = the center of shpere(through 3 vertices)
-    #center3d = (vertices[:, triangles[0,:]] + vertices[:,triangles[1,:]] + vertices[:, triangles[2,:]])/3.
-    #tri_depth = np.sum(center3d**2, axis = 0)
-    #-m2. z = the center of z(v0, v1, v2)
-    tri_depth = (vertices[2, triangles[0,:]] + vertices[2,triangles[1,:]] + vertices[2, triangles[2,:]])/3.
-    
-    for i in range(triangles.shape[1]):
-        tri = triangles[:, i] # 3 vertex indices
-
-        # the inner bounding box
-        umin = max(int(np.ceil(np.min(vertices[0,tri]))), 0)
-        umax = min(int(np.floor(np.max(vertices[0,tri]))), w-1)
-
-        vmin = max(int(np.ceil(np.min(vertices[1,tri]))), 0)
-        vmax = min(int(np.floor(np.max(vertices[1,tri]))), h-1)
-
-        if umax<umin or vmax<vmin:
-            continue
-
-        for u in range(umin, umax+1):
-            for v in range(vmin, vmax+1):
-                #-m3. calculate the accurate depth(z) of each pixel by barycentric weights
-                #w0, w1, w2 = weightsOfpoint([u,v], vertices[:2, tri])
-                #tri_depth = w0*vertices[2,tri[0]] + w1*vertices[2,tri[1]] + w2*vertices[2,tri[2]]
-                if tri_depth[i] > depth_buffer[v, u] and isPointInTri([u,v], vertices[:2, tri]): 
-                    depth_buffer[v, u] = tri_depth[i]
-                    triangle_buffer[v, u] = i
-
+    _, triangle_buffer = rasterize_triangles(vertices, triangles, h, w)
     return triangle_buffer
 
 
@@ -295,48 +227,46 @@ def vis_of_vertices(vertices, triangles, h, w, depth_buffer = None):
         depth_buffer: height x width
     Returns:
         vertices_vis: nver. the visibility of each vertex
+    A vertex is visible if its depth is close to the depth buffer at its
+    nearest pixel, and no previous vertex at this pixel is in front of it.
     '''
-    if depth_buffer == None:
+    if depth_buffer is None:
         depth_buffer = get_depth_buffer(vertices, triangles, h, w)
 
     vertices_vis = np.zeros(vertices.shape[1], dtype = bool)
-    
-    depth_tmp = np.zeros_like(depth_buffer) - 99999
-    for i in range(vertices.shape[1]):
-        vertex = vertices[:, i]
-
-        if np.floor(vertex[0]) < 0 or np.ceil(vertex[0]) > w-1 or np.floor(vertex[1]) < 0 or np.ceil(vertex[1]) > h-1:
-            continue        
-        
-        # bilinear interp 
-        # ul = depth_buffer[int(np.floor(vertex[1])), int(np.floor(vertex[0]))]
-        # ur = depth_buffer[int(np.floor(vertex[1])), int(np.ceil(vertex[0]))]
-        # dl = depth_buffer[int(np.ceil(vertex[1])), int(np.floor(vertex[0]))]
-        # dr = depth_buffer[int(np.ceil(vertex[1])), int(np.ceil(vertex[0]))]
-        
-        # yd = vertex[1] - np.floor(vertex[1])
-        # xd = vertex[0] - np.floor(vertex[0])
-
-        # vertex_depth = ul*(1-xd)*(1-yd) + ur*xd*(1-yd) + dl*(1-xd)*yd + dr*xd*yd
-        
-        # nearest
-        px = int(np.round(vertex[0]))
-        py = int(np.round(vertex[1]))
-
-        # if (vertex[2] > depth_buffer[ul[0], ul[1]]) & (vertex[2] > depth_buffer[ur[0], ur[1]]) & (vertex[2] > depth_buffer[dl[0], dl[1]]) & (vertex[2] > depth_buffer[dr[0], dr[1]]):
-        if vertex[2] < depth_tmp[py, px]:
-            continue
-        
-        # if vertex[2] > depth_buffer[py, px]:
-        #     vertices_vis[i] = True
-        #     depth_tmp[py, px] = vertex[2]
-        # elif np.abs(vertex[2] - depth_buffer[py, px]) < 1:
-        #     vertices_vis[i] = True
-
-        threshold = 2 # need to be optimized.
-        if np.abs(vertex[2] - depth_buffer[py, px]) < threshold:
-        # if np.abs(vertex[2] - vertex_depth) < threshold:
-            vertices_vis[i] = True
-            depth_tmp[py, px] = vertex[2]
 
+    inside = (np.floor(vertices[0]) >= 0) & (np.ceil(vertices[0]) <= w-1) & \
+        (np.floor(vertices[1]) >= 0) & (np.ceil(vertices[1]) <= h-1)
+    ind = np.nonzero(inside)[0]
+
+    # nearest
+    px = np.round(vertices[0, ind]).astype(int)
+    py = np.round(vertices[1, ind]).astype(int)
+    z = vertices[2, ind]
+
+    threshold = 2 # need to be optimized.
+    close = (np.abs(z - depth_buffer[py, px]) < threshold) & (z >= -99999)
+    ind, pix, z = ind[close], (py * w + px)[close], z[close]
+    if len(ind) == 0:
+        return vertices_vis
+
+    # The visible vertices of a pixel have non decreasing depths in vertex
+    # order, so a vertex is visible if no previous vertex of its pixel is
+    # strictly in front of it: the smallest index among the vertices with
+    # a bigger depth must come after it.
+    order = np.lexsort((ind, -z, pix))
+    ind, pix, z = ind[order], pix[order], z[order]
+    seg = np.cumsum(np.r_[0, pix[1:] != pix[:-1]])
+    n = vertices.shape[1] + 1
+    run_min = np.minimum.accumulate(ind + (seg[-1] - seg) * n) - (seg[-1] - seg) * n
+
+    # minimum over the strictly bigger depths: the run before the tie group
+    tie_start = np.r_[True, (pix[1:] != pix[:-1]) | (z[1:] != z[:-1])]
+    start = np.maximum.accumulate(np.where(tie_start, np.arange(len(ind)), 0))
+    prev = start - 1
+    first_of_pixel = np.r_[True, pix[1:] != pix[:-1]]
+    seg_start = np.maximum.accumulate(np.where(first_of_pixel, np.arange(len(ind)), 0))
+    front_min = np.where(prev >= seg_start, run_min[np.maximum(prev, 0)], n)
+
+    vertices_vis[ind[front_min > ind]] = True
     return vertices_vis
@@ -1,5 +1,6 @@
 import sys
 import time
+from functools import lru_cache
 
 import cv2
 import numpy as np
@@ -49,31 +50,42 @@ args = update_parser(parser)
 # ======================
 # Utils
 # ======================
-def grid_sample(img, grid):
-    height, width, c = img.shape
-    output = np.zeros_like(img)
-    grid[:, :, 0] = (grid[:, :, 0] + 1) * (width-1) / 2
-    grid[:, :, 1] = (grid[:, :, 1] + 1) * (height-1) / 2
-    # TODO speed up here
-    for h in range(height):
-        for w in range(width):
-            h_ = int(grid[h, w, 1])
-            w_ = int(grid[h, w, 0])
-            output[h, w] = img[h_, w_]
-    return output
+@lru_cache(maxsize=4)
+def map_buffers(height, width):
+    """Remap coordinate buffers, reused while the document size repeats"""
+    return (
+        np.empty((height, width), dtype=np.float32),
+        np.empty((height, width), dtype=np.float32),
+    )
+
+
+def backward_map(bm, height, width):
+    """
+    Pixel coordinates of the (2, H', W') backward map in [-1, 1],
+    smoothed and resized to the image size.
+    The scaling is done on the small map, before the resize.
+    """
+    map_x, map_y = map_buffers(height, width)
+    bm0 = (bm[0] + 1) * ((width - 1) / 2)
+    bm1 = (bm[1] + 1) * ((height - 1) / 2)
+    cv2.resize(cv2.blur(bm0, (3, 3)), (width, height), dst=map_x)
+    cv2.resize(cv2.blur(bm1, (3, 3)), (width, height), dst=map_y)
+    return map_x, map_y
 
 
 def unwarp(img, bm):
-    w, h = img.shape[0], img.shape[1]
-    bm = bm.transpose(1, 2, 0)
-    bm0 = cv2.blur(bm[:, :, 0], (3, 3))
-    bm1 = cv2.blur(bm[:, :, 1], (3, 3))
-    bm0 = cv2.resize(bm0, (h, w))
-    bm1 = cv2.resize(bm1, (h, w))
-    bm = np.stack([bm0, bm1], axis=-1)
-    img = img.astype(float) / 255.0
-    res = grid_sample(img, bm)
-    return res
+    """
+    Unwarp the uint8 image with the (2, H', W') backward map,
+    in one remap of the image as it is.
+    A batch of images with (N, 2, H', W') backward maps is also accepted
+    """
+    if bm.ndim == 4:
+        return np.stack([unwarp(i, b) for i, b in zip(img, bm)])
+    h, w = img.shape[0], img.shape[1]
+    map_x, map_y = backward_map(bm.astype(np.float32), h, w)
+    return cv2.remap(
+        img, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+    )
 
 
 # ======================
@@ -122,7 +134,7 @@ def unwarp_from_image():
 
         savepath = get_savepath(args.savepath, image_path)
         logger.info(f'saved at : {savepath}')
-        cv2.imwrite(savepath, uwpred * 255)
+        cv2.imwrite(savepath, uwpred)
     logger.info('Script finished successfully.')
 
 
@@ -135,9 +147,6 @@ def unwarp_from_video():
 
     # create video writer if savepath is specified as video format
     if args.savepath != SAVE_IMAGE_PATH:
-        logger.warning(
-            'currently, video results cannot be output correctly...'
-        )
         f_h = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
         f_w = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
         save_h, save_w = webcamera_utils.calc_adjust_fsize(
@@ -159,12 +168,10 @@ def unwarp_from_video():
         uwpred = run_inference(wc_net, bm_net, input_data, org_image)
 
         cv2.imshow('frame', uwpred)
-        # TODO: FIXME:
-        # >>> error: (-215:Assertion failed)
-        # >>> image.depth() == CV_8U in function 'write'
-        # # save results
-        # if writer is not None:
-        #     writer.write(uwpred)
+
+        # save results
+        if writer is not None:
+            writer.write(uwpred)
 
     capture.release()
     cv2.destroyAllWindows()
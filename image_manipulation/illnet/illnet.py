@@ -13,6 +13,7 @@ from illnet_utils import *
 sys.path.append('../../util')
 from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
+from tiling_utils import tiled_inference  # noqa: E402
 import webcamera_utils  # noqa: E402
 
 # logger
@@ -31,6 +32,7 @@ IMAGE_PATH = 'input.png'
 SAVE_IMAGE_PATH = 'output.png'
 
 PATCH_RES = 128
+PATCH_OVERLAP = PATCH_RES // 8
 
 
 # ======================
@@ -39,12 +41,35 @@ PATCH_RES = 128
 parser = get_base_parser(
     'Illumination Correction Model', IMAGE_PATH, SAVE_IMAGE_PATH
 )
+parser.add_argument(
+    '--batch_size', type=int, default=16,
+    help='number of patches computed by one inference'
+)
 args = update_parser(parser)
 
 
 # ======================
 # Main functions
 # ======================
+def predict_patches(net, img):
+    """
+    Run the model over overlapping patches of the whole image, and blend
+    them back into an image of the same size
+    """
+    input_data = img.transpose((2, 0, 1)).astype(np.float32) / 255.0
+    input_data = (input_data - 0.5) / 0.5
+
+    def predict(patches):
+        net.set_input_shape(patches.shape)
+        return np.clip(net.predict(patches), 0, 1)
+
+    out = tiled_inference(
+        input_data, predict, PATCH_RES, overlap=PATCH_OVERLAP,
+        batch_size=args.batch_size, pad_mode='edge',
+    )
+    return (out.transpose((1, 2, 0)) * 255).astype(np.uint8)
+
+
 def recognize_from_image():
     # net initialize
     net = ailia.Net(MODEL_PATH, WEIGHT_PATH, env_id=args.env_id)
@@ -55,15 +80,6 @@ def recognize_from_image():
         logger.info(image_path)
         img = io.imread(image_path)
         img = preProcess(img)
-        input_data = padCropImg(img)
-        input_data = input_data.astype(np.float32) / 255.0
-
-        ynum = input_data.shape[0]
-        xnum = input_data.shape[1]
-
-        preds_ailia = np.zeros(
-            (ynum, xnum, PATCH_RES, PATCH_RES, 3), dtype=np.float32
-        )
 
         # inference
         logger.info('Start inference...')
@@ -71,38 +87,13 @@ def recognize_from_image():
             logger.info('BENCHMARK mode')
             for c in range(5):
                 start = int(round(time.time() * 1000))
-
-                for j in range(ynum):
-                    for i in range(xnum):
-                        patchImg = input_data[j, i]
-                        patchImg = (patchImg - 0.5) / 0.5
-                        patchImg = patchImg.transpose((2, 0, 1))
-                        patchImg = patchImg[np.newaxis, :, :, :]
-                        out = net.predict(patchImg)
-                        out = out.transpose((0, 2, 3, 1))[0]
-                        out = (np.clip(out, 0, 1) * 255).astype(np.uint8)
-                        preds_ailia[j, i] = out
-
+                resImg = predict_patches(net, img)
                 end = int(round(time.time() * 1000))
                 logger.info(f'\tailia processing time {end - start} ms')
         else:
-            start = int(round(time.time() * 1000))
-
-            for j in range(ynum):
-                for i in range(xnum):
-                    patchImg = input_data[j, i]
-                    patchImg = (patchImg - 0.5) / 0.5
-                    patchImg = patchImg.transpose((2, 0, 1))
-                    patchImg = patchImg[np.newaxis, :, :, :]
-                    out = net.predict(patchImg)
-                    out = out.transpose((0, 2, 3, 1))[0]
-                    out = (np.clip(out, 0, 1) * 255).astype(np.uint8)
-                    preds_ailia[j, i] = out
-
-            end = int(round(time.time() * 1000))
+            resImg = predict_patches(net, img)
 
         # postprocessing
-        resImg = composePatch(preds_ailia)
         resImg = postProcess(resImg)
         savepath = get_savepath(args.savepath, image_path)
         logger.info(f'saved at : {savepath}')
@@ -122,17 +113,7 @@ def recognize_from_video():
     if args.savepath != SAVE_IMAGE_PATH:
         f_h = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
         f_w = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
-        dummy_img = np.zeros((f_h, f_w, 3))
-        dummy_img = padCropImg(dummy_img)
-        ynum = dummy_img.shape[0]
-        xnum = dummy_img.shape[1]
-        dummy_img = np.zeros(
-            (ynum, xnum, PATCH_RES, PATCH_RES, 3), dtype=np.float32
-        )
-        dummy_img = composePatch(dummy_img)
-        writer = webcamera_utils.get_writer(
-            args.savepath, dummy_img.shape[0], dummy_img.shape[1]
-        )
+        writer = webcamera_utils.get_writer(args.savepath, f_h, f_w)
     else:
         writer = None
 
@@ -142,28 +123,7 @@ def recognize_from_video():
             break
 
         img = preProcess(frame)
-        input_data = padCropImg(img)
-        input_data = input_data.astype(np.float32) / 255.0
-
-        ynum = input_data.shape[0]
-        xnum = input_data.shape[1]
-
-        preds_ailia = np.zeros(
-            (ynum, xnum, PATCH_RES, PATCH_RES, 3), dtype=np.float32
-        )
-
-        for j in range(ynum):
-            for i in range(xnum):
-                patchImg = input_data[j, i]
-                patchImg = (patchImg - 0.5) / 0.5
-                patchImg = patchImg.transpose((2, 0, 1))
-                patchImg = patchImg[np.newaxis, :, :, :]
-                out = net.predict(patchImg)
-                out = out.transpose((0, 2, 3, 1))[0]
-                out = (np.clip(out, 0, 1) * 255).astype(np.uint8)
-                preds_ailia[j, i] = out
-
-                resImg = composePatch(preds_ailia)
+        resImg = predict_patches(net, img)
         resImg = postProcess(resImg)
 
         resImg = img_as_ubyte(resImg)
@@ -15,7 +15,7 @@ NUM_GRIDS = [40, 36, 24, 16, 12]
 FPN_INSTANCE_STRIDES = [8, 8, 16, 32, 32]
 MASK_THR = 0.5
 NMS_PRE = 500
-NMS_TYPE = 'mask'
+NMS_TYPE = 'matrix'
 NMS_SIGMA = 2
 NMS_KERNEL = 'gaussian'
 UPDATE_THR = 0.05
@@ -106,46 +106,52 @@ def point_nms(heat, kernel=2):
     """
     # kernel must be 2
     hmax = np.expand_dims(pool2d(heat.squeeze(), kernel, 1, 1), (0, 1))
-    keep = (hmax[:, :, :-1, :-1] == heat).astype(np.float)
+    keep = (hmax[:, :, :-1, :-1] == heat).astype(np.float32)
     return heat * keep
 
-def matrix_nms(cate_labels, seg_masks, sum_masks, cate_scores, sigma=2.0, kernel='gaussian'):
+def mask_iou_matrix(cate_labels, seg_masks, sum_masks):
     """
-    Ref.: https://github.com/aim-uofa/AdelaiDet
+    Upper triangular (N, N) float32 IoU of the masks, zero between
+    different labels, with the intersections from a single matrix product
     """
     n_samples = len(cate_labels)
-    if n_samples == 0:
-        return []
-
-    seg_masks = seg_masks.reshape(n_samples, -1).float()
+    seg_masks = seg_masks.reshape(n_samples, -1).astype(np.float32)
+    sum_masks = sum_masks.astype(np.float32)
     # inter.
     inter_matrix = seg_masks @ seg_masks.T
     # union.
-    sum_masks_x = sum_masks.expand(n_samples, n_samples)
+    union_matrix = sum_masks[:, None] + sum_masks[None, :] - inter_matrix
     # iou.
-    iou_matrix = (inter_matrix / (sum_masks_x + sum_masks_x.transpose(1, 0) - inter_matrix)).triu(diagonal=1)
+    iou_matrix = np.divide(
+        inter_matrix, union_matrix,
+        out=np.zeros_like(inter_matrix), where=union_matrix > 0)
     # label_specific matrix.
-    cate_labels_x = cate_labels.expand(n_samples, n_samples)
-    label_matrix = (cate_labels_x == cate_labels_x.transpose(1, 0)).float().triu(diagonal=1)
+    label_matrix = cate_labels[:, None] == cate_labels[None, :]
+    return np.triu(iou_matrix * label_matrix, k=1)
 
-    # IoU compensation
-    compensate_iou, _ = (iou_matrix * label_matrix).max(0)
-    compensate_iou = compensate_iou.expand(n_samples, n_samples).transpose(1, 0)
+def matrix_nms(cate_labels, seg_masks, sum_masks, cate_scores, sigma=2.0, kernel='gaussian'):
+    """
+    Ref.: https://github.com/aim-uofa/AdelaiDet
+    """
+    n_samples = len(cate_labels)
+    if n_samples == 0:
+        return cate_scores
 
     # IoU decay / soft nms
-    delay_iou = iou_matrix * label_matrix
+    decay_iou = mask_iou_matrix(cate_labels, seg_masks, sum_masks)
+
+    # IoU compensation
+    compensate_iou = decay_iou.max(0)[:, None]
 
     # matrix nms
     if kernel == 'linear':
-        delay_matrix = (1 - delay_iou) / (1 - compensate_iou)
-        delay_coefficient, _ = delay_matrix.min(0)
+        decay_matrix = (1 - decay_iou) / (1 - compensate_iou)
     else:
-        delay_matrix = np.exp(-1 * sigma * (delay_iou ** 2))
-        compensate_matrix = np.exp(-1 * sigma * (compensate_iou ** 2))
-        delay_coefficient, _ = (delay_matrix / compensate_matrix).min(0)
+        decay_matrix = np.exp(-1 * sigma * (decay_iou ** 2 - compensate_iou ** 2))
+    decay_coefficient = decay_matrix.min(0)
 
     # update the score.
-    cate_scores_update = cate_scores * delay_coefficient
+    cate_scores_update = cate_scores * decay_coefficient
 
     return cate_scores_update
 
@@ -155,31 +161,19 @@ def mask_nms(cate_labels, seg_masks, sum_masks, cate_scores, nms_thr=0.5):
     """
     n_samples = len(cate_scores)
     if n_samples == 0:
-        return []
-
-    keep = np.ones(cate_scores.shape)
-    seg_masks = seg_masks.astype(float)
-
-    for i in range(n_samples - 1):
-        if not keep[i]:
-            continue
-        mask_i = seg_masks[i]
-        label_i = cate_labels[i]
-        for j in range(i + 1, n_samples, 1):
-            if not keep[j]:
-                continue
-            mask_j = seg_masks[j]
-            label_j = cate_labels[j]
-            if label_i != label_j:
-                continue
-            # overlaps
-            inter = (mask_i * mask_j).sum()
-            union = sum_masks[i] + sum_masks[j] - inter
-            if union > 0:
-                if inter / union > nms_thr:
-                    keep[j] = False
-            else:
-                keep[j] = False
+        return np.zeros(0, dtype=bool)
+
+    # a mask suppresses the following ones of the same label which overlap
+    # it, or have an empty union with it
+    iou_matrix = mask_iou_matrix(cate_labels, seg_masks, sum_masks)
+    suppress = np.triu(iou_matrix > nms_thr, k=1)
+    empty = (sum_masks[:, None] + sum_masks[None, :]) == 0
+    suppress |= np.triu(empty & (cate_labels[:, None] == cate_labels[None, :]), k=1)
+
+    keep = np.ones(n_samples, dtype=bool)
+    for i in np.nonzero(suppress.any(1))[0]:
+        if keep[i]:
+            keep &= ~suppress[i]
     return keep
 
 def inference_single_image(cate_preds, kernel_preds, seg_preds, cur_size, ori_size):
@@ -218,18 +212,16 @@ def inference_single_image(cate_preds, kernel_preds, seg_preds, cur_size, ori_si
         strides[size_trans[ind_ - 1]:size_trans[ind_]] *= FPN_INSTANCE_STRIDES[ind_]
     strides = strides[inds[0]]
 
-    # mask encoding.
+    # mask encoding, (N, I) kernels x (I, HW) features.
     N, I = kernel_preds.shape
-    kernel_preds = kernel_preds.reshape(N, I, 1, 1)
-    B, _, H, W = seg_preds.shape
-    tmp = np.empty((B, N, H, W))
-    for i in range(N):
-        tmp[0, i] = np.sum(seg_preds[0] * kernel_preds[i], axis=0)
-    seg_preds = expit(tmp.squeeze(0))
+    _, _, H, W = seg_preds.shape
+    seg_preds = kernel_preds.astype(np.float32) @ \
+        seg_preds[0].reshape(I, H * W).astype(np.float32)
+    seg_preds = expit(seg_preds).reshape(N, H, W)
 
     # mask.
     seg_masks = seg_preds > MASK_THR
-    sum_masks = seg_masks.sum((1, 2)).astype(float)
+    sum_masks = seg_masks.sum((1, 2)).astype(np.float32)
 
     # filter.
     keep = sum_masks > strides
@@ -243,7 +235,7 @@ def inference_single_image(cate_preds, kernel_preds, seg_preds, cur_size, ori_si
     cate_labels = cate_labels[keep]
 
     # mask scoring.
-    seg_scores = (seg_preds * seg_masks.astype(float)).sum((1, 2)) / sum_masks
+    seg_scores = (seg_preds * seg_masks).sum((1, 2)) / sum_masks
     cate_scores *= seg_scores
 
     # sort and keep top nms_pre
@@ -284,19 +276,12 @@ def inference_single_image(cate_preds, kernel_preds, seg_preds, cur_size, ori_si
     cate_scores = cate_scores[sort_inds]
     cate_labels = cate_labels[sort_inds]
 
-    # reshape to original size.
+    # reshape to original size, all the masks as channels of one image.
     C, _, _ = seg_preds.shape
-    H, W = upsampled_size_out
-    tmp = np.empty((C, H, W))
-    for i in range(C):
-        tmp[i] = cv2.resize(seg_preds[i], (W, H))
-    seg_preds = tmp
-    H, W = ori_size
-    tmp = np.empty((C, H, W))
-    for i in range(C):
-        tmp[i] = cv2.resize(seg_preds[i], (W, H))
-    seg_masks = tmp
-    seg_masks = seg_masks > MASK_THR
+    seg_preds = seg_preds.transpose(1, 2, 0)
+    for H, W in (upsampled_size_out, ori_size):
+        seg_preds = cv2.resize(seg_preds, (W, H)).reshape(H, W, C)
+    seg_masks = seg_preds.transpose(2, 0, 1) > MASK_THR
 
     pred_classes = cate_labels
     scores = cate_scores
@@ -1,6 +1,7 @@
 import sys
 import time
 import math
+from functools import lru_cache
 
 import cv2
 import numpy as np
@@ -15,6 +16,7 @@ from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from image_utils import load_image  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
 import webcamera_utils  # noqa: E402
+from plot3d_utils import SkeletonRenderer3d  # noqa: E402
 
 # logger
 from logging import getLogger   # noqa: E402
@@ -122,6 +124,42 @@ openpose_to_3dposebaseline = [
     -1, 8, 9, 10, 11, 12, 13, -1, 1, 0, 5, 6, 7, 2, 3, 4
 ]
 
+PLOT_EDGES = {
+    True: [
+        ("Head", "Thorax", "#0000aa"),
+        ("Thorax", 'RShoulder', "#00ff00"),
+        ('RShoulder', 'RElbow', "#00ff00"),
+        ('RElbow', 'RWrist', "#00ff00"),
+        ("Thorax", 'LShoulder', "#00ff00"),
+        ('LShoulder', 'LElbow', "#00ff00"),
+        ('LElbow', 'LWrist', "#00ff00"),
+        ('Thorax', 'Spine', "#00ff00"),
+        ('Spine', 'LHip', "#00ff00"),
+        ('Spine', 'RHip', "#00ff00"),
+        ('RHip', 'RKnee', "#ff0000"),
+        ('RKnee', 'RFoot', "#ff0000"),
+        ('LHip', 'LKnee', "#ff0000"),
+        ('LKnee', 'LFoot', "#ff0000"),
+    ],
+    False: [
+        ("Head", "Thorax", "#0000ff"),
+        ("Thorax", 'RShoulder', "#00ff00"),
+        ('RShoulder', 'RElbow', "#00ff00"),
+        ('RElbow', 'RWrist', "#00ff00"),
+        ("Thorax", 'LShoulder', "#00ff00"),
+        ('LShoulder', 'LElbow', "#00ff00"),
+        ('LElbow', 'LWrist', "#00ff00"),
+        ('Thorax', 'Spine', "#00ff00"),
+        ('Spine', 'Hip', "#00ff00"),
+        ('Hip', 'LHip', "#ff0000"),
+        ('Hip', 'RHip', "#ff0000"),
+        ('RHip', 'RKnee', "#ff0000"),
+        ('RKnee', 'RFoot', "#ff0000"),
+        ('LHip', 'LKnee', "#ff0000"),
+        ('LKnee', 'LFoot', "#ff0000"),
+    ],
+}
+
 fig = plt.figure()
 ax = Axes3D(fig)
 ax.view_init(18, -70)
@@ -185,40 +223,54 @@ def plot(outputs, inputs):
                 Y.append(inputs[i*2+1]*data_std_2d[j*2+1]+data_mean_2d[j*2+1])
                 Z.append(0)
 
-        if(IS_3D):
-            draw_connect("Head", "Thorax", "#0000aa", X, Y, Z, IS_3D)
-            draw_connect("Thorax", 'RShoulder', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('RShoulder', 'RElbow', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('RElbow', 'RWrist', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect("Thorax", 'LShoulder', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('LShoulder', 'LElbow', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('LElbow', 'LWrist', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('Thorax', 'Spine', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('Spine', 'LHip', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('Spine', 'RHip', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('RHip', 'RKnee', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('RKnee', 'RFoot', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('LHip', 'LKnee', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('LKnee', 'LFoot', "#ff0000", X, Y, Z, IS_3D)
-        else:
-            draw_connect("Head", "Thorax", "#0000ff", X, Y, Z, IS_3D)
-            draw_connect("Thorax", 'RShoulder', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('RShoulder', 'RElbow', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('RElbow', 'RWrist', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect("Thorax", 'LShoulder', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('LShoulder', 'LElbow', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('LElbow', 'LWrist', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('Thorax', 'Spine', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('Spine', 'Hip', "#00ff00", X, Y, Z, IS_3D)
-            draw_connect('Hip', 'LHip', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('Hip', 'RHip', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('RHip', 'RKnee', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('RKnee', 'RFoot', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('LHip', 'LKnee', "#ff0000", X, Y, Z, IS_3D)
-            draw_connect('LKnee', 'LFoot', "#ff0000", X, Y, Z, IS_3D)
-
-
-def display_3d_pose(points, baseline):
+        for from_id, to_id, color in PLOT_EDGES[IS_3D]:
+            draw_connect(from_id, to_id, color, X, Y, Z, IS_3D)
+
+
+def pose_coordinates(outputs, inputs, IS_3D):
+    """(16, 3) joints of the 3d output, or of the 2d input at Z=0"""
+    if IS_3D:
+        return np.asarray(outputs[:48], dtype=np.float32).reshape(16, 3)
+    j = np.array(h36m_2d_mean)
+    xy = np.asarray(inputs[:32]).reshape(16, 2) * \
+        data_std_2d.reshape(-1, 2)[j] + data_mean_2d.reshape(-1, 2)[j]
+    return np.concatenate((xy, np.zeros((16, 1))), axis=1)
+
+
+@lru_cache(maxsize=None)
+def plot_edges(IS_3D):
+    """joint index pairs and BGR colors of PLOT_EDGES, for the renderer"""
+    edges, colors = [], []
+    for from_id, to_id, color in PLOT_EDGES[IS_3D]:
+        from_id = search_name(from_id, IS_3D)
+        to_id = search_name(to_id, IS_3D)
+        if from_id == -1 or to_id == -1:
+            continue
+        edges.append((from_id, to_id))
+        colors.append(tuple(int(color[k:k + 2], 16) for k in (5, 3, 1)))
+    return np.array(edges), colors
+
+
+def create_renderer(canvas_size=(480, 640)):
+    # same view as the matplotlib figure
+    return SkeletonRenderer3d(canvas_size, elev=18, azim=-70)
+
+
+def render(renderer, outputs, inputs):
+    """OpenCV version of plot, returns the BGR canvas"""
+    # plot axes are (X, Z, Y), with the Y axis going down
+    poses = [pose_coordinates(outputs, inputs, IS_3D)[:, [0, 2, 1]] *
+             np.array([1, 1, -1]) for IS_3D in (True, False)]
+    renderer.fit(np.concatenate(poses))
+
+    img = renderer.canvas.copy()
+    for IS_3D, pose in zip((True, False), poses):
+        edges, colors = plot_edges(IS_3D)
+        renderer.draw(img, pose, edges, colors, thickness=1, radius=2)
+    return img
+
+
+def display_3d_pose(points, baseline, renderer=None):
     inputs = np.zeros(32)
 
     for i in range(16):
@@ -261,6 +313,8 @@ def display_3d_pose(points, baseline):
         outputs[i*3+1] = dy*math.cos(theta) + dz*math.sin(theta)
         outputs[i*3+2] = -dy*math.sin(theta) + dz*math.cos(theta)
 
+    if renderer is not None:
+        return render(renderer, outputs, inputs)
     plot(outputs, inputs)
 
 
@@ -287,7 +341,8 @@ def line(input_img, person, point1, point2):
         cv2.line(input_img, (x1, y1), (x2, y2), color, 5)
 
 
-def display_result(input_img, pose, baseline):
+def display_result(input_img, pose, baseline, renderer=None):
+    canvas_3d = None if renderer is None else renderer.canvas.copy()
     count = pose.get_object_count()
     if count >= 1:
         count = 1
@@ -417,7 +472,9 @@ def display_result(input_img, pose, baseline):
                 target_width/input_img.shape[1]
             )
 
-        display_3d_pose(points, baseline)
+        canvas_3d = display_3d_pose(points, baseline, renderer)
+
+    return canvas_3d
 
 
 # ======================
@@ -495,6 +552,9 @@ def recognize_from_video():
     else:
         writer = None
 
+    # 3d pose is drawn with OpenCV, matplotlib is too slow for video
+    renderer = create_renderer()
+
     while(True):
         ret, frame = capture.read()
         if (cv2.waitKey(1) & 0xFF == ord('q')) or not ret:
@@ -509,13 +569,11 @@ def recognize_from_video():
         _ = pose.compute(input_data)
 
         # postprocessing
-        display_result(input_image, pose, baseline)
+        canvas_3d = display_result(input_image, pose, baseline, renderer)
         cv2.imshow('frame', input_image)
 
         # display 3d pose
-        plt.pause(0.01)
-        if not plt.get_fignums():
-            break
+        cv2.imshow('3d pose', canvas_3d)
         # # save results
         # if writer is not None:
         #     writer.write(res_img)
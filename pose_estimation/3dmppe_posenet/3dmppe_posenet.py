@@ -21,6 +21,7 @@ sys.path.append('../../util')
 from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
 import webcamera_utils  # noqa: E402
+from plot3d_utils import SkeletonRenderer3d  # noqa: E402
 
 # logger
 from logging import getLogger   # noqa: E402
@@ -81,8 +82,7 @@ def preprocess_maskrcnn(image):
 
     # Normalize
     mean_vec = np.array([102.9801, 115.9465, 122.7717])
-    for i in range(image.shape[0]):
-        image[i, :, :] = image[i, :, :] - mean_vec[i]
+    image -= mean_vec[:, np.newaxis, np.newaxis]
 
     # Pad to be divisible of 32
     padded_h = int(math.ceil(image.shape[1] / 32) * 32)
@@ -214,10 +214,11 @@ def process_bbox(bbox, width, height):
 
 
 def pixel2cam(pixel_coord, f, c):
-    x = (pixel_coord[:, 0] - c[0]) / f[0] * pixel_coord[:, 2]
-    y = (pixel_coord[:, 1] - c[1]) / f[1] * pixel_coord[:, 2]
-    z = pixel_coord[:, 2]
-    cam_coord = np.concatenate((x[:,None], y[:,None], z[:,None]),1)
+    # pixel_coord: (..., 3), any number of leading axes (persons, joints)
+    x = (pixel_coord[..., 0] - c[0]) / f[0] * pixel_coord[..., 2]
+    y = (pixel_coord[..., 1] - c[1]) / f[1] * pixel_coord[..., 2]
+    z = pixel_coord[..., 2]
+    cam_coord = np.stack((x, y, z), -1)
     return cam_coord
 
 
@@ -300,7 +301,27 @@ def vis_3d_multiple_skeleton(kpt_3d, kpt_3d_vis, kps_lines, fig_h, fig_w):
     plt.close()
 
     return vis_img
-        
+
+
+def create_skeleton_renderer(fig_h, fig_w):
+    # same view as vis_3d_multiple_skeleton, plot axes are (x, z, -y)
+    return SkeletonRenderer3d(
+        (fig_h, fig_w), elev=10, azim=330,
+        limits=((-2000, 2000), (5000, 25000), (-2000, 2000)),
+    )
+
+
+def render_3d_multiple_skeleton(renderer, kpt_3d, kps_lines):
+    """OpenCV version of vis_3d_multiple_skeleton, for video"""
+    cmap = plt.get_cmap('rainbow')
+    colors = [cmap(i) for i in np.linspace(0, 1, len(kps_lines) + 2)]
+    colors = [(c[2] * 255, c[1] * 255, c[0] * 255) for c in colors]
+
+    points = np.stack(
+        (kpt_3d[..., 0], kpt_3d[..., 2], -kpt_3d[..., 1]), axis=-1)
+    return renderer.render(
+        points, kps_lines, colors[:len(kps_lines)], thickness=2, radius=3)
+
 
 def generate_patch_image(cvimg, bbox, do_flip, scale, rot, do_occlusion):
     img = cvimg.copy()
@@ -404,14 +425,32 @@ def transform(img):
     #                                                      std=cfg.pixel_std)])
     img = np.array(img).astype(np.float32)
     img = img.transpose(2, 0, 1)
-    for rgb_i in range(3):
-        img[rgb_i, :, :] = img[rgb_i, :, :] - cfg.pixel_mean[rgb_i]
-    for rgb_i in range(3):
-        img[rgb_i, :, :] = img[rgb_i, :, :] / cfg.pixel_std[rgb_i]
-    return img
+    mean = np.array(cfg.pixel_mean, dtype=np.float32)[:, None, None]
+    std = np.array(cfg.pixel_std, dtype=np.float32)[:, None, None]
+    return (img - mean) / std
+
+
+def set_batch_shape(net, *shapes):
+    # one shape per input blob, in input order
+    for blob_idx, shape in zip(net.get_input_blob_list(), shapes):
+        net.set_input_blob_shape(shape, blob_idx)
+
+
+def predict_batch(net, inputs):
+    set_batch_shape(net, *[x.shape for x in inputs])
+    if args.benchmark:
+        logger.info('BENCHMARK mode')
+        for i in range(5):
+            start = int(round(time.time() * 1000))
+            outputs = net.predict(inputs)
+            end = int(round(time.time() * 1000))
+            logger.info(f'\tailia processing time {end - start} ms')
+    else:
+        outputs = net.predict(inputs)
+    return outputs[0]
 
 
-def posenet_to_image(original_img, bbox_list, net_root, net_pose, benchmark=False):
+def posenet_to_image(original_img, bbox_list, net_root, net_pose, benchmark=False, renderer=None):
     # refer from [https://github.com/mks0601/3DMPPE_ROOTNET_RELEASE/blob/master/demo/demo.py]
     # refer from [https://github.com/mks0601/3DMPPE_POSENET_RELEASE/blob/master/demo/demo.py]
     # MuCo joint set
@@ -423,59 +462,52 @@ def posenet_to_image(original_img, bbox_list, net_root, net_pose, benchmark=Fals
     # prepare input image
     original_img_height, original_img_width = original_img.shape[:2]
 
-    # prepare bbox
-    person_num = len(bbox_list)
-
     # normalized camera intrinsics
     focal = [1500, 1500] # x-axis, y-axis
     princpt = [original_img_width/2, original_img_height/2] # x-axis, y-axis
 
-    # for each cropped and resized human image, forward it to PoseNet
-    output_pose_2d_list = []
-    output_pose_3d_list = []
-    for n in range(person_num):
-        bbox = process_bbox(np.array(bbox_list[n]), original_img_width, original_img_height)
-        img, img2bb_trans = generate_patch_image(original_img, bbox, False, 1.0, 0.0, False) 
-        img = transform(img)[None,:,:,:]
-        k_value = np.array([math.sqrt(cfg.bbox_real[0]*cfg.bbox_real[1]*focal[0]*focal[1]/(bbox[2]*bbox[3]))]).astype(np.float32)
-        k_value = k_value[None,:]
+    # crop and resize all humans, then forward them to RootNet and PoseNet
+    # as one batch
+    bboxes = [
+        process_bbox(np.array(bbox), original_img_width, original_img_height)
+        for bbox in bbox_list
+    ]
+    valid = [bbox is not None for bbox in bboxes]
+    bbox_list = bbox_list[valid]
+    bboxes = np.array([bbox for bbox in bboxes if bbox is not None]).reshape(-1, 4)
+    person_num = len(bboxes)
+
+    output_pose_2d_list = np.zeros((person_num, joint_num, 2))
+    output_pose_3d_list = np.zeros((person_num, joint_num, 3))
+    if person_num > 0:
+        patches = [
+            generate_patch_image(original_img, bbox, False, 1.0, 0.0, False)
+            for bbox in bboxes
+        ]
+        img = np.stack([transform(patch) for patch, _ in patches])
+        img2bb_trans = np.stack([trans for _, trans in patches])
+        k_value = np.sqrt(
+            cfg.bbox_real[0] * cfg.bbox_real[1] * focal[0] * focal[1] /
+            (bboxes[:, 2] * bboxes[:, 3])
+        ).astype(np.float32)[:, None]
 
         # inference
-        if args.benchmark:
-            logger.info('BENCHMARK mode')
-            for i in range(5):
-                start = int(round(time.time() * 1000))
-                root_3d = net_root.predict([img, k_value])[0]
-                end = int(round(time.time() * 1000))
-                logger.info(f'\tailia processing time {end - start} ms')
-        else:
-            root_3d = net_root.predict([img, k_value])[0]
-        root_3d = root_3d[0]
-
-        # inference
-        if args.benchmark:
-            logger.info('BENCHMARK mode')
-            for i in range(5):
-                start = int(round(time.time() * 1000))
-                pose_3d = net_pose.predict([img])[0]
-                end = int(round(time.time() * 1000))
-                logger.info(f'\tailia processing time {end - start} ms')
-        else:
-            pose_3d = net_pose.predict([img])[0]
+        root_3d = predict_batch(net_root, [img, k_value])
+        pose_3d = predict_batch(net_pose, [img])
 
         # inverse affine transform (restore the crop and resize)
-        pose_3d = pose_3d[0]
-        pose_3d[:,0] = pose_3d[:,0] / cfg.output_shape[1] * cfg.input_shape[1]
-        pose_3d[:,1] = pose_3d[:,1] / cfg.output_shape[0] * cfg.input_shape[0]
-        pose_3d_xy1 = np.concatenate((pose_3d[:,:2], np.ones_like(pose_3d[:,:1])),1)
-        img2bb_trans_001 = np.concatenate((img2bb_trans, np.array([0,0,1]).reshape(1,3)))
-        pose_3d[:,:2] = np.dot(np.linalg.inv(img2bb_trans_001), pose_3d_xy1.transpose(1,0)).transpose(1,0)[:,:2]
-        output_pose_2d_list.append(pose_3d[:,:2].copy())
-        
+        pose_3d[:, :, 0] = pose_3d[:, :, 0] / cfg.output_shape[1] * cfg.input_shape[1]
+        pose_3d[:, :, 1] = pose_3d[:, :, 1] / cfg.output_shape[0] * cfg.input_shape[0]
+        pose_3d_xy1 = np.concatenate((pose_3d[:, :, :2], np.ones_like(pose_3d[:, :, :1])), 2)
+        img2bb_trans_001 = np.concatenate(
+            (img2bb_trans, np.tile(np.array([0, 0, 1.]), (person_num, 1, 1))), 1)
+        bb2img_trans = np.linalg.inv(img2bb_trans_001)
+        pose_3d[:, :, :2] = np.einsum('nij,nkj->nki', bb2img_trans, pose_3d_xy1)[:, :, :2]
+        output_pose_2d_list = pose_3d[:, :, :2].copy()
+
         # root-relative discretized depth -> absolute continuous depth
-        pose_3d[:,2] = (pose_3d[:,2] / cfg.depth_dim * 2 - 1) * (cfg.bbox_3d_shape[0]/2) + root_3d[2]  # root_depth_list[n]
-        pose_3d = pixel2cam(pose_3d, focal, princpt)
-        output_pose_3d_list.append(pose_3d.copy())
+        pose_3d[:, :, 2] = (pose_3d[:, :, 2] / cfg.depth_dim * 2 - 1) * (cfg.bbox_3d_shape[0]/2) + root_3d[:, None, 2]  # root_depth_list[n]
+        output_pose_3d_list = pixel2cam(pose_3d, focal, princpt)
 
     # visualize 2d poses
     vis_img_2d = original_img.copy()
@@ -494,8 +526,11 @@ def posenet_to_image(original_img, bbox_list, net_root, net_pose, benchmark=Fals
     # visualize 3d poses
     vis_kps = np.array(output_pose_3d_list)
     fig_h, fig_w = np.shape(original_img)[:2]
-    vis_img_3d = vis_3d_multiple_skeleton(kpt_3d=vis_kps, kpt_3d_vis=np.ones_like(vis_kps), 
-                                          kps_lines=skeleton, fig_h=fig_h, fig_w=fig_w)
+    if renderer is None:
+        vis_img_3d = vis_3d_multiple_skeleton(kpt_3d=vis_kps, kpt_3d_vis=np.ones_like(vis_kps), 
+                                              kps_lines=skeleton, fig_h=fig_h, fig_w=fig_w)
+    else:
+        vis_img_3d = render_3d_multiple_skeleton(renderer, vis_kps, skeleton)
     
     # summary result
     vis_img = np.concatenate([vis_img_2d, vis_img_3d], axis=1)
@@ -546,6 +581,12 @@ def recognize_from_video(vid_path, net_maskrcnn, net_root, net_pose):
     else:
         video_writer = None
 
+    # 3d skeletons are drawn with OpenCV, matplotlib is too slow for video
+    renderer = create_skeleton_renderer(
+        int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+    )
+
     # frame read and exec segmentation
     while(True):
         # frame read
@@ -564,7 +605,8 @@ def recognize_from_video(vid_path, net_maskrcnn, net_root, net_pose):
 
         # exec posenet
         vis_img = posenet_to_image(original_img=original_img, bbox_list=bbox_list, 
-                                   net_root=net_root, net_pose=net_pose)
+                                   net_root=net_root, net_pose=net_pose,
+                                   renderer=renderer)
         
         # display
         cv2.imshow("frame", vis_img)
@@ -2,7 +2,6 @@ import cv2
 import matplotlib.patches as patches
 import matplotlib.pyplot as plt
 import numpy as np
-import math
 from scipy.special import expit
 from scipy.ndimage.filters import gaussian_filter
 
@@ -25,83 +24,6 @@ EFFICIENT_POSE_KEYPOINT_LEFT_ANKLE		   = (15)
 
 EFFICIENT_POSE_KEYPOINT_CNT = 16
 
-def resize(source_array, target_height, target_width):
-    """ 
-    Resizes an image or image-like Numpy array to be no larger than (target_height, target_width) or (target_height, target_width, c).
-    
-    Args:
-        source_array: ndarray
-            Numpy array of shape (h, w) or (h, w, 3)
-        target_height: int
-            Desired maximum height
-        target_width: int
-            Desired maximum width
-        
-    Returns:
-        Resized Numpy array.
-    """
-    
-    # Get height and width of source array
-    source_height, source_width = source_array.shape[:2]
-     
-    # Compute correct scale for resizing operation
-    target_ratio = target_height / target_width
-    source_ratio = source_height / source_width
-    if target_ratio > source_ratio:
-        scale = target_width / source_width
-    else:
-        scale = target_height / source_height
-        
-    # Perform rescaling
-    width = int(source_width * scale)
-    height = int(source_height * scale)
-    dim = (width, height)
-    # resize image
-    resized_array = cv2.resize(source_array, dim, interpolation = cv2.INTER_AREA)/255.
-
-    # resized_array = rescale(source_array, scale, multichannel=True)
-    
-    return resized_array
-
-def pad(source_array, target_height, target_width):
-    """ 
-    Pads an image or image-like Numpy array with zeros to fit the target-size.
-    
-    Args:
-        source_array: ndarray
-            Numpy array of shape (h, w) or (h, w, 3)
-        target_height: int
-            Height of padded image
-        target_width: int
-            Width of padded image
-    
-    Returns:
-        Zero-padded Numpy array of shape (target_height, target_width) or (target_height, target_width, c).
-    """
-    
-    # Get height and width of source array
-    source_height, source_width = source_array.shape[:2]
-    
-    # Ensure array is resized properly
-    if (source_height > target_height) or (source_width > target_width):
-        source_array = resize(source_array, target_height, target_width)
-        source_height, source_width = source_array.shape[:2]
-        
-    # Compute padding variables
-    pad_left = int((target_width - source_width) / 2)
-    pad_top = int((target_height - source_height) / 2)
-    pad_right = int(target_width - source_width - pad_left)
-    pad_bottom = int(target_height - source_height - pad_top)
-    paddings = [[pad_top, pad_bottom], [pad_left, pad_right]]
-    has_channels_dim = len(source_array.shape) == 3
-    if has_channels_dim:  
-        paddings.append([0,0])
-        
-    # Perform padding
-    target_array = np.pad(source_array, paddings, 'constant')
-    
-    return target_array
-
 def normalize(x):
     """Preprocesses a Numpy array encoding a batch of images.
     Arguments:
@@ -142,21 +64,21 @@ def preprocess(batch, resolution, lite=False):
         Preprocessed Numpy array of shape (n, resolution, resolution, 3).
     """
     
-    batch = [resize(frame, resolution, resolution) for frame in batch]
-
-    # Pad frames in batch to form quadratic input
-    batch = [pad(frame, resolution, resolution) for frame in batch]
-
-    # Convert from normalized pixels to RGB absolute values
-    batch = [np.uint8(255 * frame) for frame in batch]
-
-    # Construct Numpy array from batch
-    batch = np.asarray(batch).astype('float')
+    # Resize frames to fit, in place into zero padded quadratic inputs
+    padded = np.zeros((len(batch), resolution, resolution, 3), dtype=np.float32)
+    for frame, target in zip(batch, padded):
+        frame_height, frame_width = frame.shape[:2]
+        scale = resolution / max(frame_height, frame_width)
+        width, height = int(frame_width * scale), int(frame_height * scale)
+        pad_left = int((resolution - width) / 2)
+        pad_top = int((resolution - height) / 2)
+        target[pad_top:pad_top + height, pad_left:pad_left + width] = cv2.resize(
+            np.ascontiguousarray(frame), (width, height), interpolation=cv2.INTER_AREA)
+    batch = padded
 
     # Normalize images in batch
     batch = normalize(batch)
 
-
     return batch
 
 def extract_coordinates(frame_output, frame_height, frame_width, real_time=False):
@@ -180,55 +102,35 @@ def extract_coordinates(frame_output, frame_height, frame_width, real_time=False
     # Define body parts
     body_parts = ['head_top', 'upper_neck', 'right_shoulder', 'right_elbow', 'right_wrist', 'thorax', 'left_shoulder', 'left_elbow', 'left_wrist', 'pelvis', 'right_hip', 'right_knee', 'right_ankle', 'left_hip', 'left_knee', 'left_ankle']
     
-    # Define confidence level
-    confidence = 0.3
-    
     # Fetch output resolution 
     output_height, output_width = frame_output.shape[0:2]
     
-    # Initialize coordinates
-    frame_coords = []
-    
-    # Iterate over body parts
-    for i in range(frame_output.shape[-1]):
-
-        # Find peak point
-        conf = frame_output[...,i]
-        if not real_time:
-            conf = gaussian_filter(conf, sigma=1.) 
-        max_index = np.argmax(conf)
-        peak_y = float(math.floor(max_index / output_width))
-        peak_x = max_index % output_width
-        conf_xy = conf[int(peak_y),int(peak_x)]
-        # Verify confidence
-        # if real_time and conf_xy < confidence:
-        #     peak_x = -0.5
-        #     peak_y = -0.5
-        # else:
-        #     peak_x += 0.5
-        #     peak_y += 0.5
-        peak_x += 0.5
-        peak_y += 0.5
-
-        # Normalize coordinates
-        peak_x /= output_width
-        peak_y /= output_height
-
-        # Convert to original aspect ratio 
-        if frame_width > frame_height:
-            norm_padding = (frame_width - frame_height) / (2 * frame_width)  
-            peak_y = (peak_y - norm_padding) / (1.0 - (2 * norm_padding))
-            peak_y = -0.5 / output_height if peak_y < 0.0 else peak_y
-            peak_y = 1.0 if peak_y > 1.0 else peak_y
-        elif frame_width < frame_height:
-            norm_padding = (frame_height - frame_width) / (2 * frame_height)  
-            peak_x = (peak_x - norm_padding) / (1.0 - (2 * norm_padding))
-            peak_x = -0.5 / output_width if peak_x < 0.0 else peak_x
-            peak_x = 1.0 if peak_x > 1.0 else peak_x
-
-        frame_coords.append((body_parts[i], peak_x, peak_y, conf_xy))
-        
-    return frame_coords
+    # Find peak points of all body parts at once
+    conf = frame_output
+    if not real_time:
+        conf = gaussian_filter(conf, sigma=(1., 1., 0.))
+    conf = conf.reshape(-1, conf.shape[-1])
+    max_index = np.argmax(conf, axis=0)
+    conf_xy = conf[max_index, np.arange(conf.shape[1])]
+    peak_y, peak_x = np.divmod(max_index, output_width)
+
+    # Normalize coordinates
+    peak_x = (peak_x + 0.5) / output_width
+    peak_y = (peak_y + 0.5) / output_height
+
+    # Convert to original aspect ratio 
+    if frame_width > frame_height:
+        norm_padding = (frame_width - frame_height) / (2 * frame_width)  
+        peak_y = (peak_y - norm_padding) / (1.0 - (2 * norm_padding))
+        peak_y = np.where(peak_y < 0.0, -0.5 / output_height, peak_y)
+        peak_y = np.minimum(peak_y, 1.0)
+    elif frame_width < frame_height:
+        norm_padding = (frame_height - frame_width) / (2 * frame_height)  
+        peak_x = (peak_x - norm_padding) / (1.0 - (2 * norm_padding))
+        peak_x = np.where(peak_x < 0.0, -0.5 / output_width, peak_x)
+        peak_x = np.minimum(peak_x, 1.0)
+
+    return list(zip(body_parts, peak_x.tolist(), peak_y.tolist(), conf_xy.tolist()))
 
 def display_body_parts(image, image_draw, coordinates, image_height=1024, image_width=1024, marker_radius=5):   
     """
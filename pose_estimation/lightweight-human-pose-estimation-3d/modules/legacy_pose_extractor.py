@@ -1,7 +1,4 @@
-from operator import itemgetter
-
 import cv2
-import math
 import numpy as np
 
 BODY_PARTS_KPT_IDS = [[1, 2], [1, 5], [2, 3], [3, 4], [5, 6], [6, 7], [1, 8], [8, 9], [9, 10], [1, 11],
@@ -10,11 +7,6 @@ BODY_PARTS_PAF_IDS = ([12, 13], [20, 21], [14, 15], [16, 17], [22, 23], [24, 25]
                       [6, 7], [8, 9], [10, 11], [28, 29], [30, 31], [34, 35], [32, 33], [36, 37], [18, 19], [26, 27])
 
 
-def linspace2d(start, stop, n=10):
-    points = 1 / (n - 1) * (stop - start)
-    return points[:, None] * np.arange(n) + start[:, None]
-
-
 def extract_keypoints(heatmap, all_keypoints, total_keypoint_num):
     heatmap[heatmap < 0.1] = 0
     heatmap_with_borders = np.pad(heatmap, [(2, 2), (2, 2)], mode='constant')
@@ -29,173 +21,152 @@ def extract_keypoints(heatmap, all_keypoints, total_keypoint_num):
                     (heatmap_center > heatmap_up) &\
                     (heatmap_center > heatmap_down)
     heatmap_peaks = heatmap_peaks[1:heatmap_center.shape[0]-1, 1:heatmap_center.shape[1]-1]
-    keypoints = list(zip(np.nonzero(heatmap_peaks)[1], np.nonzero(heatmap_peaks)[0]))  # (w, h)
-    keypoints = sorted(keypoints, key=itemgetter(0))
-
-    suppressed = np.zeros(len(keypoints), np.uint8)
-    keypoints_with_score_and_id = []
-    keypoint_num = 0
-    for i in range(len(keypoints)):
-        if suppressed[i]:
-            continue
-        for j in range(i+1, len(keypoints)):
-            if math.sqrt((keypoints[i][0] - keypoints[j][0]) ** 2 +
-                         (keypoints[i][1] - keypoints[j][1]) ** 2) < 6:
-                suppressed[j] = 1
-        keypoint_with_score_and_id = (keypoints[i][0], keypoints[i][1], heatmap[keypoints[i][1], keypoints[i][0]],
-                                      total_keypoint_num + keypoint_num)
-        keypoints_with_score_and_id.append(keypoint_with_score_and_id)
-        keypoint_num += 1
-    all_keypoints.append(keypoints_with_score_and_id)
+    ys, xs = np.nonzero(heatmap_peaks)
+    order = np.lexsort((ys, xs))  # sorted by w, then h
+    xs, ys = xs[order], ys[order]
+
+    # suppress the peaks closer than 6 pixels to a kept one, in order
+    close = (xs[:, None] - xs[None, :]) ** 2 + (ys[:, None] - ys[None, :]) ** 2 < 36
+    suppressed = np.zeros(len(xs), dtype=bool)
+    for i in range(len(xs)):
+        if not suppressed[i]:
+            suppressed[i + 1:] |= close[i, i + 1:]
+    keep = ~suppressed
+    xs, ys = xs[keep], ys[keep]
+
+    # (x, y, score, global id) of each keypoint
+    keypoint_num = len(xs)
+    all_keypoints.append(np.stack(
+        [xs, ys, heatmap[ys, xs], total_keypoint_num + np.arange(keypoint_num)], axis=1).astype(np.float64))
     return keypoint_num
 
 
+def score_connections(kpts_a, kpts_b, paf_x, paf_y, height_n, min_paf_score=0.05, point_num=10):
+    """PAF line integral of all the (a, b) keypoint pairs of a limb at once.
+
+    :param kpts_a: (A, 2) keypoints coordinates
+    :param kpts_b: (B, 2) keypoints coordinates
+    :param paf_x, paf_y: (H, W) part affinity field of the limb
+    :return: (A, B) score of each pair, and (A, B) mask of the accepted pairs
+    """
+    vec = kpts_b[None, :, :] - kpts_a[:, None, :]
+    vec_norm = np.sqrt(vec[..., 0] ** 2 + vec[..., 1] ** 2)
+    found = vec_norm != 0
+    vec = vec / np.where(found, vec_norm, 1)[..., None]
+
+    # point_num points from a to b, truncated to pixel coordinates
+    step = 1 / (point_num - 1) * (kpts_b[None, :, :] - kpts_a[:, None, :])
+    points = (step[..., None, :] * np.arange(point_num)[:, None] + kpts_a[:, None, None, :]).astype(np.int64)
+    point_scores = vec[..., 0, None] * paf_x[points[..., 1], points[..., 0]] + \
+        vec[..., 1, None] * paf_y[points[..., 1], points[..., 0]]
+
+    passed = point_scores > min_paf_score
+    passed_point_score = np.zeros(vec_norm.shape)
+    for point_idx in range(point_num):
+        passed_point_score += np.where(passed[..., point_idx], point_scores[..., point_idx], 0)
+    passed_point_num = passed.sum(axis=-1)
+
+    success_ratio = passed_point_num / point_num
+    ratio = np.where(passed_point_num > 0, passed_point_score / np.maximum(passed_point_num, 1), 0)
+    ratio = ratio + np.minimum(height_n / np.where(found, vec_norm, 1) - 1, 0)
+    return ratio, found & (ratio > 0) & (success_ratio > 0.8)
+
+
+def new_pose_entries(kpt_ids, kpt_idx, scores, pose_entry_size):
+    """Pose entries made of a single keypoint, or of a connection when kpt_ids has 2 columns"""
+    pose_entries = np.full((len(kpt_idx), pose_entry_size), -1.0)
+    for k, kpt_id in enumerate(kpt_ids):
+        pose_entries[:, kpt_id] = kpt_idx[:, k]
+    pose_entries[:, -1] = len(kpt_ids)
+    pose_entries[:, -2] = scores
+    return pose_entries
+
+
 def group_keypoints(all_keypoints_by_type, pafs, pose_entry_size=20, min_paf_score=0.05):
-    pose_entries = []
-    all_keypoints = np.array([item for sublist in all_keypoints_by_type for item in sublist])
+    pose_entries = np.zeros((0, pose_entry_size))
+    all_keypoints = np.concatenate([np.reshape(kpts, (-1, 4)) for kpts in all_keypoints_by_type])
+    num_all_keypoints = len(all_keypoints)
+    height_n = pafs.shape[1] // 2
     for part_id in range(len(BODY_PARTS_PAF_IDS)):
-        part_pafs = pafs[BODY_PARTS_PAF_IDS[part_id]]
-        kpts_a = all_keypoints_by_type[BODY_PARTS_KPT_IDS[part_id][0]]
-        kpts_b = all_keypoints_by_type[BODY_PARTS_KPT_IDS[part_id][1]]
+        kpt_a_id, kpt_b_id = BODY_PARTS_KPT_IDS[part_id]
+        kpts_a = np.reshape(all_keypoints_by_type[kpt_a_id], (-1, 4))
+        kpts_b = np.reshape(all_keypoints_by_type[kpt_b_id], (-1, 4))
         num_kpts_a = len(kpts_a)
         num_kpts_b = len(kpts_b)
-        kpt_a_id = BODY_PARTS_KPT_IDS[part_id][0]
-        kpt_b_id = BODY_PARTS_KPT_IDS[part_id][1]
 
         if num_kpts_a == 0 and num_kpts_b == 0:  # no keypoints for such body part
             continue
-        elif num_kpts_a == 0:  # body part has just 'b' keypoints
-            for i in range(num_kpts_b):
-                num = 0
-                for j in range(len(pose_entries)):  # check if already in some pose, was added by another body part
-                    if pose_entries[j][kpt_b_id] == kpts_b[i][3]:
-                        num += 1
-                        continue
-                if num == 0:
-                    pose_entry = np.ones(pose_entry_size) * -1
-                    pose_entry[kpt_b_id] = kpts_b[i][3]  # keypoint idx
-                    pose_entry[-1] = 1                   # num keypoints in pose
-                    pose_entry[-2] = kpts_b[i][2]        # pose score
-                    pose_entries.append(pose_entry)
-            continue
-        elif num_kpts_b == 0:  # body part has just 'a' keypoints
-            for i in range(num_kpts_a):
-                num = 0
-                for j in range(len(pose_entries)):
-                    if pose_entries[j][kpt_a_id] == kpts_a[i][3]:
-                        num += 1
-                        continue
-                if num == 0:
-                    pose_entry = np.ones(pose_entry_size) * -1
-                    pose_entry[kpt_a_id] = kpts_a[i][3]
-                    pose_entry[-1] = 1
-                    pose_entry[-2] = kpts_a[i][2]
-                    pose_entries.append(pose_entry)
+        elif num_kpts_a == 0 or num_kpts_b == 0:  # body part has just 'a' or just 'b' keypoints
+            kpt_id, kpts = (kpt_b_id, kpts_b) if num_kpts_a == 0 else (kpt_a_id, kpts_a)
+            # unless already in some pose, was added by another body part
+            new = ~np.isin(kpts[:, 3], pose_entries[:, kpt_id])
+            pose_entries = np.concatenate([
+                pose_entries,
+                new_pose_entries([kpt_id], kpts[new, 3:4], kpts[new, 2], pose_entry_size)])
             continue
 
-        connections = []
-        for i in range(num_kpts_a):
-            kpt_a = np.array(kpts_a[i][0:2])
-            for j in range(num_kpts_b):
-                kpt_b = np.array(kpts_b[j][0:2])
-                mid_point = [(), ()]
-                mid_point[0] = (int(round((kpt_a[0] + kpt_b[0]) * 0.5)),
-                                int(round((kpt_a[1] + kpt_b[1]) * 0.5)))
-                mid_point[1] = mid_point[0]
-
-                vec = [kpt_b[0] - kpt_a[0], kpt_b[1] - kpt_a[1]]
-                vec_norm = math.sqrt(vec[0] ** 2 + vec[1] ** 2)
-                if vec_norm == 0:
-                    continue
-                vec[0] /= vec_norm
-                vec[1] /= vec_norm
-                cur_point_score = (vec[0] * part_pafs[0, mid_point[0][1], mid_point[0][0]] +
-                                   vec[1] * part_pafs[1, mid_point[1][1], mid_point[1][0]])
-
-                height_n = pafs.shape[1] // 2
-                success_ratio = 0
-                point_num = 10  # number of points to integration over paf
-                ratio = 0
-                if cur_point_score > -100:
-                    passed_point_score = 0
-                    passed_point_num = 0
-                    x, y = linspace2d(kpt_a, kpt_b)
-                    for point_idx in range(point_num):
-                        px = int(x[point_idx])
-                        py = int(y[point_idx])
-                        paf = part_pafs[:, py, px]
-                        cur_point_score = vec[0] * paf[0] + vec[1] * paf[1]
-                        if cur_point_score > min_paf_score:
-                            passed_point_score += cur_point_score
-                            passed_point_num += 1
-                    success_ratio = passed_point_num / point_num
-                    if passed_point_num > 0:
-                        ratio = passed_point_score / passed_point_num
-                    ratio += min(height_n / vec_norm - 1, 0)
-                if ratio > 0 and success_ratio > 0.8:
-                    score_all = ratio + kpts_a[i][2] + kpts_b[j][2]
-                    connections.append([i, j, ratio, score_all])
-        if len(connections) > 0:
-            connections = sorted(connections, key=itemgetter(2), reverse=True)
+        paf_x_id, paf_y_id = BODY_PARTS_PAF_IDS[part_id]
+        ratio, accepted = score_connections(
+            kpts_a[:, :2], kpts_b[:, :2], pafs[paf_x_id], pafs[paf_y_id], height_n, min_paf_score)
 
+        # greedy assignment, best scores first
+        i, j = np.nonzero(accepted)
+        order = np.argsort(-ratio[i, j], kind='stable')
         num_connections = min(num_kpts_a, num_kpts_b)
-        has_kpt_a = np.zeros(num_kpts_a, dtype=np.int32)
-        has_kpt_b = np.zeros(num_kpts_b, dtype=np.int32)
-        filtered_connections = []
-        for row in range(len(connections)):
-            if len(filtered_connections) == num_connections:
+        has_kpt_a = [False] * num_kpts_a
+        has_kpt_b = [False] * num_kpts_b
+        filtered = []
+        for k, a, b in zip(order.tolist(), i[order].tolist(), j[order].tolist()):
+            if len(filtered) == num_connections:
                 break
-            i, j, cur_point_score = connections[row][0:3]
-            if not has_kpt_a[i] and not has_kpt_b[j]:
-                filtered_connections.append([kpts_a[i][3], kpts_b[j][3], cur_point_score])
-                has_kpt_a[i] = 1
-                has_kpt_b[j] = 1
-        connections = filtered_connections
-        if len(connections) == 0:
+            if not has_kpt_a[a] and not has_kpt_b[b]:
+                filtered.append(k)
+                has_kpt_a[a] = True
+                has_kpt_b[b] = True
+        if len(filtered) == 0:
             continue
+        i, j = i[filtered], j[filtered]
+        connections = np.stack([kpts_a[i, 3], kpts_b[j, 3]], axis=1)
+        connection_scores = ratio[i, j]
+        connection_idx = connections.astype(np.int64)
+
+        # connection of each pose entry, by its keypoint of the given type
+        def lookup(kpt_id, column):
+            index = np.full(num_all_keypoints + 1, -1)
+            index[connection_idx[:, column]] = np.arange(len(connections))
+            return index[pose_entries[:, kpt_id].astype(np.int64)]  # -1 entries read the last, unused slot
 
         if part_id == 0:
-            pose_entries = [np.ones(pose_entry_size) * -1 for _ in range(len(connections))]
-            for i in range(len(connections)):
-                pose_entries[i][BODY_PARTS_KPT_IDS[0][0]] = connections[i][0]
-                pose_entries[i][BODY_PARTS_KPT_IDS[0][1]] = connections[i][1]
-                pose_entries[i][-1] = 2
-                pose_entries[i][-2] = np.sum(all_keypoints[connections[i][0:2], 2]) + connections[i][2]
+            pose_entries = new_pose_entries(
+                [kpt_a_id, kpt_b_id], connections,
+                all_keypoints[connection_idx[:, 0], 2] + all_keypoints[connection_idx[:, 1], 2] + connection_scores,
+                pose_entry_size)
         elif part_id == 17 or part_id == 18:
-            kpt_a_id = BODY_PARTS_KPT_IDS[part_id][0]
-            kpt_b_id = BODY_PARTS_KPT_IDS[part_id][1]
-            for i in range(len(connections)):
-                for j in range(len(pose_entries)):
-                    if pose_entries[j][kpt_a_id] == connections[i][0] and pose_entries[j][kpt_b_id] == -1:
-                        pose_entries[j][kpt_b_id] = connections[i][1]
-                    elif pose_entries[j][kpt_b_id] == connections[i][1] and pose_entries[j][kpt_a_id] == -1:
-                        pose_entries[j][kpt_a_id] = connections[i][0]
-            continue
+            by_a = lookup(kpt_a_id, 0)
+            by_b = lookup(kpt_b_id, 1)
+            fill_b = (by_a >= 0) & (pose_entries[:, kpt_b_id] == -1)
+            fill_a = ~fill_b & (by_b >= 0) & (pose_entries[:, kpt_a_id] == -1)
+            pose_entries[fill_b, kpt_b_id] = connections[by_a[fill_b], 1]
+            pose_entries[fill_a, kpt_a_id] = connections[by_b[fill_a], 0]
         else:
-            kpt_a_id = BODY_PARTS_KPT_IDS[part_id][0]
-            kpt_b_id = BODY_PARTS_KPT_IDS[part_id][1]
-            for i in range(len(connections)):
-                num = 0
-                for j in range(len(pose_entries)):
-                    if pose_entries[j][kpt_a_id] == connections[i][0]:
-                        pose_entries[j][kpt_b_id] = connections[i][1]
-                        num += 1
-                        pose_entries[j][-1] += 1
-                        pose_entries[j][-2] += all_keypoints[connections[i][1], 2] + connections[i][2]
-                if num == 0:
-                    pose_entry = np.ones(pose_entry_size) * -1
-                    pose_entry[kpt_a_id] = connections[i][0]
-                    pose_entry[kpt_b_id] = connections[i][1]
-                    pose_entry[-1] = 2
-                    pose_entry[-2] = np.sum(all_keypoints[connections[i][0:2], 2]) + connections[i][2]
-                    pose_entries.append(pose_entry)
-
-    filtered_entries = []
-    for i in range(len(pose_entries)):
-        if pose_entries[i][-1] < 3 or (pose_entries[i][-2] / pose_entries[i][-1] < 0.2):
-            continue
-        filtered_entries.append(pose_entries[i])
-    pose_entries = np.asarray(filtered_entries)
+            by_a = lookup(kpt_a_id, 0)
+            matched = by_a >= 0
+            k = by_a[matched]
+            pose_entries[matched, kpt_b_id] = connections[k, 1]
+            pose_entries[matched, -1] += 1
+            pose_entries[matched, -2] += all_keypoints[connection_idx[k, 1], 2] + connection_scores[k]
+
+            new = ~np.isin(np.arange(len(connections)), k)
+            pose_entries = np.concatenate([
+                pose_entries,
+                new_pose_entries(
+                    [kpt_a_id, kpt_b_id], connections[new],
+                    all_keypoints[connection_idx[new, 0], 2] + all_keypoints[connection_idx[new, 1], 2] +
+                    connection_scores[new],
+                    pose_entry_size)])
+
+    keep = (pose_entries[:, -1] >= 3) & (pose_entries[:, -2] / np.maximum(pose_entries[:, -1], 1) >= 0.2)
+    pose_entries = pose_entries[keep]
     return pose_entries, all_keypoints
 
 
@@ -215,20 +186,12 @@ def extract_poses(heatmaps, pafs, upsample_ratio):
     
     pose_entries, all_keypoints = group_keypoints(all_keypoints_by_type, pafs)
 
-    found_poses = []
-    for pose_entry in pose_entries:
-        if len(pose_entry) == 0:
-            continue
-        pose_keypoints = np.ones((num_keypoints * 3 + 1), dtype=np.float32) * -1
-        for kpt_id in range(num_keypoints):
-            if pose_entry[kpt_id] != -1.0:
-                pose_keypoints[kpt_id * 3 + 0] = all_keypoints[int(pose_entry[kpt_id]), 0]
-                pose_keypoints[kpt_id * 3 + 1] = all_keypoints[int(pose_entry[kpt_id]), 1]
-                pose_keypoints[kpt_id * 3 + 2] = all_keypoints[int(pose_entry[kpt_id]), 2]
-        pose_keypoints[-1] = pose_entry[18]
-        found_poses.append(pose_keypoints)
-
-    if not found_poses:
-        return np.array(found_poses, dtype=np.float32).reshape((0,0)), None
-
-    return np.array(found_poses, dtype=np.float32), None
+    if len(pose_entries) == 0:
+        return np.zeros((0, 0), dtype=np.float32), None
+
+    kpt_idx = pose_entries[:, :num_keypoints].astype(np.int64)
+    found = kpt_idx != -1
+    pose_keypoints = np.where(found[..., None], all_keypoints[np.where(found, kpt_idx, 0), :3], -1)
+    found_poses = np.concatenate(
+        [pose_keypoints.reshape(len(pose_entries), -1), pose_entries[:, 18:19]], axis=1)
+    return found_poses.astype(np.float32), None
@@ -29,49 +29,45 @@ def get_root_relative_poses(inference_results):
     found_poses[:, 0:-1:3] /= upsample_ratio
     found_poses[:, 1:-1:3] /= upsample_ratio
 
-    poses_2d = []
     num_kpt_panoptic = 19
     num_kpt = 18
-    for pose_id in range(found_poses.shape[0]):
-        if found_poses[pose_id, 3] == -1:  # skip pose if does not found neck
-            continue
-        pose_2d = np.ones(num_kpt_panoptic * 3 + 1, dtype=np.float32) * -1  # +1 for pose confidence
-        for kpt_id in range(num_kpt):
-            if found_poses[pose_id, kpt_id * 3] != -1:
-                x_2d, y_2d = found_poses[pose_id, kpt_id * 3:kpt_id * 3 + 2]
-                conf = found_poses[pose_id, kpt_id * 3 + 2]
-                pose_2d[map_id_to_panoptic[kpt_id] * 3] = x_2d  # just repacking
-                pose_2d[map_id_to_panoptic[kpt_id] * 3 + 1] = y_2d
-                pose_2d[map_id_to_panoptic[kpt_id] * 3 + 2] = conf
-        pose_2d[-1] = found_poses[pose_id, -1]
-        poses_2d.append(pose_2d)
+    if found_poses.size:
+        found_poses = found_poses[found_poses[:, 3] != -1]  # skip pose if does not found neck
+    else:
+        found_poses = found_poses.reshape((0, num_kpt * 3 + 1))
+    num_poses = len(found_poses)
+
+    # just repacking
+    poses_2d = np.ones((num_poses, num_kpt_panoptic * 3 + 1), dtype=np.float32) * -1  # +1 for pose confidence
+    kpts = found_poses[:, :-1].reshape((num_poses, num_kpt, 3))
+    kpts = np.where(kpts[:, :, 0:1] != -1, kpts, -1)
+    poses_2d[:, :-1].reshape((num_poses, num_kpt_panoptic, 3))[:, map_id_to_panoptic] = kpts
+    poses_2d[:, -1] = found_poses[:, -1]
 
     keypoint_treshold = 0.1
-    poses_3d = np.ones((len(poses_2d), num_kpt_panoptic * 4), dtype=np.float32) * -1
-    for pose_id in range(len(poses_3d)):
-        if poses_2d[pose_id][2] > keypoint_treshold:
-            neck_2d = poses_2d[pose_id][:2].astype(int)
-            # read all pose coordinates at neck location
-            for kpt_id in range(num_kpt_panoptic):
-                map_3d = features[kpt_id * 3:(kpt_id + 1) * 3]
-                poses_3d[pose_id][kpt_id * 4] = map_3d[0, neck_2d[1], neck_2d[0]] * AVG_PERSON_HEIGHT
-                poses_3d[pose_id][kpt_id * 4 + 1] = map_3d[1, neck_2d[1], neck_2d[0]] * AVG_PERSON_HEIGHT
-                poses_3d[pose_id][kpt_id * 4 + 2] = map_3d[2, neck_2d[1], neck_2d[0]] * AVG_PERSON_HEIGHT
-                poses_3d[pose_id][kpt_id * 4 + 3] = poses_2d[pose_id][kpt_id * 3 + 2]
-
-            # refine keypoints coordinates at corresponding limbs locations
-            for limb in limbs:
-                for kpt_id_from in limb:
-                    if poses_2d[pose_id][kpt_id_from * 3 + 2] > keypoint_treshold:
-                        for kpt_id_where in limb:
-                            kpt_from_2d = poses_2d[pose_id][kpt_id_from*3: kpt_id_from*3 + 2].astype(int)
-                            map_3d = features[kpt_id_where * 3:(kpt_id_where + 1) * 3]
-                            poses_3d[pose_id][kpt_id_where * 4] = map_3d[0, kpt_from_2d[1], kpt_from_2d[0]] * AVG_PERSON_HEIGHT
-                            poses_3d[pose_id][kpt_id_where * 4 + 1] = map_3d[1, kpt_from_2d[1], kpt_from_2d[0]] * AVG_PERSON_HEIGHT
-                            poses_3d[pose_id][kpt_id_where * 4 + 2] = map_3d[2, kpt_from_2d[1], kpt_from_2d[0]] * AVG_PERSON_HEIGHT
-                        break
-
-    return poses_3d, np.array(poses_2d), features.shape
+    poses_3d = np.ones((num_poses, num_kpt_panoptic, 4), dtype=np.float32) * -1
+    maps_3d = features[:num_kpt_panoptic * 3].reshape((num_kpt_panoptic, 3) + features.shape[1:])
+    conf = poses_2d[:, 2:-1:3]
+    valid = np.nonzero(conf[:, 0] > keypoint_treshold)[0]
+    if len(valid):
+        # read all pose coordinates at neck location
+        neck_2d = poses_2d[valid, :2].astype(int)
+        poses_3d[valid, :, :3] = maps_3d[:, :, neck_2d[:, 1], neck_2d[:, 0]].transpose(2, 0, 1) * AVG_PERSON_HEIGHT
+        poses_3d[valid, :, 3] = conf[valid]
+
+        # refine keypoints coordinates at corresponding limbs locations,
+        # read at the first confident keypoint of the limb
+        for limb in limbs:
+            found = conf[valid][:, limb] > keypoint_treshold
+            pose_ids = valid[found.any(axis=1)]
+            kpt_id_from = np.array(limb)[found.argmax(axis=1)[found.any(axis=1)]]
+            kpt_from_2d = np.stack([
+                poses_2d[pose_ids, kpt_id_from * 3], poses_2d[pose_ids, kpt_id_from * 3 + 1]], axis=1).astype(int)
+            poses_3d[pose_ids[:, None], limb, :3] = \
+                maps_3d[limb][:, :, kpt_from_2d[:, 1], kpt_from_2d[:, 0]].transpose(2, 0, 1) * AVG_PERSON_HEIGHT
+    poses_3d = poses_3d.reshape((num_poses, num_kpt_panoptic * 4))
+
+    return poses_3d, poses_2d, features.shape
 
 
 previous_poses_2d = []
@@ -80,27 +76,20 @@ previous_poses_2d = []
 def parse_poses(inference_results, input_scale, stride, fx, is_video=False):
     global previous_poses_2d
     poses_3d, poses_2d, features_shape = get_root_relative_poses(inference_results)
-    poses_2d_scaled = []
-    for pose_2d in poses_2d:
-        num_kpt = (pose_2d.shape[0] - 1) // 3
-        pose_2d_scaled = np.ones(pose_2d.shape[0], dtype=np.float32) * -1  # +1 for pose confidence
-        for kpt_id in range(num_kpt):
-            if pose_2d[kpt_id * 3] != -1:
-                pose_2d_scaled[kpt_id * 3] = int(pose_2d[kpt_id * 3] * stride / input_scale)
-                pose_2d_scaled[kpt_id * 3 + 1] = int(pose_2d[kpt_id * 3 + 1] * stride / input_scale)
-                pose_2d_scaled[kpt_id * 3 + 2] = pose_2d[kpt_id * 3 + 2]
-        pose_2d_scaled[-1] = pose_2d[-1]
-        poses_2d_scaled.append(pose_2d_scaled)
+    poses_2d_scaled = np.ones(poses_2d.shape, dtype=np.float32) * -1  # +1 for pose confidence
+    found = poses_2d[:, 0:-1:3] != -1
+    for coordinate_id in range(2):
+        scaled = np.trunc(poses_2d[:, coordinate_id:-1:3] * stride / input_scale)
+        poses_2d_scaled[:, coordinate_id:-1:3] = np.where(found, scaled, -1)
+    poses_2d_scaled[:, 2:-1:3] = np.where(found, poses_2d[:, 2:-1:3], -1)
+    poses_2d_scaled[:, -1] = poses_2d[:, -1]
 
     if is_video:  # track poses ids
         current_poses_2d = []
-        for pose_id in range(len(poses_2d_scaled)):
-            pose_keypoints = np.ones((Pose.num_kpts, 2), dtype=np.int32) * -1
-            for kpt_id in range(Pose.num_kpts):
-                if poses_2d_scaled[pose_id][kpt_id * 3] != -1.0:  # keypoint was found
-                    pose_keypoints[kpt_id, 0] = int(poses_2d_scaled[pose_id][kpt_id * 3 + 0])
-                    pose_keypoints[kpt_id, 1] = int(poses_2d_scaled[pose_id][kpt_id * 3 + 1])
-            pose = Pose(pose_keypoints, poses_2d_scaled[pose_id][-1])
+        for pose_2d_scaled in poses_2d_scaled:
+            pose_keypoints = pose_2d_scaled[0:Pose.num_kpts * 3].reshape((Pose.num_kpts, 3))[:, :2].astype(np.int32)
+            pose_keypoints[pose_2d_scaled[0:Pose.num_kpts * 3:3] == -1.0] = -1  # keypoint was not found
+            pose = Pose(pose_keypoints, pose_2d_scaled[-1])
             current_poses_2d.append(pose)
         propagate_ids(previous_poses_2d, current_poses_2d)
         previous_poses_2d = current_poses_2d
@@ -110,16 +99,9 @@ def parse_poses(inference_results, input_scale, stride, fx, is_video=False):
     for pose_id in range(len(poses_3d)):
         pose_3d = poses_3d[pose_id].reshape((-1, 4)).transpose()
         pose_2d = poses_2d[pose_id][:-1].reshape((-1, 3)).transpose()
-        num_valid = np.count_nonzero(pose_2d[2] != -1)
-        pose_3d_valid = np.zeros((3, num_valid), dtype=np.float32)
-        pose_2d_valid = np.zeros((2, num_valid), dtype=np.float32)
-        valid_id = 0
-        for kpt_id in range(pose_3d.shape[1]):
-            if pose_2d[2, kpt_id] == -1:
-                continue
-            pose_3d_valid[:, valid_id] = pose_3d[0:3, kpt_id]
-            pose_2d_valid[:, valid_id] = pose_2d[0:2, kpt_id]
-            valid_id += 1
+        valid = pose_2d[2] != -1
+        pose_3d_valid = pose_3d[0:3, valid]
+        pose_2d_valid = pose_2d[0:2, valid]
 
         pose_2d_valid[0] = pose_2d_valid[0] - features_shape[2]/2
         pose_2d_valid[1] = pose_2d_valid[1] - features_shape[1]/2
@@ -136,10 +118,7 @@ def parse_poses(inference_results, input_scale, stride, fx, is_video=False):
 
         if is_video:
             translation = current_poses_2d[pose_id].filter(translation)
-        for kpt_id in range(19):
-            pose_3d[0, kpt_id] = pose_3d[0, kpt_id] + translation[0]
-            pose_3d[1, kpt_id] = pose_3d[1, kpt_id] + translation[1]
-            pose_3d[2, kpt_id] = pose_3d[2, kpt_id] + translation[2]
+        pose_3d[0:3] += np.asarray(translation)[:, None]
         translated_poses_3d.append(pose_3d.transpose().reshape(-1))
 
-    return np.array(translated_poses_3d), np.array(poses_2d_scaled)
+    return np.array(translated_poses_3d), poses_2d_scaled
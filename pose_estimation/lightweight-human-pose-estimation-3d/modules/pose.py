@@ -21,13 +21,7 @@ class Pose:
         super().__init__()
         self.keypoints = keypoints
         self.confidence = confidence
-        found_keypoints = np.zeros((np.count_nonzero(keypoints[:, 0] != -1), 2), dtype=np.int32)
-        found_kpt_id = 0
-        for kpt_id in range(keypoints.shape[0]):
-            if keypoints[kpt_id, 0] == -1:
-                continue
-            found_keypoints[found_kpt_id] = keypoints[kpt_id]
-            found_kpt_id += 1
+        found_keypoints = keypoints[keypoints[:, 0] != -1].astype(np.int32)
         self.bbox = cv2.boundingRect(found_keypoints)
         self.id = None
         self.translation_filter = [OneEuroFilter(freq=80, beta=0.01),
@@ -48,15 +42,29 @@ class Pose:
 
 
 def get_similarity(a, b, threshold=0.5):
-    num_similar_kpt = 0
-    for kpt_id in range(Pose.num_kpts):
-        if a.keypoints[kpt_id, 0] != -1 and b.keypoints[kpt_id, 0] != -1:
-            distance = np.sum((a.keypoints[kpt_id] - b.keypoints[kpt_id]) ** 2)
-            area = max(a.bbox[2] * a.bbox[3], b.bbox[2] * b.bbox[3])
-            similarity = np.exp(-distance / (2 * (area + np.spacing(1)) * Pose.vars[kpt_id]))
-            if similarity > threshold:
-                num_similar_kpt += 1
-    return num_similar_kpt
+    return int(get_similarities([a], [b], threshold)[0, 0])
+
+
+def get_similarities(poses_a, poses_b, threshold=0.5):
+    """Number of similar keypoints of every pair of poses.
+
+    :param poses_a: list of A poses
+    :param poses_b: list of B poses
+    :param threshold: minimal keypoint similarity
+    :return: (A, B) array
+    """
+    if len(poses_a) == 0 or len(poses_b) == 0:
+        return np.zeros((len(poses_a), len(poses_b)), dtype=np.int64)
+    kpts_a = np.stack([pose.keypoints for pose in poses_a])[:, None]
+    kpts_b = np.stack([pose.keypoints for pose in poses_b])[None]
+    area_a = np.array([pose.bbox[2] * pose.bbox[3] for pose in poses_a])
+    area_b = np.array([pose.bbox[2] * pose.bbox[3] for pose in poses_b])
+    area = np.maximum(area_a[:, None], area_b[None, :])[..., None]
+
+    found = (kpts_a[..., 0] != -1) & (kpts_b[..., 0] != -1)
+    distance = np.sum((kpts_a - kpts_b) ** 2, axis=-1)
+    similarity = np.exp(-distance / (2 * (area + np.spacing(1)) * Pose.vars))
+    return np.count_nonzero(found & (similarity > threshold), axis=-1)
 
 
 def propagate_ids(previous_poses, current_poses, threshold=3):
@@ -71,21 +79,19 @@ def propagate_ids(previous_poses, current_poses, threshold=3):
     current_poses_sorted_ids = list(range(len(current_poses)))
     current_poses_sorted_ids = sorted(
         current_poses_sorted_ids, key=lambda pose_id: current_poses[pose_id].confidence, reverse=True)  # match confident poses first
-    mask = np.ones(len(previous_poses), dtype=np.int32)
+    mask = np.ones(len(previous_poses), dtype=bool)
+    similarities = get_similarities(current_poses, previous_poses)
     for current_pose_id in current_poses_sorted_ids:
         best_matched_id = None
         best_matched_pose_id = None
         best_matched_iou = 0
-        for previous_pose_id in range(len(previous_poses)):
-            if not mask[previous_pose_id]:
-                continue
-            iou = get_similarity(current_poses[current_pose_id], previous_poses[previous_pose_id])
-            if iou > best_matched_iou:
-                best_matched_iou = iou
-                best_matched_pose_id = previous_poses[previous_pose_id].id
-                best_matched_id = previous_pose_id
-        if best_matched_iou >= threshold:
-            mask[best_matched_id] = 0
+        if len(previous_poses) > 0:
+            ious = np.where(mask, similarities[current_pose_id], 0)
+            best_matched_id = int(np.argmax(ious))  # first best match
+            best_matched_iou = ious[best_matched_id]
+            best_matched_pose_id = previous_poses[best_matched_id].id
+        if best_matched_iou >= threshold and best_matched_iou > 0:
+            mask[best_matched_id] = False
         else:  # pose not similar to any previous
             best_matched_pose_id = None
         current_poses[current_pose_id].update_id(best_matched_pose_id)
@@ -12,6 +12,7 @@ from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
 from detector_utils import load_image  # noqa: E402
 import webcamera_utils  # noqa: E402
+from top_down_utils import TopDownPoseEstimator  # noqa: E402
 from pose_resnet_util import compute, keep_aspect  # noqa: E402
 
 # logger
@@ -53,6 +54,10 @@ THRESHOLD = 0.4
 IOU = 0.45
 POSE_THRESHOLD = 0.1
 
+# BGR format
+POSE_MEAN = [0.485, 0.456, 0.406]
+POSE_STD = [0.229, 0.224, 0.225]
+
 
 # ======================
 # Arguemnt Parser Config
@@ -135,6 +140,7 @@ def plot_results(detector, pose, img, category, logging=True):
     if logging:
         logger.info(f'object_count={count}')
 
+    pose_boxes = []
     for idx in range(count):
         obj = detector.get_object(idx)
         # print result
@@ -169,27 +175,32 @@ def plot_results(detector, pose, img, category, logging=True):
         if obj.category != CATEGORY_PERSON:
             continue
 
-        # pose detection
+        # pose detection box
         px1, py1, px2, py2 = keep_aspect(
-            top_left, bottom_right, pose_img, pose
-        )
-
-        crop_img = pose_img[py1:py2, px1:px2, :]
-        offset_x = px1/img.shape[1]
-        offset_y = py1/img.shape[0]
-        scale_x = crop_img.shape[1]/img.shape[1]
-        scale_y = crop_img.shape[0]/img.shape[0]
-        detections = compute(
-            pose, crop_img, offset_x, offset_y, scale_x, scale_y
+            top_left, bottom_right, pose_img, pose.net
         )
+        if px2 <= px1 or py2 <= py1:
+            continue
+        pose_boxes.append((px1, py1, px2, py2))
 
         cv2.rectangle(img, (px1, py1), (px2, py2), color, 1)
 
+    # pose detection of all the persons at once
+    for detections in compute(pose, pose_img, pose_boxes):
         display_result(img, detections)
 
     return img
 
 
+def create_pose_estimator():
+    net = ailia.Net(POSE_MODEL_PATH, POSE_WEIGHT_PATH, env_id=args.env_id)
+    shape = net.get_input_shape()
+    # SimpleBaseline decoding, argmax and quarter pixel refinement
+    return TopDownPoseEstimator(
+        net, (shape[2], shape[3]), mean=POSE_MEAN, std=POSE_STD,
+        decode='argmax')
+
+
 # ======================
 # Main functions
 # ======================
@@ -206,7 +217,7 @@ def recognize_from_image():
         env_id=args.env_id,
     )
 
-    pose = ailia.Net(POSE_MODEL_PATH, POSE_WEIGHT_PATH, env_id=args.env_id)
+    pose = create_pose_estimator()
 
     # input image loop
     for image_path in args.input:
@@ -248,7 +259,7 @@ def recognize_from_video():
         env_id=args.env_id,
     )
 
-    pose = ailia.Net(POSE_MODEL_PATH, POSE_WEIGHT_PATH, env_id=args.env_id)
+    pose = create_pose_estimator()
 
     capture = webcamera_utils.get_capture(args.video)
     # create video writer if savepath is specified as video format
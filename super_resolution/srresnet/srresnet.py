@@ -11,6 +11,7 @@ sys.path.append('../../util')
 from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
 from image_utils import load_image  # noqa: E402
+from tiling_utils import iter_tiled_rows  # noqa: E402
 import webcamera_utils  # noqa: E402
 
 # logger
@@ -27,6 +28,7 @@ IMAGE_HEIGHT = 64    # net.get_input_shape()[3]
 IMAGE_WIDTH = 64     # net.get_input_shape()[2]
 OUTPUT_HEIGHT = 256  # net.get_output_shape()[3]
 OUTPUT_WIDTH = 256   # net.get_output.shape()[2]
+SCALE = OUTPUT_HEIGHT // IMAGE_HEIGHT
 
 
 # ======================
@@ -45,6 +47,14 @@ parser.add_argument(
     help=('Instead of resizing input image when loading it, ' +
           ' padding input and output image')
 )
+parser.add_argument(
+    '--overlap', type=int, default=8,
+    help='overlap between input tiles in padding mode, blended by feathering'
+)
+parser.add_argument(
+    '--batch_size', type=int, default=16,
+    help='number of tiles computed by one inference in padding mode'
+)
 args = update_parser(parser)
 
 
@@ -100,54 +110,36 @@ def recognize_from_image():
 
 
 def tiling(net, img):
+    """
+    Super-resolution of an image of any size by overlapping tiles,
+    computed args.batch_size at a time and blended with feather weights.
+    Recomposed rows are written straight into the uint8 output.
+    """
     h, w = img.shape[0], img.shape[1]
-
-    padding_w = int((w + IMAGE_WIDTH - 1) / IMAGE_WIDTH) * IMAGE_WIDTH
-    padding_h = int((h+IMAGE_HEIGHT-1) / IMAGE_HEIGHT) * IMAGE_HEIGHT
-    scale = int(OUTPUT_HEIGHT / IMAGE_HEIGHT)
-    output_padding_w = padding_w * scale
-    output_padding_h = padding_h * scale
-    output_w = w * scale
-    output_h = h * scale
+    output_h, output_w = h * SCALE, w * SCALE
 
     logger.debug(f'input image : {h}x{w}')
     logger.debug(f'output image : {output_w}x{output_h}')
 
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img = img / 255.0
-    img = img.transpose(2, 0, 1)
-    img = img[np.newaxis, :, :, :]
+    img = img.transpose(2, 0, 1).astype(np.float32) / 255.0
 
-    pad_img = np.zeros((1, 3, padding_h, padding_w))
-    pad_img[:, :, 0:h, 0:w] = img
+    def predict(tiles):
+        net.set_input_shape(tiles.shape)
+        return net.predict(tiles)
 
-    output_pad_img = np.zeros((1, 3, output_padding_h, output_padding_w))
-    tile_x = int(padding_w / IMAGE_WIDTH)
-    tile_y = int(padding_h / IMAGE_HEIGHT)
+    output_img = np.zeros((output_h, output_w, 3), dtype=np.uint8)
 
     # Inference
     start = int(round(time.time() * 1000))
-    for y in range(tile_y):
-        for x in range(tile_x):
-            output_pad_img[
-                :,
-                :,
-                y*OUTPUT_HEIGHT:(y+1)*OUTPUT_HEIGHT,
-                x*OUTPUT_WIDTH:(x+1)*OUTPUT_WIDTH
-            ] = net.predict(pad_img[
-                :,
-                :,
-                y*IMAGE_HEIGHT:(y+1)*IMAGE_HEIGHT,
-                x*IMAGE_WIDTH:(x+1)*IMAGE_WIDTH
-            ])
+    for top, rows in iter_tiled_rows(
+            img, predict, (IMAGE_HEIGHT, IMAGE_WIDTH),
+            overlap=args.overlap, scale=SCALE, batch_size=args.batch_size):
+        rows = np.clip(rows * 255, 0, 255).round().astype(np.uint8)
+        output_img[top:top + rows.shape[1]] = rows.transpose(1, 2, 0)[:, :, ::-1]
     end = int(round(time.time() * 1000))
     logger.info(f'ailia processing time {end - start} ms')
 
-    # Postprocessing
-    output_img = output_pad_img[0, :, :output_h, :output_w]
-    output_img = output_img.transpose(1, 2, 0).astype(np.float32)
-    output_img = cv2.cvtColor(output_img, cv2.COLOR_RGB2BGR)
-
     return output_img
 
 
@@ -165,7 +157,7 @@ def recognize_from_image_tiling():
         output_img = tiling(net, img)
         savepath = get_savepath(args.savepath, image_path)
         logger.info(f'saved at : {savepath}')
-        cv2.imwrite(savepath, output_img * 255)
+        cv2.imwrite(savepath, output_img)
     logger.info('Script finished successfully.')
 
 
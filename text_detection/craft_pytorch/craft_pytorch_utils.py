@@ -31,6 +31,16 @@ def pre_process(image):
 
 
 def post_process(y, image, ratio_w, ratio_h):
+    polys = detect_text(y, ratio_w, ratio_h)
+    return save_result(image[:, :, ::-1], polys)
+
+
+def detect_text(y, ratio_w, ratio_h, poly=False):
+    """
+    Text regions of the network output, in input image coordinates.
+    Each region is a (4, 2) box, or a polygon when `poly` is True and
+    the region is curved.
+    """
     score_text = y[0, :, :, 0]
     score_link = y[0, :, :, 1]
     boxes, polys = get_det_boxes(
@@ -39,7 +49,7 @@ def post_process(y, image, ratio_w, ratio_h):
         text_threshold=0.7,
         link_threshold=0.4,
         low_text=0.4,
-        poly=False,
+        poly=poly,
     )
     boxes = adjust_result_coordinates(boxes, ratio_w, ratio_h)
     polys = adjust_result_coordinates(polys, ratio_w, ratio_h)
@@ -47,7 +57,7 @@ def post_process(y, image, ratio_w, ratio_h):
         if polys[k] is None:
             polys[k] = boxes[k]
 
-    return save_result(image[:, :, ::-1], polys)
+    return polys
 
 
 # ======================
@@ -136,6 +146,20 @@ def get_det_boxes_core(
         text_score_comb.astype(np.uint8), connectivity=4
     )
 
+    # max text score of every label, in one sorted pass over the
+    # foreground pixels
+    fg = np.flatnonzero(labels)
+    fg_labels = labels.reshape(-1)[fg]
+    order = np.argsort(fg_labels, kind='stable')
+    starts = np.searchsorted(fg_labels[order], np.arange(1, nLabels))
+    label_max = np.zeros(nLabels, dtype=textmap.dtype)
+    if len(fg) > 0:
+        label_max[1:] = np.maximum.reduceat(
+            textmap.reshape(-1)[fg][order], starts)
+
+    # link area which is not text
+    link_only = np.logical_and(link_score == 1, text_score == 0)
+
     det = []
     mapper = []
     for k in range(1, nLabels):
@@ -145,14 +169,9 @@ def get_det_boxes_core(
             continue
 
         # thresholding
-        if np.max(textmap[labels == k]) < text_threshold:
+        if label_max[k] < text_threshold:
             continue
 
-        # make segmentation map
-        segmap = np.zeros(textmap.shape, dtype=np.uint8)
-        segmap[labels == k] = 255
-        # remove link area
-        segmap[np.logical_and(link_score == 1, text_score == 0)] = 0
         x, y = stats[k, cv2.CC_STAT_LEFT], stats[k, cv2.CC_STAT_TOP]
         w, h = stats[k, cv2.CC_STAT_WIDTH], stats[k, cv2.CC_STAT_HEIGHT]
         niter = int(math.sqrt(size * min(w, h) / (w * h)) * 2)
@@ -169,12 +188,17 @@ def get_det_boxes_core(
             ey = img_h
         kernel = cv2.getStructuringElement(
             cv2.MORPH_RECT, (1 + niter, 1 + niter))
-        segmap[sy:ey, sx:ex] = cv2.dilate(segmap[sy:ey, sx:ex], kernel)
+
+        # make segmentation map, only inside the dilated bounding box
+        segmap = np.zeros((ey - sy, ex - sx), dtype=np.uint8)
+        segmap[labels[sy:ey, sx:ex] == k] = 255
+        # remove link area
+        segmap[link_only[sy:ey, sx:ex]] = 0
+        segmap = cv2.dilate(segmap, kernel)
 
         # make box
-        np_contours = np.roll(
-            np.array(np.where(segmap != 0)), 1, axis=0
-        ).transpose().reshape(-1, 2)
+        ys, xs = np.nonzero(segmap)
+        np_contours = np.stack([xs + sx, ys + sy], axis=1)
         rectangle = cv2.minAreaRect(np_contours)
         box = cv2.boxPoints(rectangle)
 
@@ -233,16 +257,13 @@ def get_poly_core(boxes, labels, mapper, linkmap):
 
         """ Polygon generation """
         # find top/bottom contours
-        cp = []
-        max_len = -1
-        for i in range(w):
-            region = np.where(word_label[:, i] != 0)[0]
-            if len(region) < 2:
-                continue
-            cp.append((i, region[0], region[-1]))
-            length = region[-1] - region[0] + 1
-            if length > max_len:
-                max_len = length
+        nz = word_label != 0
+        col_len = nz.sum(axis=0)
+        top = np.argmax(nz, axis=0)
+        bottom = word_label.shape[0] - 1 - np.argmax(nz[::-1], axis=0)
+        cols = np.flatnonzero(col_len >= 2)
+        cp = list(zip(cols, top[cols], bottom[cols]))
+        max_len = (bottom[cols] - top[cols] + 1).max() if len(cols) else -1
 
         # pass if max_len is similar to h
         if h * max_len_ratio < max_len:
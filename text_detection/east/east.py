@@ -117,15 +117,38 @@ def post_processing(
         return None
 
     # here we filter some low score boxes by the average score map, this is different from the orginal paper
-    for i, box in enumerate(boxes):
-        mask = np.zeros_like(score_map, dtype=np.uint8)
-        cv2.fillPoly(mask, box[:8].reshape((-1, 4, 2)).astype(np.int32) // 4, 1)
-        boxes[i, 8] = cv2.mean(score_map, mask)[0]
+    boxes[:, 8] = box_scores(score_map, boxes[:, :8].reshape((-1, 4, 2)).astype(np.int32) // 4)
     boxes = boxes[boxes[:, 8] > box_thresh]
 
     return boxes
 
 
+def box_scores(score_map, polys):
+    '''
+    average of the score map inside each polygon
+    :param score_map: H*W score map
+    :param polys: N*4*2 int32 polygons in score map coordinates
+    :return: N scores
+
+    The polygon is rasterized only inside its bounding rectangle (clipped
+    to the map), so the cost scales with the box area, not the map size.
+    '''
+    h, w = score_map.shape
+    scores = np.zeros(len(polys), dtype=np.float32)
+    x0 = np.clip(polys[:, :, 0].min(axis=1), 0, w)
+    y0 = np.clip(polys[:, :, 1].min(axis=1), 0, h)
+    x1 = np.clip(polys[:, :, 0].max(axis=1) + 1, 0, w)
+    y1 = np.clip(polys[:, :, 1].max(axis=1) + 1, 0, h)
+    for i, poly in enumerate(polys):
+        if x1[i] <= x0[i] or y1[i] <= y0[i]:
+            continue
+        roi = score_map[y0[i]:y1[i], x0[i]:x1[i]]
+        mask = np.zeros(roi.shape, dtype=np.uint8)
+        cv2.fillPoly(mask, [poly - np.array([x0[i], y0[i]], dtype=np.int32)], 1)
+        scores[i] = cv2.mean(roi, mask)[0]
+    return scores
+
+
 def sort_poly(p):
     min_axis = np.argmin(np.sum(p, axis=1))
     p = p[[min_axis, (min_axis + 1) % 4, (min_axis + 2) % 4, (min_axis + 3) % 4]]
@@ -1,10 +1,6 @@
 import numpy as np
 
-USE_POLYGON=False
-if USE_POLYGON:
-    import Polygon
-else:
-    from poly_iou import poly_iou
+from poly_iou import poly_iou_batch, poly_iou_pairs
 
 __all__ = [
     'restore_rectangle',
@@ -88,35 +84,13 @@ def restore_rectangle(origin, geometry):
     return restore_rectangle_rbox(origin, geometry)
 
 
-def intersection(g, p):
-    if USE_POLYGON:
-        g = Polygon.Polygon(g[:8].reshape((4, 2)))
-        p = Polygon.Polygon(p[:8].reshape((4, 2)))
-        inter = (g & p).area()
-        union = g.area() + p.area() - inter
-        if union == 0:
-            return 0
-        else:
-            return inter / union
-    else:
-        g = g[:8].reshape((4, 2))
-        p = p[:8].reshape((4, 2))
-        return poly_iou(g, p)
-
-
-def weighted_merge(g, p):
-    g[:8] = (g[8] * g[:8] + p[8] * p[:8]) / (g[8] + p[8])
-    g[8] = (g[8] + p[8])
-    return g
-
-
 def standard_nms(S, thres):
     order = np.argsort(S[:, 8])[::-1]
     keep = []
     while order.size > 0:
         i = order[0]
         keep.append(i)
-        ovr = np.array([intersection(S[i], S[t]) for t in order[1:]])
+        ovr = poly_iou_batch(S[i, :8], S[order[1:], :8])
 
         inds = np.where(ovr <= thres)[0]
         order = order[inds + 1]
@@ -124,24 +98,35 @@ def standard_nms(S, thres):
     return S[keep]
 
 
-def nms_locality(polys, thres=0.3):
+def nms_locality(polys, thres=0.3, batch_size=4096):
     '''
     locality aware nms of EAST
     :param polys: a N*9 numpy array. first 8 coordinates, then prob
     :return: boxes after nms
+
+    The candidates come sorted by row, so neighbours in the array belong to
+    the same text line. The IoU of each candidate with the previous one is
+    computed for a whole batch at once, a new group starts where it is not
+    above `thres`, and each group is merged by a score weighted average.
+    Unlike the sequential version, the overlap is measured against the
+    previous candidate instead of the running merged box.
     '''
-    S = []
-    p = None
-    for g in polys:
-        if p is not None and intersection(g, p) > thres:
-            p = weighted_merge(g, p)
-        else:
-            if p is not None:
-                S.append(p)
-            p = g
-    if p is not None:
-        S.append(p)
-
-    if len(S) == 0:
+    if len(polys) == 0:
         return np.array([])
-    return standard_nms(np.array(S), thres)
+
+    quads = polys[:, :8].reshape((-1, 4, 2))
+    ious = np.zeros(len(polys))
+    for start in range(1, len(polys), batch_size):
+        end = min(start + batch_size, len(polys))
+        ious[start:end] = poly_iou_pairs(quads[start - 1:end - 1], quads[start:end])
+
+    starts = np.concatenate([[0], np.nonzero(ious[1:] <= thres)[0] + 1])
+    scores = polys[:, 8]
+    score_sum = np.add.reduceat(scores, starts)
+    S = np.empty((len(starts), 9), dtype=polys.dtype)
+    S[:, :8] = np.add.reduceat(polys[:, :8] * scores[:, np.newaxis], starts) \
+        / score_sum[:, np.newaxis]
+    S[:, 8] = score_sum
+
+    return standard_nms(S, thres)
+
@@ -5,9 +5,14 @@ import math
 import numpy as np
 
 __all__ = [
-    'poly_iou'
+    'poly_iou',
+    'poly_iou_batch',
+    'poly_iou_pairs',
 ]
 
+# a convex quadrangle clipped by another one has at most 8 vertices
+MAX_VERTICES = 8
+
 
 def crossing_number(point, polys):
     cn = 0
@@ -211,6 +216,98 @@ def poly_iou(g, p):
         return inter / union
 
 
+def signed_area(polys, count=None):
+    """
+    Shoelace signed area of (N, M, 2) polygons, the first `count` vertices
+    of each polygon are used (all M if None).
+    """
+    n, m = polys.shape[:2]
+    idx = np.arange(m)[np.newaxis, :]
+    if count is None:
+        count = np.full(n, m)
+    valid = idx < count[:, np.newaxis]
+    nxt = np.where(idx + 1 >= count[:, np.newaxis], 0, idx + 1)
+    q = np.take_along_axis(polys, nxt[:, :, np.newaxis], axis=1)
+    cross = polys[:, :, 0] * q[:, :, 1] - q[:, :, 0] * polys[:, :, 1]
+    return 0.5 * np.sum(np.where(valid, cross, 0), axis=1)
+
+
+def clip_polygons(polys, count, a, b):
+    """
+    One Sutherland-Hodgman step on stacked polygons: keep the part of each
+    polygon on the left of the directed edge a -> b. a and b are (2,) or
+    one edge per polygon (N, 2).
+    """
+    n, m = polys.shape[:2]
+    a = np.broadcast_to(a, (n, 2))[:, np.newaxis, :]
+    b = np.broadcast_to(b, (n, 2))[:, np.newaxis, :]
+    idx = np.arange(m)[np.newaxis, :]
+    valid = idx < count[:, np.newaxis]
+    prv_idx = np.where(idx == 0, count[:, np.newaxis] - 1, idx - 1)
+    prv_idx = np.maximum(prv_idx, 0)
+    prv = np.take_along_axis(polys, prv_idx[:, :, np.newaxis], axis=1)
+
+    e = b - a
+    d_cur = e[..., 0] * (polys[..., 1] - a[..., 1]) - \
+        e[..., 1] * (polys[..., 0] - a[..., 0])
+    d_prv = e[..., 0] * (prv[..., 1] - a[..., 1]) - \
+        e[..., 1] * (prv[..., 0] - a[..., 0])
+    in_cur = d_cur >= 0
+    in_prv = d_prv >= 0
+
+    denom = d_prv - d_cur
+    t = d_prv / np.where(denom == 0, 1, denom)
+    inter = prv + t[:, :, np.newaxis] * (polys - prv)
+
+    # each vertex emits [intersection, vertex], kept by the SH rules
+    out = np.empty((n, 2 * m, 2), polys.dtype)
+    out[:, 0::2] = inter
+    out[:, 1::2] = polys
+    keep = np.empty((n, 2 * m), bool)
+    keep[:, 0::2] = valid & (in_cur != in_prv)
+    keep[:, 1::2] = valid & in_cur
+
+    order = np.argsort(~keep, axis=1, kind='stable')[:, :MAX_VERTICES]
+    out = np.take_along_axis(out, order[:, :, np.newaxis], axis=1)
+    return out, np.minimum(keep.sum(axis=1), MAX_VERTICES)
+
+
+def poly_iou_pairs(gs, ps):
+    """
+    IoU of the convex quadrangles gs[i] and ps[i], gs and ps are (N, 4, 2)
+    """
+    gs = np.asarray(gs, dtype=np.float64).reshape(-1, 4, 2)
+    ps = np.asarray(ps, dtype=np.float64).reshape(-1, 4, 2)
+    n = len(ps)
+    if n == 0:
+        return np.zeros(0)
+
+    # clip edges must be counter clockwise
+    area_g = signed_area(gs)
+    gs = np.where((area_g < 0)[:, np.newaxis, np.newaxis], gs[:, ::-1], gs)
+    area_g = np.abs(area_g)
+    area_p = np.abs(signed_area(ps))
+
+    polys = np.zeros((n, MAX_VERTICES, 2))
+    polys[:, :4] = ps
+    count = np.full(n, 4)
+    for i in range(4):
+        polys, count = clip_polygons(polys, count, gs[:, i], gs[:, (i + 1) % 4])
+
+    inter = np.where(count >= 3, np.abs(signed_area(polys, count)), 0)
+    union = area_g + area_p - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1), 0)
+
+
+def poly_iou_batch(g, ps):
+    """
+    IoU of the convex quadrangle g (4, 2) with each of ps (N, 4, 2)
+    """
+    ps = np.asarray(ps, dtype=np.float64).reshape(-1, 4, 2)
+    g = np.asarray(g, dtype=np.float64).reshape(1, 4, 2)
+    return poly_iou_pairs(np.broadcast_to(g, ps.shape), ps)
+
+
 if __name__ == '__main__':
     g = np.array([
         811.2532959, 267.52346802, 871.93408203, 265.97250366,
@@ -222,3 +319,4 @@ if __name__ == '__main__':
     ]).reshape(-1, 2)
 
     print(poly_iou(g, p))
+    print(poly_iou_batch(g, p[np.newaxis]))
@@ -8,60 +8,84 @@ __all__ = [
 ]
 
 
+# (dx, dy) of the 8 neighbours, in the order of the link channels
+NEIGHBOURS = [
+    (-1, -1), (0, -1), (1, -1), (-1, 0),
+    (1, 0), (-1, 1), (0, 1), (1, 1)
+]
+
+
 def decode_batch(
         pixel_cls_scores, pixel_link_scores,
         pixel_conf_threshold=0.8, link_conf_threshold=0.8):
-    batch_size = pixel_cls_scores.shape[0]
-    batch_mask = []
-    for image_idx in range(batch_size):
-        image_pos_pixel_scores = pixel_cls_scores[image_idx, :, :]
-        image_pos_link_scores = pixel_link_scores[image_idx, :, :, :]
-        mask = decode_image(
-            image_pos_pixel_scores, image_pos_link_scores,
-            pixel_conf_threshold, link_conf_threshold
-        )
-        batch_mask.append(mask)
-    return np.asarray(batch_mask, np.int32)
-
-
-def get_neighbours(x, y):
-    return [
-        (x - 1, y - 1), (x, y - 1), (x + 1, y - 1), (x - 1, y), \
-        (x + 1, y), (x - 1, y + 1), (x, y + 1), (x + 1, y + 1)
-    ]
+    """
+    Group positive pixels linked to each other into text instances.
 
+    All images of the batch are labeled together: links are turned into
+    edges between flat pixel indices with array shifts, and the connected
+    components are found by a vectorized union-find. Instance ids start
+    from 1 in each image, in the raster order of their first pixel.
+    """
+    pixel_mask = pixel_cls_scores >= pixel_conf_threshold
+    link_mask = pixel_link_scores >= link_conf_threshold
+    batch_size, h, w = pixel_mask.shape
+    result_mask = np.zeros(pixel_mask.shape, np.int32)
 
-def is_valid_cord(x, y, w, h):
-    return x >= 0 and x < w and y >= 0 and y < h
+    # compact index of each positive pixel
+    flat_mask = pixel_mask.reshape(-1)
+    pos = np.flatnonzero(flat_mask)
+    if len(pos) == 0:
+        return result_mask
+    index = np.full(flat_mask.shape, -1, np.int64)
+    index[pos] = np.arange(len(pos))
+    index = index.reshape(pixel_mask.shape)
+
+    # undirected edges, each neighbour pair is visited once (the neighbours
+    # after the pixel in raster order) and linked if either side links
+    us, vs = [], []
+    for n_idx in range(4, 8):
+        dx, dy = NEIGHBOURS[n_idx]
+        ys = slice(0, h - dy)
+        xs = slice(max(-dx, 0), w - max(dx, 0))
+        nys = slice(dy, h)
+        nxs = slice(max(dx, 0), w - max(-dx, 0))
+        edge = pixel_mask[:, ys, xs] & pixel_mask[:, nys, nxs] & (
+            link_mask[:, ys, xs, n_idx] | link_mask[:, nys, nxs, 7 - n_idx])
+        us.append(index[:, ys, xs][edge])
+        vs.append(index[:, nys, nxs][edge])
+    u = np.concatenate(us)
+    v = np.concatenate(vs)
+
+    # union-find: hook the larger root under the smaller one, then
+    # compress the paths, until both ends of every edge share a root
+    parent = np.arange(len(pos))
+    while True:
+        pu, pv = parent[u], parent[v]
+        diff = pu != pv
+        if not diff.any():
+            break
+        np.minimum.at(parent, np.maximum(pu, pv)[diff], np.minimum(pu, pv)[diff])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+    # the root is the first pixel of the instance in raster order
+    roots, group = np.unique(parent, return_inverse=True)
+    root_image = pos[roots] // (h * w)
+    first = np.searchsorted(root_image, np.arange(batch_size))
+    group_id = np.arange(len(roots)) - first[root_image] + 1
+    result_mask.reshape(-1)[pos] = group_id[group.reshape(-1)]
+    return result_mask
 
 
 def decode_image(
         pixel_scores, link_scores,
         pixel_conf_threshold, link_conf_threshold):
-    #
-    pixel_mask = pixel_scores >= pixel_conf_threshold
-    link_mask = link_scores >= link_conf_threshold
-    done_mask = np.zeros(pixel_mask.shape, np.bool)
-    result_mask = np.zeros(pixel_mask.shape, np.int32)
-    points = list(zip(*np.where(pixel_mask)))
-    h, w = np.shape(pixel_mask)
-    group_id = 0
-    for point in points:
-        if done_mask[point]:
-            continue
-        group_id += 1
-        group_q = [point]
-        result_mask[point] = group_id
-        while len(group_q):
-            y, x = group_q[-1]
-            group_q.pop()
-            if not done_mask[y, x]:
-                done_mask[y, x], result_mask[y, x] = True, group_id
-                for n_idx, (nx, ny) in enumerate(get_neighbours(x, y)):
-                    if is_valid_cord(nx, ny, w, h) and pixel_mask[ny, nx] and (
-                            link_mask[y, x, n_idx] or link_mask[ny, nx, 7 - n_idx]):
-                        group_q.append((ny, nx))
-    return result_mask
+    return decode_batch(
+        pixel_scores[np.newaxis], link_scores[np.newaxis],
+        pixel_conf_threshold, link_conf_threshold)[0]
 
 
 def find_contours(mask, method=None):
@@ -134,13 +158,34 @@ def mask_to_bboxes(
     max_bbox_idx = mask.max()
     mask = cv2.resize(mask, (image_w, image_h),
                       interpolation=cv2.INTER_NEAREST)
-
-    for bbox_idx in range(1, max_bbox_idx + 1):
-        bbox_mask = mask == bbox_idx
+    if max_bbox_idx <= 0:
+        return bboxes
+
+    # bounds of all instances in one pass over the labeled pixels
+    ys, xs = np.nonzero(mask)
+    labels = mask[ys, xs]
+    n = max_bbox_idx + 1
+    x0 = np.full(n, image_w)
+    y0 = np.full(n, image_h)
+    x1 = np.full(n, -1)
+    y1 = np.full(n, -1)
+    np.minimum.at(x0, labels, xs)
+    np.minimum.at(y0, labels, ys)
+    np.maximum.at(x1, labels, xs)
+    np.maximum.at(y1, labels, ys)
+
+    for bbox_idx in range(1, n):
+        if x1[bbox_idx] < 0:
+            continue
+        # contour of the instance inside its bounds, with a 1px margin
+        bbox_mask = mask[y0[bbox_idx]:y1[bbox_idx] + 1,
+                         x0[bbox_idx]:x1[bbox_idx] + 1] == bbox_idx
+        bbox_mask = np.pad(bbox_mask, 1)
         cnts = find_contours(bbox_mask)
         if len(cnts) == 0:
             continue
-        cnt = cnts[0]
+        cnt = cnts[0] + np.array([x0[bbox_idx] - 1, y0[bbox_idx] - 1],
+                                 dtype=cnts[0].dtype)
         rect, rect_area = min_area_rect(cnt)
 
         w, h = rect[2:-1]
@@ -11,6 +11,7 @@ import ailia
 sys.path.append('../../util')
 from utils import get_base_parser, update_parser  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
+from ctc_utils import greedy_decode  # noqa: E402
 import webcamera_utils  # noqa: E402
 
 # logger
@@ -54,19 +55,9 @@ def pre_process(image):
 
 
 def post_process(preds, length, alphabet):
-    preds = np.argmax(preds, axis=2).transpose(1, 0)[0]
-    
-    alphabet = alphabet + '-'  # for `-1` index
-    dict = {}
-    for i, char in enumerate(alphabet):
-        dict[char] = i + 1
-
-    assert len(preds)== length, "text with length: {} does not match declared length: {}".format(len(preds), length)
-    char_list = []
-    for i in range(length):
-        if preds[i] != 0 and (not (i > 0 and preds[i - 1] == preds[i])):
-            char_list.append(alphabet[preds[i] - 1])
-    return ''.join(char_list)
+    # preds: (T, B, C), class 0 is the CTC blank
+    assert len(preds) == length, "text with length: {} does not match declared length: {}".format(len(preds), length)
+    return greedy_decode(preds.transpose(1, 0, 2), '-' + alphabet)[0]
 
 
 def predict(net, image):
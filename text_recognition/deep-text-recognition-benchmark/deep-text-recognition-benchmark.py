@@ -1,4 +1,6 @@
+import os
 import sys
+import csv
 import time
 import codecs
 import argparse
@@ -12,6 +14,7 @@ sys.path.append('../../util')
 from utils import get_base_parser, update_parser, get_savepath  # noqa: E402
 from model_utils import check_and_download_models  # noqa: E402
 from webcamera_utils import adjust_frame_size, get_capture  # noqa: E402
+from ctc_utils import softmax, greedy_decode, max_prob_confidence  # noqa: E402
 
 import string
 
@@ -30,6 +33,13 @@ IMAGE_FOLDER_PATH = 'demo_image/'
 IMAGE_WIDTH = 100
 IMAGE_HEIGHT = 32
 
+# batch mode
+SAVE_CSV_PATH = 'output.csv'
+MAX_WIDTH = 400
+BUCKET_STEP = 50
+
+CHARACTER = '0123456789abcdefghijklmnopqrstuvwxyz'
+
 
 # ======================
 # Arguemnt Parser Config
@@ -38,6 +48,12 @@ IMAGE_HEIGHT = 32
 parser = get_base_parser(
     'deep text recognition benchmark.', IMAGE_FOLDER_PATH, None
 )
+parser.add_argument(
+    '--batch_size', type=int, default=1,
+    help=('batch mode if larger than 1: crops keep their aspect ratio, are '
+          'padded to width buckets and recognized by batches of this size. '
+          'Results are written to --savepath as CSV')
+)
 args = update_parser(parser)
 
 
@@ -45,29 +61,9 @@ args = update_parser(parser)
 # Utils
 # ======================
 
-def ctc_decode(text_index, length, character):
-    dict_character = list(character)
-
-    dict = {}
-    for i, char in enumerate(dict_character):
-        dict[char] = i + 1
-
-    character = ['[CTCblank]'] + dict_character
-    CTC_BLANK = 0
-    
-    texts = []
-    for index, l in enumerate(length):
-        t = text_index[index, :]
-
-        char_list = []
-        for i in range(l):
-            if t[i] != CTC_BLANK and (not (i > 0 and t[i - 1] == t[i])):
-                char_list.append(character[t[i]])
-        text = ''.join(char_list)
-
-        texts.append(text)
-
-    return texts
+def ctc_decode(preds, length, character):
+    # class 0 is the CTC blank
+    return greedy_decode(preds, ['[CTCblank]'] + list(character), lengths=length)
 
 def preprocess_image(sample):
     sample = cv2.resize(sample,(IMAGE_WIDTH,IMAGE_HEIGHT),interpolation=cv2.INTER_CUBIC)
@@ -75,9 +71,20 @@ def preprocess_image(sample):
     sample = sample/127.5 - 1.0
     return sample
 
-def softmax(x):
-    u = numpy.sum(numpy.exp(x))
-    return numpy.exp(x)/u
+def preprocess_image_keep_ratio(sample):
+    """
+    Resize to IMAGE_HEIGHT keeping the aspect ratio, then pad the width to
+    its bucket by repeating the last column.
+    Returns the padded image and its valid width.
+    """
+    h, w = sample.shape[:2]
+    w = min(max(int(numpy.ceil(IMAGE_HEIGHT * w / h)), 1), MAX_WIDTH)
+    sample = cv2.resize(sample, (w, IMAGE_HEIGHT), interpolation=cv2.INTER_CUBIC)
+    sample = cv2.cvtColor(sample, cv2.COLOR_BGR2GRAY)
+
+    bucket_w = max(int(numpy.ceil(w / BUCKET_STEP)) * BUCKET_STEP, IMAGE_WIDTH)
+    sample = numpy.pad(sample, ((0, 0), (0, bucket_w - w)), mode='edge')
+    return sample / 127.5 - 1.0, w
 
 dashed_line = '-' * 80
 
@@ -90,12 +97,16 @@ def recognize_from_image():
 
     print(args.input)
 
+    if args.batch_size > 1:
+        recognize_batch(args.input, session)
+        return
+
     for path in args.input:
         recognize_one_image(path,session)
 
 def recognize_one_image(image_path,session):
     """ model configuration """
-    character = '0123456789abcdefghijklmnopqrstuvwxyz'
+    character = CHARACTER
     imgH = IMAGE_HEIGHT
     imgW = IMAGE_WIDTH
     batch_size = 1
@@ -111,20 +122,81 @@ def recognize_one_image(image_path,session):
 
     # Select max probabilty (greedy decoding) then decode index to character
     preds_size = [int(preds.shape[1])] * batch_size
-    preds_index = numpy.argmax(preds,axis=2)
+    preds_str = ctc_decode(preds, preds_size, character)
 
-    preds_str = ctc_decode(preds_index, preds_size, character)
-    preds_prob = numpy.zeros(preds.shape)
-    
-    for b in range(0,preds.shape[0]):
-        for t in range(0,preds.shape[1]):
-            preds_prob[b,t,:]=softmax(preds[b,t,:])
+    preds_prob = softmax(preds, axis=2)
+    confidence_scores = max_prob_confidence(preds_prob, preds_size)
+    for img_name, pred, confidence_score in zip([image_path], preds_str, confidence_scores):
+        logger.info(f'{img_name:25s}\t{pred:25s}\t{confidence_score:0.4f}')
 
-    preds_max_prob = numpy.max(preds_prob,axis=2)
-    for img_name, pred, pred_max_prob in zip([image_path], preds_str, preds_max_prob):
-        confidence_score = pred_max_prob.cumprod(axis=0)[-1]
 
-        logger.info(f'{img_name:25s}\t{pred:25s}\t{confidence_score:0.4f}')
+def predict_bucket(session, images, widths):
+    """
+    Recognize a batch of crops padded to the same width.
+    Returns the texts and the confidence scores.
+    """
+    x = numpy.stack(images)[:, numpy.newaxis].astype(numpy.float32)
+    session.set_input_shape(x.shape)
+    preds = session.predict(x)
+
+    # time steps which only see the padding are ignored
+    steps = preds.shape[1]
+    preds_size = numpy.ceil(
+        numpy.array(widths) * steps / x.shape[3]).astype(int)
+    preds_str = ctc_decode(preds, preds_size, CHARACTER)
+
+    preds_prob = softmax(preds, axis=2)
+    confidence_scores = max_prob_confidence(preds_prob, preds_size)
+    return preds_str, confidence_scores
+
+
+def recognize_batch(image_paths, session):
+    """
+    Crops are loaded one by one and queued by bucket width. A bucket is
+    recognized as soon as it holds batch_size crops, and its results are
+    appended to the CSV, so memory use does not depend on the number of
+    inputs.
+    """
+    savepath = args.savepath if args.savepath else SAVE_CSV_PATH
+    if os.path.isdir(savepath):
+        savepath = os.path.join(savepath, SAVE_CSV_PATH)
+
+    buckets = {}
+    n_images = 0
+    start = time.time()
+
+    with open(savepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image_path', 'predicted_labels', 'confidence_score'])
+
+        def flush(bucket_w):
+            paths, images, widths = zip(*buckets.pop(bucket_w))
+            preds_str, confidence_scores = predict_bucket(
+                session, images, widths)
+            for row in zip(paths, preds_str, confidence_scores):
+                writer.writerow([row[0], row[1], f'{row[2]:0.4f}'])
+
+        for path in image_paths:
+            input_img = cv2.imread(path)
+            if input_img is None:
+                logger.warning(f'cannot read {path}')
+                continue
+            input_img, w = preprocess_image_keep_ratio(input_img)
+
+            bucket_w = input_img.shape[1]
+            buckets.setdefault(bucket_w, []).append((path, input_img, w))
+            if len(buckets[bucket_w]) >= args.batch_size:
+                flush(bucket_w)
+
+            n_images += 1
+            if n_images % 10000 == 0:
+                logger.info(f'{n_images} images '
+                            f'({n_images / (time.time() - start):.1f} images/s)')
+
+        for bucket_w in sorted(buckets):
+            flush(bucket_w)
+
+    logger.info(f'{n_images} images recognized, saved at : {savepath}')
 
 
 if __name__ == '__main__':
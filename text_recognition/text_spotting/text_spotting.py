@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+
+import cv2
+import numpy as np
+
+import ailia
+
+sys.path.append('../../text_detection/craft_pytorch')
+import craft_pytorch_utils  # noqa: E402
+
+# import original modules
+sys.path.append('../../util')
+from utils import get_base_parser, update_parser  # noqa: E402
+from model_utils import check_and_download_models  # noqa: E402
+from ctc_utils import softmax, greedy_decode, max_prob_confidence  # noqa: E402
+
+# logger
+from logging import getLogger   # noqa: E402
+logger = getLogger(__name__)
+
+
+# ======================
+# Parameters
+# ======================
+DETECTOR_WEIGHT_PATH = 'craft.onnx'
+DETECTOR_MODEL_PATH = 'craft.onnx.prototxt'
+DETECTOR_REMOTE_PATH = \
+    'https://storage.googleapis.com/ailia-models/craft-pytorch/'
+
+RECOGNIZER_WEIGHT_PATH = 'crnn_pytorch.onnx'
+RECOGNIZER_MODEL_PATH = 'crnn_pytorch.onnx.prototxt'
+RECOGNIZER_REMOTE_PATH = \
+    'https://storage.googleapis.com/ailia-models/crnn_pytorch/'
+
+IMAGE_PATH = '../../text_detection/craft_pytorch/imgs/00_00.jpg'
+SAVE_PATH = 'output.jsonl'
+
+# class 0 is the CTC blank
+CHARACTERS = '-0123456789abcdefghijklmnopqrstuvwxyz'
+
+# crnn_pytorch.onnx is exported for a (1, 1, 32, 100) input
+CROP_HEIGHT = 32
+CROP_WIDTH = 100
+
+
+# ======================
+# Arguemnt Parser Config
+# ======================
+parser = get_base_parser(
+    'Text spotting: CRAFT detection + CRNN recognition',
+    IMAGE_PATH,
+    SAVE_PATH,
+)
+parser.add_argument(
+    '--batch_size', type=int, default=32,
+    help='maximum number of word crops recognized at once'
+)
+args = update_parser(parser)
+
+
+# ======================
+# Utils
+# ======================
+def rectify(gray, box):
+    """
+    Warp the quad `box` (tl, tr, br, bl) to an upright crop of
+    CROP_WIDTH x CROP_HEIGHT.
+    """
+    box = np.asarray(box, dtype=np.float32)
+    w = max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[3] - box[2]))
+    h = max(np.linalg.norm(box[1] - box[2]), np.linalg.norm(box[0] - box[3]))
+    w, h = max(int(round(w)), 1), max(int(round(h)), 1)
+
+    tar = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    M = cv2.getPerspectiveTransform(box, tar)
+    crop = cv2.warpPerspective(gray, M, (w, h), flags=cv2.INTER_LINEAR)
+
+    interpolation = cv2.INTER_AREA \
+        if CROP_WIDTH < w and CROP_HEIGHT < h else cv2.INTER_LINEAR
+    return cv2.resize(
+        crop, (CROP_WIDTH, CROP_HEIGHT), interpolation=interpolation)
+
+
+def recognize_crops(net, crops):
+    """
+    Batched recognition of the rectified crops.
+    Returns the text and the confidence of each crop.
+
+    If the recognizer can not be reshaped to a batch of crops, it falls
+    back to one crop at a time (--batch_size 1) for the rest of the run.
+    """
+    texts = [''] * len(crops)
+    confidences = np.zeros(len(crops), np.float32)
+    start = 0
+    while start < len(crops):
+        idx = np.arange(start, min(start + args.batch_size, len(crops)))
+        x = np.stack([crops[i] for i in idx])[:, np.newaxis]
+        x = ((x / 255 - 0.5) / 0.5).astype(np.float32)
+
+        try:
+            net.set_input_shape(x.shape)
+            preds = net.predict({'input.1': x})[0]
+        except Exception:
+            if len(idx) == 1:
+                raise
+            logger.warning(
+                'the recognizer does not accept a batch of %d crops, '
+                'falling back to --batch_size 1' % len(idx))
+            args.batch_size = 1
+            continue
+        start += len(idx)
+
+        # preds: (T, B, C)
+        probs = softmax(preds.transpose(1, 0, 2))
+        for i, text, conf in zip(
+                idx, greedy_decode(probs, CHARACTERS),
+                max_prob_confidence(probs)):
+            texts[i] = text
+            confidences[i] = conf
+    return texts, confidences
+
+
+def spot_text(detector, recognizer, image):
+    x, ratio_w, ratio_h = craft_pytorch_utils.pre_process(image)
+    detector.set_input_shape((1, 3, x.shape[2], x.shape[3]))
+    y, _ = detector.predict({'input.1': x})
+    boxes = craft_pytorch_utils.detect_text(y, ratio_w, ratio_h)
+
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    crops = [rectify(gray, box) for box in boxes]
+    texts, confidences = recognize_crops(recognizer, crops)
+
+    return [
+        {
+            'box': np.round(box, 1).tolist(),
+            'text': text,
+            'confidence': float(conf),
+        }
+        for box, text, conf in zip(boxes, texts, confidences)
+    ]
+
+
+# ======================
+# Main functions
+# ======================
+def recognize_from_image():
+    # net initialize
+    detector = ailia.Net(
+        DETECTOR_MODEL_PATH, DETECTOR_WEIGHT_PATH, env_id=args.env_id)
+    recognizer = ailia.Net(
+        RECOGNIZER_MODEL_PATH, RECOGNIZER_WEIGHT_PATH, env_id=args.env_id)
+
+    savepath = args.savepath
+    if os.path.isdir(savepath):
+        savepath = os.path.join(savepath, SAVE_PATH)
+
+    with open(savepath, 'w') as f:
+        # input image loop
+        for image_path in args.input:
+            logger.info(image_path)
+            image = craft_pytorch_utils.load_image(image_path)
+
+            # inference
+            logger.info('Start inference...')
+            if args.benchmark:
+                logger.info('BENCHMARK mode')
+                for i in range(5):
+                    start = int(round(time.time() * 1000))
+                    words = spot_text(detector, recognizer, image)
+                    end = int(round(time.time() * 1000))
+                    logger.info(f'\tailia processing time {end - start} ms')
+            else:
+                words = spot_text(detector, recognizer, image)
+
+            for word in words:
+                logger.info(f"{word['text']} ({word['confidence']:.3f})")
+                f.write(json.dumps(dict(image=image_path, **word)) + '\n')
+
+    logger.info(f'saved at : {savepath}')
+    logger.info('Script finished successfully.')
+
+
+def main():
+    # model files check and download
+    check_and_download_models(
+        DETECTOR_WEIGHT_PATH, DETECTOR_MODEL_PATH, DETECTOR_REMOTE_PATH)
+    check_and_download_models(
+        RECOGNIZER_WEIGHT_PATH, RECOGNIZER_MODEL_PATH, RECOGNIZER_REMOTE_PATH)
+
+    recognize_from_image()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+import math
+
+import numpy as np
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+
+def softmax(x, axis=-1):
+    """
+    Numerically stable softmax along `axis`
+
+    Parameters
+    ----------
+    x: numpy array
+    axis: int
+
+    Returns
+    -------
+    probs: numpy array (float32)
+    """
+    x = np.asarray(x, dtype=np.float32)
+    e = np.exp(x - x.max(axis=axis, keepdims=True))
+    return e / e.sum(axis=axis, keepdims=True)
+
+
+def _as_batch(preds, lengths, ndim=3):
+    preds = np.asarray(preds)
+    if preds.ndim == ndim - 1:
+        preds = preds[np.newaxis]
+    batch, time_steps = preds.shape[:2]
+    if lengths is None:
+        lengths = np.full(batch, time_steps)
+    lengths = np.minimum(np.asarray(lengths).reshape(-1), time_steps)
+    return preds, lengths
+
+
+def greedy_decode(preds, characters, lengths=None, blank=0):
+    """
+    Batched best path CTC decoding
+
+    Parameters
+    ----------
+    preds: numpy array
+        (B, T, C) or (T, C) scores (probabilities or logits)
+    characters: str or list of str
+        character of each class index, the entry at `blank` is never output
+    lengths: numpy array, default is None
+        number of valid time steps of each sequence, all T if None
+    blank: int, default is 0
+        index of the CTC blank class
+
+    Returns
+    -------
+    texts: list of str
+    """
+    preds, lengths = _as_batch(preds, lengths)
+    index = np.argmax(preds, axis=2)
+    return collapse(index, characters, lengths=lengths, blank=blank)
+
+
+def collapse(index, characters, lengths=None, blank=0):
+    """
+    Merge repeated labels then remove blanks, for a (B, T) label array
+
+    Parameters
+    ----------
+    index: numpy array
+        (B, T) or (T,) class index of each time step
+    characters: str or list of str
+    lengths: numpy array, default is None
+    blank: int, default is 0
+
+    Returns
+    -------
+    texts: list of str
+    """
+    index, lengths = _as_batch(index, lengths, ndim=2)
+    batch, time_steps = index.shape
+
+    keep = index != blank
+    keep[:, 1:] &= index[:, 1:] != index[:, :-1]
+    keep &= np.arange(time_steps)[np.newaxis, :] < lengths[:, np.newaxis]
+
+    chars = np.asarray(list(characters), dtype=object)[index[keep]]
+    splits = np.cumsum(keep.sum(axis=1))[:-1]
+    return [''.join(c) for c in np.split(chars, splits)]
+
+
+def max_prob_confidence(probs, lengths=None):
+    """
+    Confidence of the best path, product of the max probability over time
+
+    Parameters
+    ----------
+    probs: numpy array
+        (B, T, C) probabilities
+    lengths: numpy array, default is None
+
+    Returns
+    -------
+    confidence: numpy array
+        (B,)
+    """
+    probs, lengths = _as_batch(probs, lengths)
+    max_prob = probs.max(axis=2)
+    valid = np.arange(probs.shape[1])[np.newaxis, :] < lengths[:, np.newaxis]
+    return np.exp(np.sum(np.log(np.where(valid, max_prob, 1.0)), axis=1))
+
+
+class NgramLanguageModel:
+    """
+    Word n-gram model loaded from an ARPA file, with Katz backoff
+
+    The instance can be given as `lm` to `prefix_beam_search`, it returns
+    the natural log probability of the last word given the previous ones.
+    """
+
+    LOG10_TO_LN = math.log(10)
+
+    def __init__(self, arpa_path, oov_log10=-10.0):
+        self.order = 0
+        self.probs = {}
+        self.backoffs = {}
+        self.oov_log10 = oov_log10
+        self._load(arpa_path)
+
+    def _load(self, arpa_path):
+        logger.info(f'loading language model: {arpa_path}')
+        n = 0
+        with open(arpa_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('\\data\\') or \
+                        line.startswith('ngram ') or line == '\\end\\':
+                    continue
+                if line.startswith('\\') and line.endswith('-grams:'):
+                    n = int(line[1:line.index('-')])
+                    self.order = max(self.order, n)
+                    continue
+                fields = line.split()
+                words = tuple(fields[1:1 + n])
+                self.probs[words] = float(fields[0])
+                if len(fields) > 1 + n:
+                    self.backoffs[words] = float(fields[1 + n])
+
+    def log10_prob(self, words):
+        words = tuple(words[-self.order:])
+        backoff = 0.0
+        while words:
+            if words in self.probs:
+                return backoff + self.probs[words]
+            backoff += self.backoffs.get(words[:-1], 0.0)
+            words = words[1:]
+        return self.probs.get(('<unk>',), self.oov_log10)
+
+    def __call__(self, words):
+        return self.log10_prob(words) * self.LOG10_TO_LN
+
+
+_HASH_BASE = np.uint64(1000003)
+
+
+def _candidates(log_probs, cutoff_top_n, cutoff_prob):
+    """(T, C) mask of the classes considered at each time step"""
+    order = np.argsort(-log_probs, axis=1)[:, :cutoff_top_n]
+    n_keep = np.full(len(order), order.shape[1])
+    if cutoff_prob < 1.0:
+        sorted_probs = np.exp(np.take_along_axis(log_probs, order, axis=1))
+        cum = np.cumsum(sorted_probs, axis=1)
+        n_keep = np.sum(cum - sorted_probs < cutoff_prob, axis=1)
+    mask = np.zeros(log_probs.shape, bool)
+    rank = np.arange(order.shape[1])[np.newaxis, :] < n_keep[:, np.newaxis]
+    np.put_along_axis(mask, order, rank, axis=1)
+    return mask
+
+
+def prefix_beam_search(
+        probs, characters, lengths=None, beam_width=16, blank=0,
+        lm=None, alpha=0.0, beta=0.0, space=' ',
+        cutoff_top_n=40, cutoff_prob=1.0,
+):
+    """
+    CTC prefix beam search in NumPy, with an optional word level LM
+
+    Parameters
+    ----------
+    probs: numpy array
+        (B, T, C) or (T, C) probabilities (apply `softmax` to logits first)
+    characters: str or list of str
+        character of each class index
+    lengths: numpy array, default is None
+    beam_width: int, default is 16
+    blank: int, default is 0
+    lm: callable, default is None
+        lm(words) -> natural log probability of words[-1] given words[:-1].
+        Called each time a word is completed by `space`, and for the last
+        word of the final beams. `NgramLanguageModel` can be used here.
+    alpha: float
+        LM weight
+    beta: float
+        word insertion bonus
+    space: str, default is ' '
+        word separator character
+    cutoff_top_n: int, default is 40
+        number of classes considered at each time step
+    cutoff_prob: float, default is 1.0
+        classes are considered until their cumulative probability reaches
+        this value
+
+    Returns
+    -------
+    texts: list of str
+    scores: numpy array
+        (B,) log score of the best beam of each sequence
+    """
+    probs, lengths = _as_batch(probs, lengths)
+    characters = list(characters)
+    space_index = characters.index(space) if space in characters else -1
+
+    texts = []
+    scores = np.zeros(len(probs), np.float32)
+    for b, (p, length) in enumerate(zip(probs, lengths)):
+        log_probs = np.log(np.maximum(p[:length], 1e-30))
+        text, score = _prefix_beam_search_one(
+            log_probs, characters, beam_width, blank, lm, alpha, beta,
+            space_index, _candidates(log_probs, cutoff_top_n, cutoff_prob),
+        )
+        texts.append(text)
+        scores[b] = score
+    return texts, scores
+
+
+def _prefix_beam_search_one(
+        log_probs, characters, beam_width, blank, lm, alpha, beta,
+        space_index, candidates,
+):
+    """
+    All beams are extended at once: the (K, C) extension scores are
+    computed with array ops, extensions reproducing an existing beam are
+    merged into it by a rolling hash of the prefixes, and the next K beams
+    are chosen with argpartition. Only the survivors are turned into
+    Python tuples, and the LM is only queried when a word is completed.
+    """
+    word_scores = {}
+
+    def word_score(prefix, key):
+        if lm is None:
+            return 0.0
+        if key not in word_scores:
+            words = ''.join(characters[c] for c in prefix).split()
+            word_scores[key] = alpha * lm(words) + beta if words else 0.0
+        return word_scores[key]
+
+    n_class = log_probs.shape[1]
+    classes = np.arange(n_class)
+    prefixes = [()]
+    p_b = np.zeros(1)
+    p_nb = np.full(1, -np.inf)
+    lm_scores = np.zeros(1)
+    last = np.full(1, -1)
+    hashes = np.zeros(1, np.uint64)
+
+    for lp, mask in zip(log_probs, candidates):
+        n_beam = len(prefixes)
+        total = np.logaddexp(p_b, p_nb)
+
+        # keep the prefix: end in blank, or repeat the last label
+        stay_b = total + lp[blank] if mask[blank] else np.full(n_beam, -np.inf)
+        stay_nb = np.where(
+            (last >= 0) & mask[np.maximum(last, 0)],
+            p_nb + lp[np.maximum(last, 0)], -np.inf,
+        )
+
+        # extend the prefix with a label (repeats need a blank in between)
+        ext_class = classes[mask & (classes != blank)]
+        ext = np.where(
+            ext_class[np.newaxis, :] == last[:, np.newaxis],
+            p_b[:, np.newaxis], total[:, np.newaxis],
+        ) + lp[ext_class][np.newaxis, :]
+        ext_hash = hashes[:, np.newaxis] * _HASH_BASE + \
+            (ext_class + 1).astype(np.uint64)[np.newaxis, :]
+
+        # extensions equal to an existing beam are merged into it
+        order = np.argsort(hashes)
+        pos = np.minimum(np.searchsorted(hashes[order], ext_hash), n_beam - 1)
+        same = hashes[order][pos] == ext_hash
+        if same.any():
+            np.logaddexp.at(stay_nb, order[pos[same]], ext[same])
+            ext[same] = -np.inf
+
+        ext_lm = np.repeat(lm_scores[:, np.newaxis], len(ext_class), axis=1)
+        if lm is not None and space_index in ext_class:
+            col = np.searchsorted(ext_class, space_index)
+            for k in np.nonzero((last >= 0) & (last != space_index))[0]:
+                ext_lm[k, col] += word_score(prefixes[k], int(hashes[k]))
+
+        scores = np.concatenate([
+            np.logaddexp(stay_b, stay_nb) + lm_scores,
+            (ext + ext_lm).ravel(),
+        ])
+        n_valid = np.count_nonzero(scores > -np.inf)
+        n_next = min(beam_width, n_valid)
+        top = np.argpartition(-scores, n_next - 1)[:n_next] \
+            if n_next < len(scores) else np.nonzero(scores > -np.inf)[0]
+
+        sk = top[top < n_beam]
+        ek, ej = np.divmod(top[top >= n_beam] - n_beam, max(len(ext_class), 1))
+        ec = ext_class[ej]
+
+        prefixes = [prefixes[k] for k in sk] + \
+            [prefixes[k] + (int(c),) for k, c in zip(ek, ec)]
+        p_b = np.concatenate([stay_b[sk], np.full(len(ek), -np.inf)])
+        p_nb = np.concatenate([stay_nb[sk], ext[ek, ej]])
+        lm_scores = np.concatenate([lm_scores[sk], ext_lm[ek, ej]])
+        last = np.concatenate([last[sk], ec])
+        hashes = np.concatenate([hashes[sk], ext_hash[ek, ej]])
+
+    final = np.logaddexp(p_b, p_nb) + lm_scores
+    for k, prefix in enumerate(prefixes):
+        if prefix and prefix[-1] != space_index:
+            final[k] += word_score(prefix, int(hashes[k]))
+    best = int(np.argmax(final))
+    return ''.join(characters[c] for c in prefixes[best]), float(final[best])
@@ -0,0 +1,215 @@
+import math
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def view_rotation(elev, azim):
+    """
+    Rotation of a matplotlib `view_init(elev, azim)` camera
+
+    Returns
+    -------
+    R: numpy array
+        read-only (3, 3) float32, its columns are the screen right, the
+        screen up and the direction toward the viewer, in data coordinates
+    """
+    e, a = math.radians(elev), math.radians(azim)
+    R = np.array([
+        [-math.sin(a), -math.sin(e) * math.cos(a), math.cos(e) * math.cos(a)],
+        [math.cos(a), -math.sin(e) * math.sin(a), math.cos(e) * math.sin(a)],
+        [0, math.cos(e), math.sin(e)],
+    ], dtype=np.float32)
+    R.flags.writeable = False
+    return R
+
+
+@lru_cache(maxsize=None)
+def _fit_scale(elev, azim, width, height, margin):
+    # scale of the unit cube, centered in the canvas
+    corners = np.array(
+        [[x, y, z] for x in (-.5, .5) for y in (-.5, .5) for z in (-.5, .5)],
+        dtype=np.float32)
+    span = np.ptp(corners @ view_rotation(elev, azim)[:, :2], axis=0)
+    return min(
+        width * (1 - 2 * margin) / span[0],
+        height * (1 - 2 * margin) / span[1],
+    )
+
+
+class SkeletonRenderer3d:
+    """
+    Headless 3D skeleton plot drawn with OpenCV, a fast replacement of a
+    matplotlib 3D axes for video.
+
+    The camera follows the matplotlib conventions: the z axis is up, the
+    view is set by `elev` and `azim` in degrees, and the data box given by
+    `limits` is scaled to a cube (a reversed limit flips its axis). The
+    whole projection is one (3, 3) matrix and an offset, computed once for
+    fixed limits. The background with the floor grid is cached too, so a
+    frame costs a matrix product, a sort and the cv2 drawing calls.
+
+    Parameters
+    ----------
+    canvas_size: (int, int)
+        height, width
+    elev, azim: float
+        camera elevation and azimuth, as `Axes3D.view_init`
+    limits: ((float, float), (float, float), (float, float)), default is None
+        x, y, z limits. If None, `fit` must be called before drawing.
+    margin: float, default is 0.1
+        canvas margin, ratio of the canvas size
+    background: color, default is white
+    grid: int, default is 4
+        floor grid divisions, 0 to disable. Only drawn for fixed limits.
+    grid_color: color
+    """
+
+    def __init__(
+            self, canvas_size, elev=30, azim=-60, limits=None,
+            margin=0.1, background=(255, 255, 255), grid=4,
+            grid_color=(192, 192, 192),
+    ):
+        self.height, self.width = canvas_size
+        self.elev, self.azim = elev, azim
+        self.R = view_rotation(float(elev), float(azim))
+        self.scale = _fit_scale(
+            float(elev), float(azim), self.width, self.height, margin)
+        self.limits = None if limits is None else \
+            np.array(limits, dtype=np.float32).reshape(3, 2)
+
+        self.canvas = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.canvas[:] = background
+        self.A = self.b = None
+        if self.limits is not None:
+            self.A, self.b = self._camera(self.limits)
+            if grid > 0:
+                self._draw_grid(self.canvas, grid, grid_color)
+
+    def _camera(self, limits):
+        center = limits.mean(axis=1)
+        extent = limits[:, 1] - limits[:, 0]
+        extent[extent == 0] = 1
+
+        # data -> (x, y, depth) of the canvas, y is down
+        A = self.R / extent[:, np.newaxis] * \
+            np.array([self.scale, -self.scale, 1], dtype=np.float32)
+        b = np.array(
+            [self.width / 2, self.height / 2, 0], dtype=np.float32
+        ) - center @ A
+        return A, b
+
+    def _draw_grid(self, img, grid, color):
+        (x0, x1), (y0, y1), (z0, _) = self.limits
+        t = np.linspace(0, 1, grid + 1, dtype=np.float32)
+        xs, ys = x0 + (x1 - x0) * t, y0 + (y1 - y0) * t
+        lines = np.concatenate([
+            np.stack([
+                np.stack([xs, np.full_like(xs, y0), np.full_like(xs, z0)], 1),
+                np.stack([xs, np.full_like(xs, y1), np.full_like(xs, z0)], 1),
+            ], 1),
+            np.stack([
+                np.stack([np.full_like(ys, x0), ys, np.full_like(ys, z0)], 1),
+                np.stack([np.full_like(ys, x1), ys, np.full_like(ys, z0)], 1),
+            ], 1),
+        ])
+        uv = np.round(self.project(lines)[..., :2]).astype(np.int32)
+        for p1, p2 in uv.tolist():
+            cv2.line(img, tuple(p1), tuple(p2), color, 1, cv2.LINE_AA)
+
+    def project(self, points):
+        """
+        Canvas coordinates of 3D points
+
+        Parameters
+        ----------
+        points: numpy array
+            (..., 3)
+
+        Returns
+        -------
+        uvd: numpy array
+            (..., 3) float32, canvas x, canvas y and depth toward the
+            viewer (larger is nearer)
+        """
+        if self.A is None:
+            raise ValueError('no camera limits, call fit() first')
+        return np.asarray(points, dtype=np.float32) @ self.A + self.b
+
+    def fit(self, points):
+        """
+        Set the camera to an equal aspect box around the points, for
+        renderers without fixed limits
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        if len(points) == 0:
+            return
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        half = max(float(np.max(hi - lo)), 1e-6) / 2
+        center = (lo + hi) / 2
+        self.A, self.b = self._camera(
+            np.stack([center - half, center + half], axis=1))
+
+    def draw(
+            self, img, points, edges, colors, visible=None,
+            thickness=2, radius=3, point_colors=None,
+    ):
+        """
+        Draw the skeletons of several persons, far edges first
+
+        Parameters
+        ----------
+        img: numpy array
+            (H, W, 3) canvas, drawn in place
+        points: numpy array
+            (N, J, 3) or (J, 3) joints
+        edges: numpy array
+            (E, 2) joint index pairs
+        colors: color or list of colors
+            one color, or the color of each edge
+        visible: numpy array, default is None
+            (N, J) or (J,) bool, edges with an invisible joint are skipped
+        thickness: int
+        radius: int
+            joint marker radius, 0 to disable
+        point_colors: color, default is None
+            joint marker color, the edge color if None
+        """
+        points = np.asarray(points, dtype=np.float32)
+        points = points.reshape((-1,) + points.shape[-2:])
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if points.shape[0] == 0 or len(edges) == 0:
+            return img
+        colors = np.broadcast_to(
+            np.asarray(colors, dtype=np.float64).reshape(-1, 3),
+            (len(edges), 3))
+
+        segments = self.project(points)[:, edges]  # (N, E, 2, 3)
+        ok = np.ones(segments.shape[:2], dtype=bool)
+        if visible is not None:
+            visible = np.asarray(visible).reshape(points.shape[:2]) > 0
+            ok = visible[:, edges].all(axis=2)
+
+        # painter's algorithm on the mean depth of the edges
+        n, e = np.nonzero(ok)
+        order = np.argsort(segments[n, e, :, 2].mean(axis=1), kind='stable')
+        n, e = n[order], e[order]
+        uv = np.round(segments[n, e, :, :2]).astype(np.int32).tolist()
+
+        for (p1, p2), color in zip(uv, colors[e].tolist()):
+            p1, p2 = tuple(p1), tuple(p2)
+            cv2.line(img, p1, p2, color, thickness, cv2.LINE_AA)
+            if radius > 0:
+                c = color if point_colors is None else point_colors
+                cv2.circle(img, p1, radius, c, -1, cv2.LINE_AA)
+                cv2.circle(img, p2, radius, c, -1, cv2.LINE_AA)
+        return img
+
+    def render(self, points, edges, colors, **kwargs):
+        """Same as `draw`, on a new copy of the cached background"""
+        return self.draw(self.canvas.copy(), points, edges, colors, **kwargs)
@@ -0,0 +1,221 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+
+def _pair(x):
+    return (x, x) if np.isscalar(x) else tuple(x)
+
+
+def blend_window(height, width, overlap_h, overlap_w, blend='feather'):
+    """
+    Weight of each pixel of a tile when overlapping tiles are recomposed
+
+    Parameters
+    ----------
+    height, width: int
+        tile size
+    overlap_h, overlap_w: int
+        overlap between neighbouring tiles
+    blend: string
+        - 'feather': linear ramp over the overlap, no seams
+        - 'uniform': plain average of the overlapping tiles
+
+    Returns
+    -------
+    weight: numpy array
+        (height, width) float32
+    """
+    def ramp(size, overlap):
+        if blend == 'uniform' or overlap <= 0:
+            return np.ones(size, dtype=np.float32)
+        i = np.arange(size, dtype=np.float32) + 0.5
+        return np.minimum(1.0, np.minimum(i, size - i) / overlap)
+
+    if blend not in ('feather', 'uniform'):
+        raise ValueError(f'unknown blend window: {blend}')
+    return np.outer(
+        ramp(height, overlap_h), ramp(width, overlap_w)
+    ).astype(np.float32)
+
+
+def tile_grid(height, width, tile_size, overlap=0):
+    """
+    Number of tiles covering an image, and the padded image size
+
+    Returns
+    -------
+    tile_y, tile_x: int
+    padded_h, padded_w: int
+    """
+    tile_h, tile_w = _pair(tile_size)
+    overlap_h, overlap_w = _pair(overlap)
+    stride_h, stride_w = tile_h - overlap_h, tile_w - overlap_w
+    tile_y = max(-(-(height - overlap_h) // stride_h), 1)
+    tile_x = max(-(-(width - overlap_w) // stride_w), 1)
+    return (
+        tile_y, tile_x,
+        tile_y * stride_h + overlap_h, tile_x * stride_w + overlap_w,
+    )
+
+
+def tile_view(img, tile_size, overlap=0):
+    """
+    Tiles of a (C, H, W) image as a view, without copy
+
+    Parameters
+    ----------
+    img: numpy array
+        (C, H, W), H and W already padded with `tile_grid`
+    tile_size: int or (int, int)
+    overlap: int or (int, int)
+
+    Returns
+    -------
+    tiles: numpy array
+        read-only (tile_y, tile_x, C, tile_h, tile_w) view of img
+    """
+    tile_h, tile_w = _pair(tile_size)
+    overlap_h, overlap_w = _pair(overlap)
+    stride_h, stride_w = tile_h - overlap_h, tile_w - overlap_w
+    c, h, w = img.shape
+    sc, sh, sw = img.strides
+    return as_strided(
+        img,
+        shape=(
+            (h - tile_h) // stride_h + 1, (w - tile_w) // stride_w + 1,
+            c, tile_h, tile_w,
+        ),
+        strides=(sh * stride_h, sw * stride_w, sc, sh, sw),
+        writeable=False,
+    )
+
+
+def tiles_in_flight(tile_bytes, memory_budget=MEMORY_BUDGET, batch_size=None):
+    """Number of tiles computed at once, within the memory budget"""
+    n = max(int(memory_budget // max(tile_bytes, 1)), 1)
+    if batch_size is not None:
+        n = min(n, max(batch_size, 1))
+    return n
+
+
+def iter_tiled_rows(
+        img, predict, tile_size, overlap=0, scale=1, blend='feather',
+        batch_size=None, memory_budget=MEMORY_BUDGET, pad_mode='reflect',
+):
+    """
+    Run a patch based model over an image of any size, and recompose the
+    outputs of the overlapping tiles with a blend window.
+
+    The tiles are read from a strided view of the padded image, and
+    given to `predict` by batches. The outputs are accumulated in a band
+    one tile row high, and the output rows which no later tile can reach
+    are yielded as soon as their tile row is done, so memory use does not
+    depend on the image height.
+
+    Parameters
+    ----------
+    img: numpy array
+        (C, H, W) input, converted to float32
+    predict: callable
+        predict(tiles) -> outputs, tiles is (N, C, tile_h, tile_w) and
+        outputs is (N, C_out, tile_h * scale, tile_w * scale)
+    tile_size: int or (int, int)
+        model input size
+    overlap: int or (int, int), default is 0
+        overlap between tiles in input pixels, at most half a tile
+    scale: int, default is 1
+        output size / input size of the model
+    blend: string, default is 'feather'
+        blend window, see `blend_window`
+    batch_size: int, default is None
+        maximum number of tiles per predict, otherwise only limited by
+        memory_budget
+    memory_budget: int
+        bytes of input and output tiles in flight
+    pad_mode: string, default is 'reflect'
+        numpy.pad mode of the image border
+
+    Yields
+    ------
+    top: int
+        first output row
+    rows: numpy array
+        (C_out, n_rows, W * scale) float32 recomposed rows
+    """
+    img = np.asarray(img, dtype=np.float32)
+    c, h, w = img.shape
+    tile_h, tile_w = _pair(tile_size)
+    overlap_h, overlap_w = _pair(overlap)
+    overlap_h = min(max(overlap_h, 0), tile_h // 2)
+    overlap_w = min(max(overlap_w, 0), tile_w // 2)
+
+    tile_y, tile_x, padded_h, padded_w = tile_grid(
+        h, w, (tile_h, tile_w), (overlap_h, overlap_w))
+    pad_img = np.pad(
+        img, ((0, 0), (0, padded_h - h), (0, padded_w - w)), mode=pad_mode)
+    tiles = tile_view(pad_img, (tile_h, tile_w), (overlap_h, overlap_w))
+
+    out_h, out_w = tile_h * scale, tile_w * scale
+    out_stride_h = (tile_h - overlap_h) * scale
+    out_stride_w = (tile_w - overlap_w) * scale
+    weight = blend_window(
+        out_h, out_w, overlap_h * scale, overlap_w * scale, blend)
+
+    # input and output of a tile, output channels assumed as many as input
+    tile_bytes = 4 * c * tile_h * tile_w * (1 + scale * scale)
+    n_batch = tiles_in_flight(tile_bytes, memory_budget, batch_size)
+    logger.debug(f'{tile_y}x{tile_x} tiles, {n_batch} tiles per predict')
+
+    band = band_weight = None
+    n_tiles = tile_y * tile_x
+    for k0 in range(0, n_tiles, n_batch):
+        index = range(k0, min(k0 + n_batch, n_tiles))
+        preds = predict(np.stack([tiles[k // tile_x, k % tile_x] for k in index]))
+
+        if band is None:
+            band = np.zeros(
+                (preds.shape[1], out_h, padded_w * scale), dtype=np.float32)
+            band_weight = np.zeros(band.shape[1:], dtype=np.float32)
+
+        for k, pred in zip(index, preds):
+            y, x = divmod(k, tile_x)
+            sx = x * out_stride_w
+            band[:, :, sx:sx + out_w] += pred * weight
+            band_weight[:, sx:sx + out_w] += weight
+            if x < tile_x - 1:
+                continue
+
+            # the tile row is done
+            top = y * out_stride_h
+            n = min(out_h if y == tile_y - 1 else out_stride_h, h * scale - top)
+            if n > 0:
+                yield top, \
+                    band[:, :n, :w * scale] / band_weight[:n, :w * scale]
+
+            rest = out_h - out_stride_h
+            band[:, :rest] = band[:, out_stride_h:]
+            band[:, rest:] = 0
+            band_weight[:rest] = band_weight[out_stride_h:]
+            band_weight[rest:] = 0
+
+
+def tiled_inference(img, predict, tile_size, overlap=0, scale=1, **kwargs):
+    """
+    Same as `iter_tiled_rows`, returns the whole (C_out, H * scale,
+    W * scale) float32 output
+    """
+    h, w = img.shape[1:]
+    output = None
+    for top, rows in iter_tiled_rows(
+            img, predict, tile_size, overlap, scale, **kwargs):
+        if output is None:
+            output = np.zeros(
+                (rows.shape[0], h * scale, w * scale), dtype=np.float32)
+        output[:, top:top + rows.shape[1]] = rows
+    return output
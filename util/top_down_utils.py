@@ -0,0 +1,280 @@
+import cv2
+import numpy as np
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+
+def _pair(x):
+    return (x, x) if np.isscalar(x) else tuple(x)
+
+
+def box_scales(boxes, input_size):
+    """
+    Image pixels per input pixel of each box
+
+    Parameters
+    ----------
+    boxes: numpy array
+        (N, 4) x1, y1, x2, y2 in image pixels, x2 and y2 excluded
+    input_size: int or (int, int)
+        height, width of the crops
+
+    Returns
+    -------
+    scales: numpy array
+        (N, 2) float32, x and y
+    """
+    height, width = _pair(input_size)
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return (boxes[:, 2:] - boxes[:, :2]) / np.array(
+        [width, height], dtype=np.float32)
+
+
+def crop_boxes(img, boxes, input_size, border_value=0):
+    """
+    Crops of several boxes of an image, resized to the same input size
+
+    The sampling grids of all the boxes are stacked and read with a single
+    bilinear cv2.remap, instead of one crop and resize per box. Pixel
+    centers are aligned as cv2.resize, and the part of a box outside the
+    image is filled with `border_value`. When all the boxes are
+    downscaled, the image is first reduced once with INTER_AREA by the
+    smallest factor, so small crops of large boxes are not aliased.
+
+    Parameters
+    ----------
+    img: numpy array
+        (H, W) or (H, W, C) image
+    boxes: numpy array
+        (N, 4) x1, y1, x2, y2 in image pixels, x2 and y2 excluded
+    input_size: int or (int, int)
+        height, width of the crops
+    border_value: int or float, default is 0
+
+    Returns
+    -------
+    crops: numpy array
+        (N, height, width) + img.shape[2:], same dtype as img
+    scales: numpy array
+        (N, 2) float32, image pixels per crop pixel, see `to_image_coords`
+    """
+    height, width = _pair(input_size)
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scales = box_scales(boxes, (height, width))
+    n = len(boxes)
+    if n == 0:
+        return np.zeros((0, height, width) + img.shape[2:], img.dtype), scales
+
+    src = np.ascontiguousarray(img)
+    factor = float(scales.min())
+    ratio = np.ones(2, dtype=np.float32)
+    if factor > 1:
+        h, w = src.shape[:2]
+        small_w = max(int(round(w / factor)), 1)
+        small_h = max(int(round(h / factor)), 1)
+        src = cv2.resize(src, (small_w, small_h), interpolation=cv2.INTER_AREA)
+        ratio = np.array([small_w / w, small_h / h], dtype=np.float32)
+
+    # pixel centers of the crops in image pixels, kept within the box
+    # pixels (the edges are replicated as cv2.resize), then in source pixels
+    xs = np.arange(width, dtype=np.float32) + 0.5
+    ys = np.arange(height, dtype=np.float32) + 0.5
+    map_x = np.clip(
+        xs[np.newaxis] * scales[:, [0]] + boxes[:, [0]] - 0.5,
+        boxes[:, [0]], np.maximum(boxes[:, [2]] - 1, boxes[:, [0]]))
+    map_y = np.clip(
+        ys[np.newaxis] * scales[:, [1]] + boxes[:, [1]] - 0.5,
+        boxes[:, [1]], np.maximum(boxes[:, [3]] - 1, boxes[:, [1]]))
+    map_x = (map_x + 0.5) * ratio[0] - 0.5
+    map_y = (map_y + 0.5) * ratio[1] - 0.5
+    map_x = np.broadcast_to(map_x[:, np.newaxis, :], (n, height, width))
+    map_y = np.broadcast_to(map_y[:, :, np.newaxis], (n, height, width))
+
+    crops = cv2.remap(
+        src,
+        np.ascontiguousarray(map_x).reshape(n * height, width),
+        np.ascontiguousarray(map_y).reshape(n * height, width),
+        cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=border_value,
+    )
+    return crops.reshape((n, height, width) + img.shape[2:]), scales
+
+
+def to_image_coords(points, boxes, scales):
+    """
+    Crop pixel coordinates (N, K, 2) to image pixel coordinates
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return (points + 0.5) * scales[:, np.newaxis] + \
+        boxes[:, np.newaxis, :2] - 0.5
+
+
+def heatmap_argmax(heatmaps):
+    """
+    Peak of each heatmap, moved by a quarter pixel toward the higher
+    neighbour (as SimpleBaseline)
+
+    Parameters
+    ----------
+    heatmaps: numpy array
+        (N, K, H, W)
+
+    Returns
+    -------
+    coords: numpy array
+        (N, K, 2) float32 x, y in heatmap pixels
+    maxvals: numpy array
+        (N, K) float32
+    """
+    n, k, h, w = heatmaps.shape
+    flat = heatmaps.reshape(n, k, -1)
+    idx = np.argmax(flat, axis=2)
+    maxvals = np.take_along_axis(flat, idx[..., np.newaxis], 2)[..., 0]
+    py, px = np.divmod(idx, w)
+    coords = np.stack([px, py], axis=-1).astype(np.float32)
+
+    inner = (1 < px) & (px < w - 1) & (1 < py) & (py < h - 1)
+    xp, xm = np.minimum(px + 1, w - 1), np.maximum(px - 1, 0)
+    yp, ym = np.minimum(py + 1, h - 1), np.maximum(py - 1, 0)
+    ni, ki = np.ogrid[:n, :k]
+    diff = np.stack([
+        heatmaps[ni, ki, py, xp] - heatmaps[ni, ki, py, xm],
+        heatmaps[ni, ki, yp, px] - heatmaps[ni, ki, ym, px],
+    ], axis=-1)
+    coords += np.where(inner[..., np.newaxis], np.sign(diff) * .25, 0)
+
+    coords *= (maxvals > 0)[..., np.newaxis]
+    return coords, maxvals.astype(np.float32)
+
+
+def soft_argmax(heatmaps, radius=2):
+    """
+    Sub-pixel peak of each heatmap: mean position of the positive values
+    in a (2 * radius + 1) window around the maximum, for all heatmaps at
+    once
+
+    Parameters
+    ----------
+    heatmaps: numpy array
+        (N, K, H, W)
+    radius: int, default is 2
+
+    Returns
+    -------
+    coords: numpy array
+        (N, K, 2) float32 x, y in heatmap pixels
+    maxvals: numpy array
+        (N, K) float32
+    """
+    n, k, h, w = heatmaps.shape
+    flat = heatmaps.reshape(n, k, -1)
+    idx = np.argmax(flat, axis=2)
+    maxvals = np.take_along_axis(flat, idx[..., np.newaxis], 2)[..., 0]
+    py, px = np.divmod(idx, w)
+
+    offset = np.arange(-radius, radius + 1)
+    wy = py[..., np.newaxis] + offset  # (N, K, R)
+    wx = px[..., np.newaxis] + offset
+    valid = ((0 <= wy) & (wy < h))[..., :, np.newaxis] & \
+        ((0 <= wx) & (wx < w))[..., np.newaxis, :]
+    ni, ki = np.ogrid[:n, :k]
+    window = heatmaps[
+        ni[..., np.newaxis, np.newaxis], ki[..., np.newaxis, np.newaxis],
+        np.clip(wy, 0, h - 1)[..., :, np.newaxis],
+        np.clip(wx, 0, w - 1)[..., np.newaxis, :],
+    ]
+    weight = np.where(valid, np.maximum(window, 0), 0).astype(np.float32)
+
+    total = weight.sum(axis=(2, 3))
+    ok = total > 0
+    total = np.where(ok, total, 1)
+    x = (weight.sum(axis=2) * wx).sum(axis=2) / total
+    y = (weight.sum(axis=3) * wy).sum(axis=2) / total
+    coords = np.where(
+        ok[..., np.newaxis],
+        np.stack([x, y], axis=-1), np.stack([px, py], axis=-1),
+    )
+    return coords.astype(np.float32), maxvals.astype(np.float32)
+
+
+class TopDownPoseEstimator:
+    """
+    Top-down pose estimation of all the boxes of an image at once: one
+    crop pass (`crop_boxes`), one predict for all the crops, and one
+    heatmap decoding pass.
+
+    Parameters
+    ----------
+    net: ailia.Net
+        (N, C, H, W) input, (N, K, h, w) heatmaps output
+    input_size: (int, int)
+        height, width of the net input
+    mean, std: list of float
+        normalization of the 0-1 pixel values, per channel
+    decode: string, default is 'soft_argmax'
+        'soft_argmax' or 'argmax' (quarter pixel refinement)
+    batch_size: int, default is None
+        maximum number of crops per predict, all at once if None
+    """
+
+    def __init__(
+            self, net, input_size, mean=(0, 0, 0), std=(1, 1, 1),
+            decode='soft_argmax', batch_size=None,
+    ):
+        if decode not in ('soft_argmax', 'argmax'):
+            raise ValueError(f'unknown heatmap decoding: {decode}')
+        self.net = net
+        self.input_size = _pair(input_size)
+        self.mean = np.asarray(mean, dtype=np.float32) * 255
+        self.std = np.asarray(std, dtype=np.float32) * 255
+        self.decode = soft_argmax if decode == 'soft_argmax' else heatmap_argmax
+        self.batch_size = batch_size
+        self.input_shape = None
+
+    def _predict(self, x):
+        if x.shape != self.input_shape:
+            self.net.set_input_shape(x.shape)
+            self.input_shape = x.shape
+        return self.net.predict(x)
+
+    def predict(self, img, boxes):
+        """
+        Parameters
+        ----------
+        img: numpy array
+            (H, W, C) uint8 image, in the channel order of the net
+        boxes: numpy array
+            (N, 4) x1, y1, x2, y2 in image pixels
+
+        Returns
+        -------
+        keypoints: numpy array
+            (N, K, 2) float32 x, y in image pixels
+        scores: numpy array
+            (N, K) float32 heatmap maximum
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if len(boxes) == 0:
+            return np.zeros((0, 0, 2), np.float32), np.zeros((0, 0), np.float32)
+
+        crops, scales = crop_boxes(img, boxes, self.input_size)
+        x = ((crops - self.mean) / self.std).astype(np.float32)
+        x = x.transpose(0, 3, 1, 2)
+
+        n_batch = self.batch_size or len(x)
+        heatmaps = np.concatenate([
+            self._predict(np.ascontiguousarray(x[i:i + n_batch]))
+            for i in range(0, len(x), n_batch)
+        ])
+
+        coords, scores = self.decode(heatmaps)
+
+        # heatmap -> crop pixels
+        stride = np.array([
+            self.input_size[1] / heatmaps.shape[3],
+            self.input_size[0] / heatmaps.shape[2],
+        ], dtype=np.float32)
+        coords = (coords + 0.5) * stride - 0.5
+        return to_image_coords(coords, boxes, scales), scores